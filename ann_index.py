@@ -0,0 +1,133 @@
+# ann_index.py - IVF approximate nearest-neighbour search over a VectorIndex matrix
+import os
+import numpy as np
+
+
+class IVFIndex:
+    """Inverted-file index: a k-means coarse quantizer plus one row list per centroid.
+
+    A query scores only the rows in the `nprobe` lists whose centroids are
+    closest to it. Raising nprobe trades latency for recall; nprobe >= nlist
+    is equivalent to exact search.
+    """
+
+    def __init__(self, nlist=None, nprobe=8, min_train=4096, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train = min_train
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        self._lists = []
+        self._arrays = []
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def needs_training(self, size):
+        """Train once the index is big enough, then again each time it quadruples"""
+        if size < self.min_train:
+            return False
+        return not self.trained or size >= 4 * self.trained_size
+
+    def train(self, vectors, iterations=10):
+        """Spherical k-means on a sample of the (unit-length) vectors"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        nlist = self.nlist or int(min(1024, max(16, 4 * np.sqrt(len(vectors)))))
+        nlist = min(nlist, len(vectors))
+        rng = np.random.default_rng(self.seed)
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), 64 * nlist), replace=False)]
+
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            # Re-seed empty clusters from random sample points
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            norms[empty] = 1.0
+            centroids = sums / norms
+
+        self.centroids = centroids.astype(np.float32)
+        self.trained_size = len(vectors)
+        self._lists = [[] for _ in range(len(centroids))]
+        self._arrays = [None] * len(centroids)
+
+    def assign(self, vectors, batch=65536):
+        """Nearest centroid for each vector"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), batch):
+            labels[start:start + batch] = np.argmax(vectors[start:start + batch] @ self.centroids.T, axis=1)
+        return labels
+
+    def add(self, rows, vectors=None, labels=None):
+        """Insert rows (positions in the owning matrix) into their lists"""
+        if labels is None:
+            labels = self.assign(vectors)
+        for row, label in zip(np.asarray(rows).tolist(), np.asarray(labels).tolist()):
+            self._lists[label].append(row)
+            self._arrays[label] = None
+
+    def remap(self, new_of_old):
+        """Renumber rows after the owning matrix was compacted; -1 drops a row"""
+        for label, rows in enumerate(self._lists):
+            if rows:
+                mapped = new_of_old[np.asarray(rows)]
+                self._lists[label] = mapped[mapped >= 0].tolist()
+                self._arrays[label] = None
+
+    def labels(self, n):
+        """List id of each of the first n rows, -1 where unassigned"""
+        labels = np.full(n, -1, dtype=np.int32)
+        for label, rows in enumerate(self._lists):
+            if rows:
+                labels[np.asarray(rows)] = label
+        return labels
+
+    def _array(self, label):
+        if self._arrays[label] is None:
+            self._arrays[label] = np.asarray(self._lists[label], dtype=np.int64)
+        return self._arrays[label]
+
+    def probe(self, query, nprobe=None):
+        """Candidate rows from the lists nearest the (unit-length) query"""
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        closeness = self.centroids @ query
+        if nprobe < len(closeness):
+            nearest = np.argpartition(closeness, -nprobe)[-nprobe:]
+        else:
+            nearest = np.arange(len(closeness))
+        arrays = [self._array(label) for label in nearest if self._lists[label]]
+        return np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int64)
+
+    # --- Persistence ---
+
+    def save(self, path, keys, labels, generation=0):
+        """Persist centroids plus the list of each row, identified by a stable key"""
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, centroids=self.centroids, keys=np.asarray(keys, dtype=np.int64),
+                 labels=np.asarray(labels, dtype=np.int32), generation=generation,
+                 trained_size=self.trained_size)
+        os.replace(tmp, path)
+
+    def load(self, path, keys, generation=0):
+        """Restore centroids and return saved list ids for `keys` (-1 where unknown)"""
+        with np.load(path) as saved:
+            self.centroids = saved["centroids"]
+            self.trained_size = int(saved["trained_size"])
+            self._lists = [[] for _ in range(len(self.centroids))]
+            self._arrays = [None] * len(self.centroids)
+            keys = np.asarray(keys, dtype=np.int64)
+            labels = np.full(len(keys), -1, dtype=np.int32)
+            if int(saved["generation"]) != generation or len(saved["keys"]) == 0:
+                return labels
+            order = np.argsort(saved["keys"])
+            saved_keys, saved_labels = saved["keys"][order], saved["labels"][order]
+        pos = np.clip(np.searchsorted(saved_keys, keys), 0, len(saved_keys) - 1)
+        found = saved_keys[pos] == keys
+        labels[found] = saved_labels[pos[found]]
+        return labels
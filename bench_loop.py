@@ -0,0 +1,229 @@
+# bench_loop.py - End-to-end loop throughput benchmark over recorded model responses
+#
+# Runs the planner -> reviewer -> execute -> reflector -> memory pipeline the
+# way server_v2.js does, against planner.py, reviewer.py, reflector_v2.py and
+# memory_v2.py served in-process with LLM_BACKEND=replay (see llm_backend.py).
+# Approved steps are not executed: executor.py runs each as `sleep --exec-ms`,
+# scheduled by the plan's depends_on like the real ones.
+#
+# Record some real loops first (LLM_BACKEND=record in the services' environment),
+# then: python3 bench_loop.py --loops 200 --concurrency 4 [--latency-ms 800 --failure-rate 0.02]
+# --stream pipelines the planner's NDJSON steps into the reviewer as server_v2.js
+# does; "plan" is then the time to the last planned step and "review" the rest.
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import http.client
+import tempfile
+import threading
+
+OUT_DIR = "data/benchmarks"
+HERE = os.path.dirname(os.path.abspath(__file__))
+STAGES = ("memory_query", "plan", "review", "execute", "reflect", "memory_add")
+SERVICES = {"memory_v2": 10004, "planner": 10005, "reviewer": 10001, "reflector_v2": 10002}
+MISSION = "Continuously improve the agent's own reliability and performance."
+
+
+def start_services():
+    """Serve each agent in this process on an ephemeral port; returns {service: port}"""
+    from service import BoundedThreadingHTTPServer
+    ports = {}
+    for name in SERVICES:
+        module = __import__(name)
+        handler = type(f"Quiet{name}", (module.H,), {"log_message": lambda self, *args: None})
+        server = BoundedThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.handle_error = lambda request, address: None  # failures are counted by the client
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        ports[name] = server.server_address[1]
+    return ports
+
+
+def plan_and_review_stream(ports, model, context):
+    """(plan, review, seconds until the plan was complete) with steps streamed from planner to reviewer"""
+    plan_conn = http.client.HTTPConnection("127.0.0.1", ports["planner"], timeout=300)
+    review_conn = http.client.HTTPConnection("127.0.0.1", ports["reviewer"], timeout=300)
+    try:
+        began = time.perf_counter()
+        plan_conn.request("POST", "/_py/plan", body=json.dumps({"model": model, "context": context, "stream": True}),
+                          headers={"Content-Type": "application/json"})
+        plan_response = plan_conn.getresponse()
+        result = {}
+
+        def body():
+            yield (json.dumps({"type": "start", "model": model}) + "\n").encode("utf-8")
+            for line in plan_response:
+                message = json.loads(line)
+                if message["type"] == "step":
+                    yield (json.dumps({"type": "step", "step": message["step"]}) + "\n").encode("utf-8")
+                elif message["type"] == "plan":
+                    result["plan"], result["plan_seconds"] = message["plan"], time.perf_counter() - began
+                    yield (json.dumps({"type": "plan", "plan": {k: message["plan"].get(k) for k in ("spec_md", "todo_md")}})
+                           + "\n").encode("utf-8")
+
+        review_conn.request("POST", "/_py/review", body=body(), encode_chunked=True,
+                            headers={"Content-Type": "application/x-ndjson", "Transfer-Encoding": "chunked"})
+        response = review_conn.getresponse()
+        review = json.loads(response.read())
+        if response.status != 200 or "plan" not in result:
+            raise RuntimeError(f"stream failed: HTTP {response.status}")
+        return result["plan"], review, result["plan_seconds"]
+    finally:
+        plan_conn.close()
+        review_conn.close()
+
+
+def run_loop(clients, loop_id, args, timings):
+    """One loop; appends (stage, seconds) to timings and returns the failed stage or None"""
+    stage = "memory_query"
+    try:
+        elapsed, memories = clients["memory_v2"].post("/_py/query", {"query": MISSION, "top_k": 3})
+        timings.append((stage, elapsed))
+        context = (f"Current Mission: {MISSION}\nLoop Number: {loop_id}\n---\nRelevant long-term memories:\n"
+                   + "\n".join(f"- {m['text'][:200]}..." for m in memories.get("results", [])))
+
+        if args.stream:
+            stage = "plan"
+            began = time.perf_counter()
+            plan, review, plan_seconds = plan_and_review_stream(args.ports, args.model, context)
+            timings.append(("plan", plan_seconds))
+            timings.append(("review", time.perf_counter() - began - plan_seconds))
+        else:
+            stage = "plan"
+            elapsed, plan = clients["planner"].post("/_py/plan", {"model": args.model, "context": context})
+            timings.append((stage, elapsed))
+
+            stage = "review"
+            elapsed, review = clients["reviewer"].post("/_py/review", dict(plan, model=args.model))
+            timings.append((stage, elapsed))
+
+        stage = "execute"
+        approved = (review.get("approved_steps") or [])[:args.max_steps]
+        began = time.perf_counter()
+        if args.exec_ms and approved:
+            from executor import execute
+            execute([dict(s, bash=f"sleep {args.exec_ms / 1000:.3f}") for s in approved],
+                    policy_path=os.path.join(HERE, "exec_policy.json"))
+        report = "# Execution Report\n\n" + "\n".join(f"- {s.get('title', '')}: simulated" for s in approved)
+        timings.append((stage, time.perf_counter() - began))
+
+        stage = "reflect"
+        prompt = (f"Plan Summary:\n{plan.get('spec_md', '')}\n\nReviewer Summary:\n{review.get('summary_md', '')}\n\n"
+                  f"Execution Report:\n{report}")
+        elapsed, reflection = clients["reflector_v2"].post("/_py/reflect", {"model": args.model, "prompt": prompt})
+        timings.append((stage, elapsed))
+
+        stage = "memory_add"
+        elapsed, _ = clients["memory_v2"].post("/_py/add_batch", {"documents": [
+            {"id": f"report_{loop_id}", "text": report, "source": "bench"},
+            {"id": f"reflection_{loop_id}", "text": reflection.get("reflection_md", ""), "source": "bench"}]})
+        timings.append((stage, elapsed))
+        return None
+    except Exception:
+        return stage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end loop benchmark with replayed model responses")
+    parser.add_argument("--loops", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=1, help="loops in flight at once")
+    parser.add_argument("--model", default="gemini-1.5-pro-latest")
+    parser.add_argument("--recordings", default="data/llm_recordings")
+    parser.add_argument("--latency-ms", type=float, default=None, help="synthetic latency per model call")
+    parser.add_argument("--jitter-ms", type=float, default=None)
+    parser.add_argument("--latency-scale", type=float, default=None, help="multiple of the recorded latency")
+    parser.add_argument("--ms-per-char", type=float, default=None, help="generation time per output character")
+    parser.add_argument("--failure-rate", type=float, default=None, help="fraction of model calls that fail")
+    parser.add_argument("--exec-ms", type=float, default=0, help="simulated execution time per approved step")
+    parser.add_argument("--max-steps", type=int, default=int(os.environ.get("MAX_APPROVED_STEPS_PER_LOOP", "7")))
+    parser.add_argument("--stream", action="store_true", help="pipeline streamed plan steps into review")
+    parser.add_argument("--external", action="store_true",
+                        help="use services already running on their usual ports instead of in-process ones")
+    parser.add_argument("--out", default=None, help=f"result file (default {OUT_DIR}/loop_<time>.json)")
+    args = parser.parse_args()
+
+    out = os.path.abspath(args.out or os.path.join(OUT_DIR, f"loop_{time.strftime('%Y%m%d_%H%M%S')}.json"))
+    sys.path.insert(0, HERE)
+    from bench_memory import Client, latency_stats
+
+    workdir = None
+    if args.external:
+        ports = dict(SERVICES)
+    else:
+        # Replay settings are read when llm_backend is imported, so set them first
+        os.environ["LLM_BACKEND"] = "replay"
+        os.environ["LLM_RECORDINGS_DIR"] = os.path.abspath(args.recordings)
+        for flag, var in (("latency_ms", "LLM_REPLAY_LATENCY_MS"), ("jitter_ms", "LLM_REPLAY_JITTER_MS"),
+                          ("latency_scale", "LLM_REPLAY_LATENCY_SCALE"), ("ms_per_char", "LLM_REPLAY_MS_PER_CHAR"),
+                          ("failure_rate", "LLM_REPLAY_FAILURE_RATE")):
+            if getattr(args, flag) is not None:
+                os.environ[var] = str(getattr(args, flag))
+        os.environ.setdefault("MEMORY_COMPRESSION_THRESHOLD", "0")
+        import llm_backend
+        if not len(llm_backend.recordings):
+            sys.exit(f"No recordings in {args.recordings}; run the services with LLM_BACKEND=record first")
+        # Memory writes go to a scratch store, not the agent's real memory
+        workdir = tempfile.mkdtemp(prefix="bench_loop_")
+        os.chdir(workdir)
+        ports = start_services()
+
+    args.ports = ports
+    timings, failures, lock = [], {}, threading.Lock()
+    next_loop = iter(range(1, args.loops + 1))
+
+    def worker():
+        clients = {name: Client(port) for name, port in ports.items()}
+        local = []
+        while True:
+            with lock:
+                loop_id = next(next_loop, None)
+            if loop_id is None:
+                break
+            failed = run_loop(clients, 1000000 + loop_id, args, local)
+            if failed:
+                with lock:
+                    failures[failed] = failures.get(failed, 0) + 1
+        with lock:
+            timings.extend(local)
+
+    print(f"Running {args.loops} loops, {args.concurrency} at a time...", flush=True)
+    began = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(max(1, args.concurrency))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - began
+
+    completed = args.loops - sum(failures.values())
+    result = {"started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "config": {k: v for k, v in vars(args).items() if k not in ("out", "ports")},
+              "env": {k: v for k, v in os.environ.items() if k.startswith(("LLM_", "GEMINI_", "MEMORY_", "PY_SERVICE_"))},
+              "wall_seconds": wall, "completed": completed, "failed": failures,
+              "loops_per_min": completed / wall * 60 if wall else 0,
+              "stages": {stage: latency_stats([t for s, t in timings if s == stage]) for stage in STAGES}}
+    if not args.external:
+        import llm_backend
+        from gemini_client import gemini
+        result["llm"] = dict(llm_backend.stats)
+        result["gemini"] = gemini.stats()
+
+    print(f"{completed}/{args.loops} loops in {wall:.1f}s = {result['loops_per_min']:.1f} loops/min"
+          + (f", failed stages: {failures}" if failures else ""))
+    for stage in STAGES:
+        stats = result["stages"][stage]
+        if stats:
+            print(f"  {stage:<13} p50 {stats['p50_ms']:8.1f} ms  p95 {stats['p95_ms']:8.1f} ms  p99 {stats['p99_ms']:8.1f} ms")
+
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"Wrote {out}")
+    if workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
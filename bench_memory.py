@@ -0,0 +1,289 @@
+# bench_memory.py - Offline benchmarks for the memory services (memory.py / memory_v2.py)
+#
+# Embeddings come from a deterministic local stand-in, so no API calls are made.
+# Each (service, size) runs in a fresh subprocess and a scratch directory, which
+# keeps peak RSS and on-disk size per run. Results are written as JSON to
+# data/benchmarks/ and can be diffed against an earlier run with --compare.
+#
+# Usage: python3 bench_memory.py [--services memory_v2,memory] [--sizes 1000,10000,100000]
+#                                [--dim 768] [--embedding hash|random] [--compare previous.json]
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import http.client
+import numpy as np
+
+SERVICES = ("memory_v2", "memory")
+OUT_DIR = "data/benchmarks"
+WORDS = ("plan", "review", "deploy", "failed", "retry", "disk", "network", "cache", "build", "test",
+         "timeout", "permission", "install", "package", "service", "restart", "memory", "loop", "lesson", "error")
+
+
+class FakeEmbedder:
+    """Deterministic stand-in for get_embedding / get_embeddings.
+
+    "hash" seeds each vector from the text, so the same text always embeds the
+    same way (queries can be repeated across runs); "random" draws from one
+    seeded stream, which is faster for bulk loads.
+    """
+
+    def __init__(self, dim=768, mode="hash", seed=0):
+        self.dim = dim
+        self.mode = mode
+        self.rng = np.random.default_rng(seed)
+        self.calls = 0
+
+    def vectors(self, texts):
+        self.calls += 1
+        if self.mode == "random":
+            return self.rng.standard_normal((len(texts), self.dim), dtype=np.float32)
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            out[i] = np.random.default_rng(seed).standard_normal(self.dim, dtype=np.float32)
+        return out
+
+    def get_embedding(self, text, task_type="RETRIEVAL_DOCUMENT"):
+        return self.vectors([text])[0].tolist()
+
+    def get_embeddings(self, texts, task_type="RETRIEVAL_DOCUMENT"):
+        return [v.tolist() for v in self.vectors(texts)]
+
+
+def make_text(i):
+    rng = np.random.default_rng(i)
+    return f"loop {i}: " + " ".join(WORDS[w] for w in rng.integers(0, len(WORDS), 24))
+
+
+def latency_stats(samples, count=None):
+    """Throughput and p50/p95/p99 (ms) for a list of per-operation durations in seconds"""
+    samples = np.asarray(samples, dtype=np.float64)
+    if not len(samples):
+        return {}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1000
+    return {"ops": int(count or len(samples)), "seconds": float(samples.sum()),
+            "per_sec": float((count or len(samples)) / max(samples.sum(), 1e-9)),
+            "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+
+def disk_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class Client:
+    """Keep-alive JSON client; reconnects transparently when the server closes"""
+
+    def __init__(self, port):
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+
+    def post(self, path, payload):
+        body = json.dumps(payload).encode("utf-8")
+        start = time.perf_counter()
+        try:
+            self.conn.request("POST", path, body, {"Content-Type": "application/json"})
+            response = self.conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            raise
+        elapsed = time.perf_counter() - start
+        if response.status != 200:
+            raise RuntimeError(f"{path} returned {response.status}: {data[:200]}")
+        return elapsed, json.loads(data or b"{}")
+
+
+def start_server(module):
+    from http.server import HTTPServer
+    if module.__name__ == "memory_v2":
+        from service import BoundedThreadingHTTPServer as server_class
+    else:
+        server_class = HTTPServer
+    server = server_class(("127.0.0.1", 0), module.H)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def reset(module):
+    """Forget the open store/index, as a process restart would"""
+    module._store = None
+    if hasattr(module, "_index"):
+        module._index = None
+
+
+def run_one(service, size, args):
+    """Benchmark one service at one size; runs inside its own scratch directory"""
+    # Compression is measured as its own phase instead of firing during the load
+    os.environ["MEMORY_COMPRESSION_THRESHOLD"] = "0"
+    module = __import__(service)
+    embedder = FakeEmbedder(args.dim, args.embedding, args.seed)
+    module.get_embedding = embedder.get_embedding
+    if hasattr(module, "get_embeddings"):
+        module.get_embeddings = embedder.get_embeddings
+    if hasattr(module, "extract_patterns"):
+        module.extract_patterns = lambda memories: "benchmark pattern"
+
+    result = {"service": service, "size": size, "phases": {}}
+    phases = result["phases"]
+    singles = min(args.adds, size)
+    bulk = size - singles
+
+    # Bulk load in batches: add_documents for memory_v2, the store directly for memory.py
+    samples = []
+    for start in range(0, bulk, args.batch):
+        ids = range(start, min(start + args.batch, bulk))
+        docs = [{"id": f"report_{i}", "text": make_text(i)} for i in ids]
+        began = time.perf_counter()
+        if service == "memory_v2":
+            module.add_documents(docs)
+        else:
+            module.get_store().add_many(docs, embedder.get_embeddings([d["text"] for d in docs]))
+        samples.append(time.perf_counter() - began)
+    phases["batch_add"] = dict(latency_stats(samples, bulk), batch=args.batch)
+
+    server = start_server(module)
+    client = Client(server.server_address[1])
+
+    samples = [client.post("/_py/add", {"id": f"report_{i}", "text": make_text(i)})[0]
+               for i in range(bulk, size)]
+    phases["add"] = latency_stats(samples)
+
+    queries = [make_text(size + i) for i in range(args.queries)]
+    samples = [client.post("/_py/query", {"query": q, "top_k": args.top_k})[0] for q in queries]
+    phases["query"] = latency_stats(samples)
+    result["disk_bytes"] = disk_bytes(module.STORE_DIR)
+
+    reset(module)
+    elapsed, _ = client.post("/_py/query", {"query": queries[0], "top_k": args.top_k})
+    phases["restart"] = {"first_query_ms": elapsed * 1000}
+
+    # Store compaction: tombstone a quarter of the entries and rewrite the live rows
+    store = module.get_store()
+    store.delete([f"report_{i}" for i in range(0, size, 4)])
+    began = time.perf_counter()
+    store.compact()
+    phases["compact"] = {"seconds": time.perf_counter() - began, "live": len(store)}
+
+    if hasattr(module, "compress_memories"):
+        began = time.perf_counter()
+        module.compress_memories(module.load_memory())
+        phases["compress"] = {"seconds": time.perf_counter() - began, "live": len(module.get_store())}
+
+    server.shutdown()
+    result["disk_bytes_final"] = disk_bytes(module.STORE_DIR)
+    result["peak_rss_mb"] = peak_rss_mb()
+    result["embed_calls"] = embedder.calls
+    return result
+
+
+def run_child(service, size, args):
+    workdir = tempfile.mkdtemp(prefix=f"bench_{service}_{size}_", dir=args.workdir)
+    here = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable, os.path.abspath(__file__), "--child", service, str(size),
+               "--dim", str(args.dim), "--embedding", args.embedding, "--seed", str(args.seed),
+               "--batch", str(args.batch), "--adds", str(args.adds), "--queries", str(args.queries),
+               "--top-k", str(args.top_k)]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+    try:
+        proc = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            return {"service": service, "size": size, "error": proc.stderr.strip().splitlines()[-1:]}
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(current, previous_file):
+    """Print per-metric ratios (current / previous) for runs present in both files"""
+    with open(previous_file, 'r') as f:
+        previous = {(r["service"], r["size"]): r for r in json.load(f)["results"]}
+    for run in current["results"]:
+        old = previous.get((run["service"], run["size"]))
+        if not old or "phases" not in run or "phases" not in old:
+            continue
+        print(f"{run['service']} @ {run['size']}:")
+        for phase in ("batch_add", "add", "query"):
+            for metric in ("per_sec", "p50_ms", "p99_ms"):
+                new_value = run["phases"].get(phase, {}).get(metric)
+                old_value = old["phases"].get(phase, {}).get(metric)
+                if new_value and old_value:
+                    print(f"  {phase}.{metric}: {old_value:.2f} -> {new_value:.2f} ({new_value / old_value:.2f}x)")
+        print(f"  peak_rss_mb: {old['peak_rss_mb']:.0f} -> {run['peak_rss_mb']:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline memory service benchmarks")
+    parser.add_argument("--services", default="memory_v2,memory")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma-separated entry counts, e.g. 1000,10000,100000,1000000")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--embedding", choices=("hash", "random"), default="hash")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch", type=int, default=1000, help="documents per bulk add")
+    parser.add_argument("--adds", type=int, default=200, help="single adds over HTTP (last entries of each size)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--workdir", default=None, help="where scratch stores are created")
+    parser.add_argument("--keep", action="store_true", help="keep scratch stores")
+    parser.add_argument("--out", default=None, help=f"result file (default {OUT_DIR}/memory_<time>.json)")
+    parser.add_argument("--compare", default=None, help="earlier result file to compare against")
+    parser.add_argument("--child", nargs=2, metavar=("SERVICE", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_one(args.child[0], int(args.child[1]), args)))
+        return
+
+    services = [s for s in args.services.split(",") if s]
+    unknown = set(services) - set(SERVICES)
+    if unknown:
+        parser.error(f"unknown services: {', '.join(sorted(unknown))}")
+    sizes = [int(float(s)) for s in args.sizes.split(",") if s]
+
+    report = {"started": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+              "config": {k: v for k, v in vars(args).items() if k not in ("child", "compare", "out")},
+              "env": {k: v for k, v in os.environ.items() if k.startswith("MEMORY_")},
+              "results": []}
+    for service in services:
+        for size in sizes:
+            print(f"Benchmarking {service} with {size} entries...", flush=True)
+            run = run_child(service, size, args)
+            report["results"].append(run)
+            if "error" in run:
+                print(f"  failed: {run['error']}")
+                continue
+            phases = run["phases"]
+            print(f"  batch_add {phases['batch_add'].get('per_sec', 0):.0f}/s, "
+                  f"add p50 {phases['add'].get('p50_ms', 0):.2f} ms, "
+                  f"query p50/p99 {phases['query']['p50_ms']:.2f}/{phases['query']['p99_ms']:.2f} ms, "
+                  f"restart {phases['restart']['first_query_ms']:.0f} ms, "
+                  f"rss {run['peak_rss_mb']:.0f} MB, disk {run['disk_bytes'] / 1e6:.1f} MB")
+
+    out = args.out or os.path.join(OUT_DIR, f"memory_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {out}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
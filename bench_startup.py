@@ -0,0 +1,136 @@
+# bench_startup.py - Cold-start time and resident memory of the Python agents
+#
+# Compares the six agent processes (`separate`, as Dockerfile_v2 used to start
+# them) with service_host.py serving all of them from one process (`host`).
+# Each run starts the agents in a scratch directory with LLM_BACKEND=replay and
+# measures:
+#   ready_ms   until every agent port answers GET /_py/llm/stats
+#   warm_ms    until one request has gone through each agent route (which
+#              imports the agent in the host; model calls fail fast, as there
+#              are no recordings, and still count)
+#   rss_mb     summed resident memory of the processes, when ready and when warm
+# Results are written to data/benchmarks/ as JSON.
+#
+# Usage: python3 bench_startup.py [--modes separate,host] [--repeats 3]
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+import http.client
+
+OUT_DIR = "data/benchmarks"
+HERE = os.path.dirname(os.path.abspath(__file__))
+AGENTS = {"reviewer": 10001, "reflector_v2": 10002, "strategist_v2": 10003,
+          "memory_v2": 10004, "planner": 10005, "system_agent": 10006}
+# One request per agent: (port, method, path, body)
+WARM_REQUESTS = [
+    (10001, "POST", "/_py/review", {"steps": []}),
+    (10002, "POST", "/_py/reflect", {"prompt": "startup"}),
+    (10003, "POST", "/_py/strategize", {"prompt": "startup"}),
+    (10004, "POST", "/_py/query", {"query": "startup", "top_k": 1}),
+    (10005, "POST", "/_py/plan", {"context": "startup"}),
+    (10006, "POST", "/_py/failures/screen", {"steps": ["true"]}),
+]
+
+
+def request(port, method, path, body=None, timeout=30):
+    """HTTP status, or None if the connection failed or closed without a response"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        payload = json.dumps(body).encode("utf-8") if body is not None else None
+        conn.request(method, path, body=payload, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    except (OSError, http.client.HTTPException):
+        return None
+    finally:
+        conn.close()
+
+
+def rss_mb(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status", 'r') as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        except (OSError, StopIteration):
+            pass
+    return total / 1024
+
+
+def start(mode, workdir, env):
+    if mode == "host":
+        commands = [[sys.executable, os.path.join(HERE, "service_host.py")]]
+    else:
+        commands = [[sys.executable, os.path.join(HERE, f"{agent}.py")] for agent in AGENTS]
+    return [subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            for command in commands]
+
+
+def run_once(mode, timeout):
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    env = dict(os.environ, LLM_BACKEND="replay", LLM_RECORDINGS_DIR=os.path.join(workdir, "recordings"),
+               PYTHONDONTWRITEBYTECODE="1")
+    began = time.perf_counter()
+    procs = start(mode, workdir, env)
+    try:
+        pending = set(AGENTS.values())
+        while pending:
+            if time.perf_counter() - began > timeout:
+                raise RuntimeError(f"{mode}: ports {sorted(pending)} not ready after {timeout}s")
+            if any(p.poll() is not None for p in procs):
+                raise RuntimeError(f"{mode}: an agent process exited during startup")
+            pending = {port for port in pending if request(port, "GET", "/_py/llm/stats", timeout=1) != 200}
+            if pending:
+                time.sleep(0.01)
+        ready = time.perf_counter() - began
+        pids = [p.pid for p in procs]
+        ready_rss = rss_mb(pids)
+        for port, method, path, body in WARM_REQUESTS:
+            request(port, method, path, body)
+        warm = time.perf_counter() - began
+        return {"ready_ms": ready * 1000, "warm_ms": warm * 1000, "rss_mb_ready": ready_rss,
+                "rss_mb_warm": rss_mb(pids), "processes": len(procs)}
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agent cold-start time and memory: separate processes vs one host")
+    parser.add_argument("--modes", default="separate,host")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for the agents to come up")
+    parser.add_argument("--out", default=None, help=f"result file (default {OUT_DIR}/startup_<time>.json)")
+    args = parser.parse_args()
+    out = args.out or os.path.join(OUT_DIR, f"startup_{time.strftime('%Y%m%d_%H%M%S')}.json")
+
+    result = {"started": time.strftime("%Y-%m-%dT%H:%M:%S"), "config": vars(args), "modes": {}}
+    for mode in args.modes.split(","):
+        runs = [run_once(mode, args.timeout) for _ in range(args.repeats)]
+        summary = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+        result["modes"][mode] = {"median": summary, "runs": runs}
+        print(f"{mode:<9} ready {summary['ready_ms']:7.0f} ms  warm {summary['warm_ms']:7.0f} ms  "
+              f"RSS {summary['rss_mb_ready']:6.1f} MB ready, {summary['rss_mb_warm']:6.1f} MB warm  "
+              f"({summary['processes']:.0f} processes)")
+
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"Wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# command_matcher.py - Shell-aware command normalization and near-duplicate lookup for FailureDB
+import re
+import zlib
+import heapq
+import numpy as np
+
+OPERATORS = {"|", "||", "&&", ";", "&"}
+# A token is an operator, or a word made of unquoted runs, escapes and quoted strings
+# (a stray quote is kept literally; "&" directly after a redirect stays in the word: 2>&1)
+TOKEN_RE = re.compile(r"""(\|\||&&|[|;&])|((?:[^\s'"|;&\\]+|\\.?|'[^']*'|"(?:[^"\\]|\\.)*"|['"]|(?<=[<>])&)+)""")
+UNQUOTE_RE = re.compile(r"""'([^']*)'|"((?:[^"\\]|\\.)*)"|\\(.)""")
+URL_RE = re.compile(r'^[a-zA-Z][\w+.-]*://\S+$')
+PATH_RE = re.compile(r'^(~|\.{1,2}(/|$)|/)|/')
+NUM_RE = re.compile(r'\d+')
+SHORT_FLAGS_RE = re.compile(r'^-[A-Za-z]{2,}$')
+ASSIGNMENT_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*=')
+MAX_KEY = 200
+
+NUM_PERM = 32
+BANDS = 8
+MAX_VERIFY = 16  # candidates sharing the most bands get an exact similarity check
+_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.default_rng(1)
+_PERM_A = _rng.integers(1, 1 << 31, NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, 1 << 31, NUM_PERM, dtype=np.uint64)
+
+
+def _unquote(match):
+    return next(group for group in match.groups() if group is not None)
+
+
+def tokenize(command):
+    """Shell tokens with quotes removed and operators (| && ; ...) split out"""
+    return [op or UNQUOTE_RE.sub(_unquote, word) for op, word in TOKEN_RE.findall(command)]
+
+
+def _normalize_arg(token):
+    if URL_RE.match(token):
+        return "<URL>"
+    if PATH_RE.search(token):
+        return "<PATH>"
+    return NUM_RE.sub("<NUM>", token)
+
+
+def _normalize_flag(token):
+    name, eq, value = token.partition("=")
+    return NUM_RE.sub("<NUM>", name) + (eq + _normalize_arg(value) if eq else "")
+
+
+def normalize(command):
+    """(binary, normalized tokens) for a command line.
+
+    Paths, URLs and numbers become placeholders, combined short flags are
+    split (-la -> -a -l) and flags are sorted within each pipeline segment,
+    so quoting, flag order and spacing differences normalize the same way.
+    """
+    binary = ""
+    tokens = []
+    segment = []
+
+    def flush():
+        head = []
+        while segment and ASSIGNMENT_RE.match(segment[0]):
+            segment.pop(0)  # FOO=bar cmd ...
+        if segment:
+            head = [segment[0].rsplit("/", 1)[-1]]
+        flags, args = [], []
+        for token in segment[1:]:
+            if SHORT_FLAGS_RE.match(token):
+                flags.extend(f"-{c}" for c in token[1:])
+            elif token.startswith("-") and len(token) > 1:
+                flags.append(_normalize_flag(token))
+            else:
+                args.append(_normalize_arg(token))
+        tokens.extend(head + sorted(set(flags)) + args)
+        segment.clear()
+        return head[0] if head else ""
+
+    for token in tokenize(command):
+        if token in OPERATORS:
+            first = flush()
+            binary = binary or first
+            tokens.append(token)
+        else:
+            segment.append(token)
+    first = flush()
+    return binary or first, tokens
+
+
+def _key(binary, tokens):
+    return f"{binary}:{' '.join(tokens)}"[:MAX_KEY]
+
+
+def pattern_key(command):
+    """Exact-match key: the first binary plus the normalized token string"""
+    return _key(*normalize(command))
+
+
+def shingles(tokens):
+    """Token unigrams and bigrams, hashed to 32 bits"""
+    grams = set(tokens)
+    grams.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    return {zlib.crc32(g.encode("utf-8")) for g in grams}
+
+
+def minhash(hashed):
+    """NUM_PERM-value MinHash signature of a set of 32-bit hashes"""
+    if not hashed:
+        return np.zeros(NUM_PERM, dtype=np.uint64)
+    values = np.fromiter(hashed, dtype=np.uint64, count=len(hashed))
+    return ((_PERM_A[:, None] * values[None, :] + _PERM_B[:, None]) % _PRIME).min(axis=1)
+
+
+class CommandIndex:
+    """Learned command patterns, looked up exactly or by near-duplicate similarity.
+
+    Exact keys live in a dict. Near-duplicates are found with MinHash LSH over
+    token shingles (BANDS bands of NUM_PERM/BANDS rows), restricted to patterns
+    with the same first binary. The candidates sharing the most bands are
+    confirmed by the exact Jaccard similarity of the shingle sets.
+    """
+
+    def __init__(self, threshold=0.8):
+        self.threshold = threshold
+        self._shingles = {}     # key -> shingle set
+        self._binary_of = {}    # key -> first binary
+        self._by_binary = {}    # binary -> set of keys
+        self._buckets = {}      # (band, band hash) -> set of keys
+
+    def __len__(self):
+        return len(self._shingles)
+
+    def __contains__(self, key):
+        return key in self._shingles
+
+    @staticmethod
+    def _bands(signature):
+        rows = NUM_PERM // BANDS
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(BANDS)]
+
+    def add(self, key, command):
+        if key in self._shingles:
+            return
+        binary, tokens = normalize(command)
+        hashed = shingles(tokens)
+        self._shingles[key] = hashed
+        self._binary_of[key] = binary
+        self._by_binary.setdefault(binary, set()).add(key)
+        for bucket in self._bands(minhash(hashed)):
+            self._buckets.setdefault(bucket, set()).add(key)
+
+    def remove(self, key):
+        hashed = self._shingles.pop(key, None)
+        if hashed is None:
+            return
+        self._by_binary[self._binary_of.pop(key)].discard(key)
+        for bucket in self._bands(minhash(hashed)):
+            keys = self._buckets.get(bucket)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._buckets[bucket]
+
+    def match(self, command):
+        """(key, similarity) of the best known pattern for command, or (None, 0.0)"""
+        binary, tokens = normalize(command)
+        key = _key(binary, tokens)
+        if key in self._shingles:
+            return key, 1.0
+        same_binary = self._by_binary.get(binary)
+        if not same_binary:
+            return None, 0.0
+        hashed = shingles(tokens)
+        shared = {}
+        for bucket in self._bands(minhash(hashed)):
+            for candidate in self._buckets.get(bucket, ()):
+                if candidate in same_binary:
+                    shared[candidate] = shared.get(candidate, 0) + 1
+        best, best_similarity = None, 0.0
+        for candidate, _ in heapq.nsmallest(MAX_VERIFY, shared.items(), key=lambda item: (-item[1], item[0])):
+            other = self._shingles[candidate]
+            similarity = len(hashed & other) / len(hashed | other)
+            if similarity > best_similarity:
+                best, best_similarity = candidate, similarity
+        if best_similarity >= self.threshold:
+            return best, best_similarity
+        return None, 0.0
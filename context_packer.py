@@ -0,0 +1,248 @@
+# context_packer.py - Relevance-ranked codebase context for the system agent
+#
+# Source files are split into units: Python functions, methods, class bodies
+# and module-level code via ast; JS/shell files at top-level function and route
+# boundaries. Each unit's summary and term counts are cached by content hash.
+# A run ranks the units against the failure text (BM25-style term overlap, plus
+# units that a traceback points into, plus units changed since the previous
+# run), then packs whole units into the token budget in rank order. Units that
+# do not fit are listed by their one-line summary while room remains.
+import os
+import re
+import ast
+import json
+import math
+import hashlib
+from collections import Counter
+
+TOKEN_BUDGET = int(os.environ.get("SYSTEM_AGENT_CONTEXT_TOKENS", "4000"))
+CHARS_PER_TOKEN = 4
+TERM_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+TRACEBACK_RE = re.compile(r'File "([^"]+)", line (\d+)')
+BOUNDARY_RE = re.compile(r"^(?:(?:async\s+)?function\s+(\w+)|app\.\w+\(\s*'([^']+)'|(\w+)\s*\(\)\s*\{|// --- (.+?) ---)")
+STOPWORDS = {"self", "def", "return", "import", "from", "none", "true", "false", "the", "and", "for", "not",
+             "with", "this", "that", "class", "else", "elif", "try", "except", "const", "let", "await", "async",
+             "function", "data", "str", "int", "get"}
+SUMMARY_SHARE = 0.2     # of the budget kept for one-line summaries of the units left out
+TRACEBACK_BOOST = 10.0  # a traceback line inside the unit
+CHANGED_BOOST = 1.0     # edited since the previous run
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def terms(text):
+    """Lower-cased identifiers, plus the parts of snake_case and camelCase ones"""
+    counts = Counter()
+    for word in TERM_RE.findall(text):
+        parts = {word} | set(word.split("_")) | set(re.findall(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])", word))
+        for part in parts:
+            part = part.lower()
+            if len(part) >= 3 and part not in STOPWORDS:
+                counts[part] += 1
+    return counts
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:20]
+
+
+def _unit(path, name, start, end, lines, summary):
+    code = "".join(lines[start - 1:end])
+    return {"id": f"{path}:{name}", "path": path, "name": name, "start": start, "end": end,
+            "code": code, "sha": _digest(code), "summary": summary}
+
+
+def _rest(path, name, start, end, lines, covered, summary):
+    """Lines of [start, end] outside the covered spans, as one unit (None if only blank lines remain)"""
+    keep = [n for n in range(start, end + 1) if not any(a <= n <= b for a, b in covered)]
+    code = "".join(lines[n - 1] for n in keep)
+    if not code.strip():
+        return None
+    return {"id": f"{path}:{name}", "path": path, "name": name, "start": start, "end": end,
+            "code": code, "sha": _digest(code), "summary": summary}
+
+
+def _signature(node, lines):
+    """First line of a def/class plus the first docstring line"""
+    line = lines[node.lineno - 1].strip()
+    doc = ast.get_docstring(node)
+    return f"{line} {doc.splitlines()[0]}" if doc else line
+
+
+def _span(node):
+    return min([d.lineno for d in getattr(node, "decorator_list", [])] + [node.lineno]), node.end_lineno
+
+
+def python_units(path, source):
+    lines = source.splitlines(keepends=True)
+    tree = ast.parse(source)
+    units, covered = [], []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            start, end = _span(node)
+            units.append(_unit(path, node.name, start, end, lines, _signature(node, lines)))
+            covered.append((start, end))
+        elif isinstance(node, ast.ClassDef):
+            start, end = _span(node)
+            methods = []
+            for child in node.body:
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    m_start, m_end = _span(child)
+                    units.append(_unit(path, f"{node.name}.{child.name}", m_start, m_end, lines,
+                                       _signature(child, lines)))
+                    methods.append((m_start, m_end))
+            head = _rest(path, node.name, start, end, lines, methods, _signature(node, lines))
+            if head:
+                units.append(head)
+            covered.append((start, end))
+    module = _rest(path, "<module>", 1, len(lines), lines, covered,
+                   next((l.strip() for l in lines if l.strip()), path))
+    if module:
+        units.append(module)
+    return units
+
+
+def text_units(path, source):
+    """JS/shell: one unit per top-level function, route or section comment"""
+    lines = source.splitlines(keepends=True)
+    starts = [(1, "<top>")]
+    for n, line in enumerate(lines, 1):
+        match = BOUNDARY_RE.match(line)
+        if match:
+            starts.append((n, next(g for g in match.groups() if g)))
+    units = []
+    for i, (start, name) in enumerate(starts):
+        end = starts[i + 1][0] - 1 if i + 1 < len(starts) else len(lines)
+        if end >= start and "".join(lines[start - 1:end]).strip():
+            if any(u["name"] == name for u in units):
+                name = f"{name}@{start}"
+            units.append(_unit(path, name, start, end, lines, lines[start - 1].strip()))
+    return units
+
+
+class ContextPacker:
+    """Splits files into units once per content hash and packs the relevant ones into a budget.
+
+    state_path keeps the unit cache (summary and term counts by unit hash) and
+    each unit's hash as of the previous run, so unchanged code is not re-parsed
+    and changed code can be put first.
+    """
+
+    def __init__(self, files, state_path="data/context_packer.json"):
+        self.files = files
+        self.state_path = state_path
+        self._parsed = {}  # path -> (file hash, units)
+        self.cache, self.last_run = {}, {}
+        if os.path.exists(state_path):
+            try:
+                with open(state_path, 'r') as f:
+                    state = json.load(f)
+                self.cache, self.last_run = state.get("cache", {}), state.get("last_run", {})
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable context state {state_path}: {e}")
+
+    def units(self):
+        result = []
+        for path in self.files:
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', errors="replace") as f:
+                source = f.read()
+            file_sha = _digest(source)
+            parsed = self._parsed.get(path)
+            if parsed is None or parsed[0] != file_sha:
+                try:
+                    units = python_units(path, source) if path.endswith(".py") else text_units(path, source)
+                except SyntaxError:
+                    units = text_units(path, source)
+                parsed = self._parsed[path] = (file_sha, units)
+            result.extend(parsed[1])
+        for unit in result:
+            if unit["sha"] not in self.cache:
+                self.cache[unit["sha"]] = {"summary": unit["summary"][:160],
+                                           "terms": terms(unit["name"] + "\n" + unit["code"])}
+        return result
+
+    def rank(self, units, query):
+        """[(score, unit)] best first"""
+        query_terms = terms(query)
+        df = Counter()
+        for unit in units:
+            df.update(self.cache[unit["sha"]]["terms"].keys())
+        n = len(units)
+        hits = {}
+        for path, line in TRACEBACK_RE.findall(query):
+            hits.setdefault(os.path.basename(path), set()).add(int(line))
+
+        ranked = []
+        for unit in units:
+            unit_terms = self.cache[unit["sha"]]["terms"]
+            score = 0.0
+            for term in query_terms:
+                tf = unit_terms.get(term, 0)
+                if tf:
+                    score += math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5)) * tf / (tf + 1.2)
+            lines = hits.get(os.path.basename(unit["path"]), ())
+            if any(unit["start"] <= line <= unit["end"] for line in lines):
+                score += TRACEBACK_BOOST
+            if self.last_run and self.last_run.get(unit["id"]) != unit["sha"]:
+                score += CHANGED_BOOST
+            ranked.append((score, unit))
+        ranked.sort(key=lambda item: -item[0])
+        return ranked
+
+    def _render(self, unit, full):
+        if full:
+            return f"# --- {unit['name']} (lines {unit['start']}-{unit['end']}) ---\n{unit['code']}"
+        return f"# {unit['name']}: {self.cache[unit['sha']]['summary']}\n"
+
+    def pack(self, query, budget=TOKEN_BUDGET):
+        """(context text, stats): relevant units in full, then summaries, in source order per file"""
+        units = self.units()
+        ranked = self.rank(units, query)
+        chosen, paths, used = {}, set(), 0  # unit id -> shown in full
+
+        def take(unit, full, limit):
+            nonlocal used
+            cost = estimate_tokens(self._render(unit, full))
+            if unit["path"] not in paths:
+                cost += estimate_tokens(f"\n=== {unit['path']} ===\n")
+            if used + cost > limit:
+                return
+            chosen[unit["id"]] = full
+            paths.add(unit["path"])
+            used += cost
+
+        for score, unit in ranked:
+            if score > 0:  # unrelated and unchanged since the last run: summary at most
+                take(unit, True, budget * (1 - SUMMARY_SHARE))
+        for score, unit in ranked:
+            if unit["id"] not in chosen:
+                take(unit, False, budget)
+
+        parts, current = [], None
+        for unit in units:
+            if unit["id"] not in chosen:
+                continue
+            if unit["path"] != current:
+                current = unit["path"]
+                parts.append(f"\n=== {current} ===\n")
+            parts.append(self._render(unit, chosen[unit["id"]]))
+        text = "".join(parts)
+        full = [i for i, f in chosen.items() if f]
+        stats = {"units": len(units), "full": len(full), "summarized": len(chosen) - len(full),
+                 "changed": sum(self.last_run.get(u["id"]) != u["sha"] for u in units) if self.last_run else len(units),
+                 "tokens": estimate_tokens(text), "budget": budget}
+        self.last_run = {unit["id"]: unit["sha"] for unit in units}
+        self.cache = {unit["sha"]: self.cache[unit["sha"]] for unit in units}  # drop stale entries
+        self.save()
+        return text, stats
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, 'w') as f:
+            f.write(json.dumps({"cache": self.cache, "last_run": self.last_run}))
+        os.replace(tmp, self.state_path)
@@ -0,0 +1,135 @@
+# embedding_cache.py - Content-addressed embedding cache in front of the embedding API
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class EmbeddingCache:
+    """Two-tier cache keyed by sha256(model, task type, text).
+
+    Tier 1 is an in-process LRU; tier 2 is one raw float32 file per key under
+    cache_dir, trimmed oldest-first once it grows past max_disk_bytes.
+    """
+
+    def __init__(self, cache_dir="data/embedding_cache", max_entries=4096, max_disk_bytes=256 * 1048576):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model, task_type, text):
+        return hashlib.sha256(f"{model}\0{task_type}\0{text}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.f32")
+
+    def _remember(self, key, embedding):
+        with self._lock:
+            self._memory[key] = embedding
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, model, task_type, text):
+        """Return the cached embedding as a list of floats, or None"""
+        key = self.key(model, task_type, text)
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return embedding
+
+        path = self._path(key)
+        try:
+            embedding = np.fromfile(path, dtype=np.float32).tolist()
+            os.utime(path)  # keeps recently used files out of eviction
+        except OSError:
+            embedding = None
+        if embedding:
+            self._remember(key, embedding)
+            with self._lock:
+                self.disk_hits += 1
+            return embedding
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, model, task_type, text, embedding):
+        if not embedding:
+            return
+        key = self.key(model, task_type, text)
+        self._remember(key, list(embedding))
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = np.asarray(embedding, dtype=np.float32).tobytes()
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._disk_lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(data)
+            if self.disk_bytes() > self.max_disk_bytes:
+                self.evict()
+
+    def _files(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        files = []
+        for shard in os.scandir(self.cache_dir):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".f32"):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def disk_bytes(self):
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(size for _, size, _ in self._files())
+        return self._disk_bytes
+
+    def evict(self, target_ratio=0.9):
+        """Drop least recently used files until the disk tier is under target_ratio of its cap"""
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_disk_bytes * target_ratio:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_bytes": self.disk_bytes(),
+        }
+
+
+# Global instance; replayed (synthetic) embeddings are kept apart from real ones
+embedding_cache = EmbeddingCache(
+    cache_dir="data/embedding_cache_replay" if os.environ.get("LLM_BACKEND") == "replay" else "data/embedding_cache",
+    max_entries=int(os.environ.get("EMBEDDING_CACHE_ENTRIES", "4096")),
+    max_disk_bytes=int(os.environ.get("EMBEDDING_CACHE_MB", "256")) * 1048576,
+)
@@ -0,0 +1,368 @@
+# executor.py - Runs approved steps under exec_policy.json, independent steps in parallel
+#
+# A step is {id?, title, bash, cwd?, allow_net?, timeout_sec?, depends_on?}.
+#   depends_on: [ids]  start once those steps have succeeded; blocked if one of
+#                      them fails or is not among the steps being run
+#   depends_on: []     start right away
+#   no depends_on key  start after the previous step has finished, as in a
+#                      sequential plan
+# Up to EXECUTOR_WORKERS steps run at once, each in its own process group that
+# is killed when its timeout_sec (capped at EXECUTOR_MAX_TIMEOUT_SEC) runs out.
+#
+# Output is captured in bounded buffers: the first and last halves of
+# EXECUTOR_OUTPUT_CAP_BYTES per stream, with a marker where the middle was cut.
+# With a spill prefix, a stream that outgrows the cap is also written in full
+# to <prefix>step<index>_<stream>.log, named in the result.
+#
+# Read-only steps (see step_cache.py) whose files have not changed since an
+# earlier run return that run's result instantly, marked "cached": true.
+#
+# Usage: python3 executor.py [--ndjson] [--spill-prefix PATH] ['<steps json>']
+#   (steps JSON on stdin when not given) prints {"success", "failed", "steps",
+#   "final_report_md", "duration_ms"}; steps holds every result in plan order.
+#   --ndjson prints {"type": "step", ...result, "report_md"} per step as soon as
+#   it is settled, then {"type": "done", "final_report_md", "duration_ms", ...}.
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import selectors
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from step_cache import step_cache
+
+POLICY_FILE = "exec_policy.json"
+WORKERS = int(os.environ.get("EXECUTOR_WORKERS", "4"))
+DEFAULT_TIMEOUT_SEC = 60
+MAX_TIMEOUT_SEC = int(os.environ.get("EXECUTOR_MAX_TIMEOUT_SEC", "600"))
+OUTPUT_CAP_BYTES = int(os.environ.get("EXECUTOR_OUTPUT_CAP_BYTES", "16384"))
+KILL_GRACE_SEC = 2       # after a kill, how long to keep draining output
+READ_BYTES = 65536
+TIMEOUT_EXIT_CODE = 124  # what timeout(1) returns, as run_steps.sh reported it
+DENIED_EXIT_CODE = -1
+
+
+def load_policy(path=POLICY_FILE):
+    with open(path, 'r') as f:
+        policy = json.load(f)
+    return {"allow_bins": set(policy.get("allow_bins", [])),
+            "allow_net_bins": set(policy.get("allow_net_bins", [])),
+            "deny_patterns": list(policy.get("deny_patterns", []))}
+
+
+def check_policy(step, policy):
+    """None if the step may run, else why not"""
+    bash = str(step.get("bash", ""))
+    words = bash.split()
+    first = words[0] if words else ""
+    if first in policy["allow_net_bins"]:
+        if not step.get("allow_net"):
+            return f"Execution denied by policy. Command '{first}' needs the network but allow_net is not set."
+    elif first not in policy["allow_bins"]:
+        return f"Execution denied by policy. Command '{first}' is not in the allowed list."
+    for pattern in policy["deny_patterns"]:
+        if pattern in bash:
+            return f"Execution denied by policy. Command matches deny pattern '{pattern}'."
+    return None
+
+
+class OutputBuffer:
+    """The first and last cap/2 bytes of a stream plus its total size.
+
+    With a spill path, the whole stream goes to that file once it outgrows the
+    cap; nothing has been dropped up to then, so the file is complete.
+    """
+
+    def __init__(self, cap=OUTPUT_CAP_BYTES, spill_path=None):
+        self.head_cap = cap // 2
+        self.tail_cap = cap - self.head_cap
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+        self.spill_path = spill_path
+        self.spilled = None
+        self._spill = None
+
+    def write(self, data):
+        self.total += len(data)
+        if self._spill is not None:
+            self._spill.write(data)
+        room = self.head_cap - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if not data:
+            return
+        if self._spill is None and self.spill_path and len(self.tail) + len(data) > self.tail_cap:
+            os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+            self._spill = open(self.spill_path, 'wb')
+            self._spill.write(bytes(self.head) + bytes(self.tail) + data)
+            self.spilled = self.spill_path
+        self.tail += data
+        if len(self.tail) > self.tail_cap:
+            del self.tail[:len(self.tail) - self.tail_cap]
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def text(self):
+        head = self.head.decode("utf-8", "replace")
+        tail = self.tail.decode("utf-8", "replace")
+        dropped = self.total - len(self.head) - len(self.tail)
+        if dropped <= 0:
+            return head + tail
+        where = f"; full output in {self.spilled}" if self.spilled else ""
+        return f"{head}\n...[{dropped} bytes truncated{where}]...\n{tail}"
+
+
+def _kill_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run_command(bash, cwd, timeout, stdout, stderr):
+    """(exit code, timed out), feeding the output into the stdout/stderr buffers as it arrives;
+    the whole process group is killed on timeout"""
+    proc = subprocess.Popen(["bash", "-c", bash], cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, start_new_session=True)
+    deadline = time.monotonic() + timeout
+    timed_out = False
+    with selectors.DefaultSelector() as selector:
+        selector.register(proc.stdout, selectors.EVENT_READ, stdout)
+        selector.register(proc.stderr, selectors.EVENT_READ, stderr)
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if timed_out:
+                    break  # something outside the process group still holds the pipes
+                timed_out = True
+                _kill_group(proc)
+                deadline = time.monotonic() + KILL_GRACE_SEC
+                continue
+            for key, _ in selector.select(remaining):
+                data = os.read(key.fd, READ_BYTES)
+                if data:
+                    key.data.write(data)
+                else:
+                    selector.unregister(key.fileobj)
+    proc.stdout.close()
+    proc.stderr.close()
+    try:
+        proc.wait(timeout=KILL_GRACE_SEC)
+    except subprocess.TimeoutExpired:
+        _kill_group(proc)
+        proc.wait()
+    return (TIMEOUT_EXIT_CODE if timed_out else proc.returncode), timed_out
+
+
+def _result(index, step, status, exit_code, stdout="", stderr="", duration_ms=0.0):
+    return {"index": index, "id": step.get("id"), "title": step.get("title", ""), "bash": step.get("bash", ""),
+            "status": status, "exit_code": exit_code, "stdout": stdout, "stderr": stderr,
+            "duration_ms": duration_ms}
+
+
+def step_timeout(step):
+    """The step's timeout_sec, capped; the default when it is missing or not a positive number"""
+    try:
+        timeout = float(step.get("timeout_sec") or DEFAULT_TIMEOUT_SEC)
+    except (TypeError, ValueError):  # e.g. "60s" from the model
+        timeout = DEFAULT_TIMEOUT_SEC
+    if not timeout > 0:
+        timeout = DEFAULT_TIMEOUT_SEC
+    timeout = min(timeout, MAX_TIMEOUT_SEC)
+    return int(timeout) if timeout == int(timeout) else timeout
+
+
+def run_step(index, step, default_cwd, spill_prefix=None):
+    timeout = step_timeout(step)
+    cwd = step.get("cwd")
+    if not (cwd and os.path.isdir(cwd)):
+        cwd = default_cwd  # e.g. the planner's /app outside the container
+    key = step_cache.key(step, cwd)
+    if key:
+        start = time.perf_counter()
+        hit = step_cache.get(key)
+        if hit:
+            result = _result(index, step, "success" if hit["exit_code"] == 0 else "failed", hit["exit_code"],
+                             hit["stdout"], hit["stderr"], (time.perf_counter() - start) * 1000)
+            result.update(cached=True, cached_at=hit["ts"], original_duration_ms=hit["duration_ms"])
+            return result
+    buffers = {stream: OutputBuffer(spill_path=f"{spill_prefix}step{index}_{stream}.log" if spill_prefix else None)
+               for stream in ("stdout", "stderr")}
+    start = time.perf_counter()
+    try:
+        exit_code, timed_out = run_command(str(step.get("bash", "")), cwd, timeout,
+                                           buffers["stdout"], buffers["stderr"])
+    except OSError as e:
+        return _result(index, step, "failed", 127, stderr=str(e), duration_ms=(time.perf_counter() - start) * 1000)
+    finally:
+        for buffer in buffers.values():
+            buffer.close()
+    duration_ms = (time.perf_counter() - start) * 1000
+    stdout, stderr = buffers["stdout"].text(), buffers["stderr"].text()
+    if timed_out:
+        status, stderr = "timeout", f"Command timed out after {timeout} seconds.\n{stderr}"
+    else:
+        status = "success" if exit_code == 0 else "failed"
+    result = _result(index, step, status, exit_code, stdout, stderr, duration_ms)
+    result["output_bytes"] = {stream: buffer.total for stream, buffer in buffers.items()}
+    spilled = {stream: buffer.spilled for stream, buffer in buffers.items() if buffer.spilled}
+    if spilled:
+        result["artifacts"] = spilled
+    elif key and not timed_out and step_cache.key(step, cwd) == key:
+        # Only if nothing it read changed while it ran (other steps run alongside)
+        step_cache.put(key, result, time.time())
+    return result
+
+
+def dependencies(steps):
+    """Per step: (positions that must succeed first, positions that must just finish first, unknown ids)"""
+    position = {}
+    for i, step in enumerate(steps):
+        if step.get("id") is not None:
+            position.setdefault(str(step["id"]), i)
+    edges = []
+    for i, step in enumerate(steps):
+        if "depends_on" not in step:
+            edges.append((set(), {i - 1} if i else set(), []))
+            continue
+        deps = step.get("depends_on") or []
+        deps = deps if isinstance(deps, list) else [deps]
+        required = {position[str(d)] for d in deps if str(d) in position and position[str(d)] != i}
+        edges.append((required, set(), [str(d) for d in deps if str(d) not in position]))
+    return edges
+
+
+def execute_iter(steps, policy_path=POLICY_FILE, workers=WORKERS, cwd=None, spill_prefix=None):
+    """Yields each step's result as soon as it is settled (run, denied or blocked), in completion order"""
+    cwd = cwd or os.getcwd()
+    policy = load_policy(policy_path)
+    edges = dependencies(steps)
+    results = [None] * len(steps)
+    running = {}  # future -> position
+
+    try:
+        yield from _schedule(steps, policy, edges, results, running, workers, cwd, spill_prefix)
+    finally:
+        step_cache.save()
+
+    for i, step in enumerate(steps):
+        if results[i] is None:  # in a dependency cycle, or waiting on one
+            results[i] = _result(i, step, "blocked", DENIED_EXIT_CODE, stderr="Dependency cycle.")
+            yield results[i]
+
+
+def _schedule(steps, policy, edges, results, running, workers, cwd, spill_prefix):
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while True:
+            progressed = True
+            while progressed:  # settle every step that can start or be ruled out now
+                progressed = False
+                for i, step in enumerate(steps):
+                    if results[i] is not None or i in running.values():
+                        continue
+                    required, after, unknown = edges[i]
+                    if unknown:
+                        results[i] = _result(i, step, "blocked", DENIED_EXIT_CODE,
+                                             stderr=f"Depends on {', '.join(unknown)}, which is not being run.")
+                        yield results[i]
+                    elif any(results[d] is None for d in required | after):
+                        continue
+                    elif any(results[d]["status"] != "success" for d in required):
+                        failed = [results[d]["title"] for d in sorted(required) if results[d]["status"] != "success"]
+                        results[i] = _result(i, step, "blocked", DENIED_EXIT_CODE,
+                                             stderr=f"Dependency did not succeed: {', '.join(failed)}")
+                        yield results[i]
+                    else:
+                        denied = check_policy(step, policy)
+                        if denied:
+                            results[i] = _result(i, step, "denied", DENIED_EXIT_CODE, stderr=denied)
+                            yield results[i]
+                        else:
+                            running[pool.submit(run_step, i, step, cwd, spill_prefix)] = i
+                    progressed = True
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = running.pop(future)
+                try:
+                    results[i] = future.result()
+                except Exception as e:  # one broken step must not cost the others their results
+                    results[i] = _result(i, steps[i], "failed", 1, stderr=f"Executor error: {e!r}")
+                yield results[i]
+
+
+def summary(results, duration_ms):
+    """The aggregate result, results in plan order"""
+    results = sorted(results, key=lambda r: r["index"])
+    return {"success": [r for r in results if r["status"] == "success"],
+            "failed": [r for r in results if r["status"] != "success"],
+            "steps": results,
+            "final_report_md": report_md(results),
+            "duration_ms": duration_ms}
+
+
+def execute(steps, policy_path=POLICY_FILE, workers=WORKERS, cwd=None, spill_prefix=None):
+    """Run the steps; returns {"success", "failed", "steps", "final_report_md", "duration_ms"}"""
+    start = time.perf_counter()
+    results = list(execute_iter(steps, policy_path, workers, cwd, spill_prefix))
+    return summary(results, (time.perf_counter() - start) * 1000)
+
+
+HEADINGS = {"success": "✅ SUCCESS", "denied": "❌ FAILED (Policy)", "timeout": "❌ FAILED (Timeout)",
+            "blocked": "❌ FAILED (Blocked)"}
+
+
+def step_md(r):
+    heading = HEADINGS.get(r["status"], f"❌ FAILED (Exit Code {r['exit_code']})")
+    timing = f"cached from {time.strftime('%Y-%m-%d %H:%M', time.localtime(r['cached_at']))}" if r.get("cached") \
+        else f"{r['duration_ms'] / 1000:.1f} s"
+    parts = [f"## {heading}: {r['title']} ({timing})\n```bash\n{r['bash']}\n```\n"]
+    if r["stdout"]:
+        parts.append(f"**Stdout:**\n{r['stdout']}\n")
+    if r["stderr"]:
+        parts.append(f"**Stderr:**\n{r['stderr']}\n")
+    parts.append("\n")
+    return "".join(parts)
+
+
+def report_header():
+    return f"# Execution Report: {time.strftime('%Y-%m-%dT%H:%M:%S%z')}\n\n"
+
+
+def report_md(results):
+    return report_header() + "".join(step_md(r) for r in results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run steps under exec_policy.json")
+    parser.add_argument("steps", nargs="?", help="steps JSON (default: read from stdin)")
+    parser.add_argument("--ndjson", action="store_true", help="stream one record per step as it completes")
+    parser.add_argument("--spill-prefix", default=None, help="write truncated outputs in full to <prefix>step<i>_<stream>.log")
+    args = parser.parse_args()
+    try:
+        steps = json.loads(args.steps if args.steps is not None else sys.stdin.read())
+        if not isinstance(steps, list):
+            raise ValueError("expected a JSON array of steps")
+        if not args.ndjson:
+            print(json.dumps(execute(steps, spill_prefix=args.spill_prefix)))
+            sys.exit(0)
+        start = time.perf_counter()
+        results = []
+        for result in execute_iter(steps, spill_prefix=args.spill_prefix):
+            results.append(result)
+            print(json.dumps(dict(result, type="step", report_md=step_md(result))), flush=True)
+        done = summary(results, (time.perf_counter() - start) * 1000)
+        print(json.dumps({"type": "done", "final_report_md": done["final_report_md"],
+                          "duration_ms": done["duration_ms"], "succeeded": len(done["success"]),
+                          "failed": len(done["failed"])}), flush=True)
+    except (ValueError, OSError) as e:
+        print(json.dumps({"error": str(e)}), flush=True)
+        sys.exit(1)
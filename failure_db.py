@@ -1,67 +1,351 @@
 # failure_db.py - Pattern database for avoiding repeated mistakes
+#
+# Persistence is a snapshot plus a write-ahead journal:
+#   failure_patterns.json           {"seq", "patterns"} - replaced atomically every SNAPSHOT_EVERY events
+#   failure_patterns.journal.jsonl  one failure event per line, appended as it is learned
+# Startup loads the snapshot and replays journal events newer than its seq.
+#
+# Several processes may share the files: writers hold an flock on
+# failure_patterns.lock, and every process re-stats the files before using its
+# cached patterns, reading only journal lines appended since its last look.
+#
+# The database is bounded: each pattern carries a score that halves every
+# HALF_LIFE_DAYS without new failures, and past MAX_PATTERNS the lowest-scoring
+# patterns are evicted. The summary reads a maintained top-K of the
+# highest-scoring repeated failures, so neither grows with running time.
 import json
 import os
-import re
+import math
+import heapq
+import time
+import threading
+from contextlib import contextmanager
 from typing import Tuple, Optional
+from command_matcher import CommandIndex, pattern_key
+
+SNAPSHOT_EVERY = int(os.environ.get("FAILURE_DB_SNAPSHOT_EVERY", "200"))
+FSYNC = os.environ.get("FAILURE_DB_FSYNC", "0") == "1"
+# Commands this similar (Jaccard over normalized token shingles) to a known pattern count as that pattern
+NEAR_DUP_THRESHOLD = float(os.environ.get("FAILURE_NEAR_DUP_THRESHOLD", "0.8"))
+MAX_PATTERNS = int(os.environ.get("FAILURE_DB_MAX_PATTERNS", "2000"))
+HALF_LIFE_DAYS = float(os.environ.get("FAILURE_DECAY_HALF_LIFE_DAYS", "14"))
+SUMMARY_TOP_K = int(os.environ.get("FAILURE_SUMMARY_TOP_K", "20"))
+MAX_TITLES = 10  # most recent step titles kept per pattern
+KEY_VERSION = 2  # pattern keys come from command_matcher.pattern_key
+VERSION = 3      # patterns carry a decayed score and last_seen
+
+try:
+    import fcntl
+except ImportError:  # no flock: only one writing process is safe
+    fcntl = None
+
+
+def _file_id(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
 
 class FailureDB:
-    def __init__(self, db_path="data/failure_patterns.json"):
+    def __init__(self, db_path="data/failure_patterns.json", snapshot_every=SNAPSHOT_EVERY,
+                 max_patterns=MAX_PATTERNS, half_life_days=HALF_LIFE_DAYS, top_k=SUMMARY_TOP_K):
         self.db_path = db_path
+        self.journal_path = os.path.splitext(db_path)[0] + ".journal.jsonl"
+        self.lock_path = os.path.splitext(db_path)[0] + ".lock"
+        self.snapshot_every = snapshot_every
+        self._lock = threading.RLock()  # services handle requests on several threads
+        self._journal = None
+        self.index = CommandIndex(NEAR_DUP_THRESHOLD)
+        self.seq = 0             # last event applied
+        self.snapshot_seq = 0    # last event included in the snapshot
+        self._snapshot_id = None  # (inode, mtime, size) of the snapshot that was loaded
+        self._journal_offset = 0  # journal bytes already applied
+        self.max_patterns = max_patterns
+        self.half_life = half_life_days * 86400
+        self.top_k = top_k
+        self._top = set()        # keys of the top_k highest-ranked repeated patterns
+        self._summary = None     # cached get_failure_summary text
         self.patterns = self.load_patterns()
-        
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock across every process using this database"""
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
     def load_patterns(self) -> dict:
-        if os.path.exists(self.db_path):
-            with open(self.db_path, 'r') as f:
-                return json.load(f)
-        return {}
+        """Snapshot plus journal replay; a legacy flat {pattern: details} file is read as a snapshot"""
+        with self._lock, self._file_lock():
+            return self._load()
+
+    def _load(self) -> dict:
+        self.patterns = {}
+        self.index = CommandIndex(self.index.threshold)
+        self._top, self._summary = set(), None
+        version = 1
+        self._snapshot_id = _file_id(self.db_path)
+        if self._snapshot_id is not None:
+            try:
+                with open(self.db_path, 'r') as f:
+                    snapshot = json.load(f)
+            except json.JSONDecodeError as e:
+                print(f"Ignoring unreadable failure snapshot {self.db_path}: {e}")
+                snapshot = {}
+            if "patterns" in snapshot and "seq" in snapshot:
+                self.patterns, self.seq = snapshot["patterns"], snapshot["seq"]
+                version = snapshot.get("version", 1)
+            else:
+                self.patterns = snapshot
+        self.snapshot_seq = self.seq
+        if version < VERSION:
+            # Older patterns start out as recent as the snapshot, at full weight
+            seen = self._snapshot_id[1] / 1e9 if self._snapshot_id else time.time()
+            for details in self.patterns.values():
+                details.setdefault("score", float(details["count"]))
+                details.setdefault("last_seen", seen)
+                details["titles"] = details["titles"][-MAX_TITLES:]
+        if version >= KEY_VERSION:
+            for pattern, details in self.patterns.items():
+                self.index.add(pattern, details["command_example"])
+
+        self._journal_offset = 0
+        if os.path.exists(self.journal_path):
+            good_bytes = 0
+            with open(self.journal_path, 'rb') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # torn tail from a crash mid-append
+                    if event["seq"] > self.seq:
+                        self._apply(event)
+                    good_bytes += len(line)
+            if good_bytes < os.path.getsize(self.journal_path):
+                with open(self.journal_path, 'r+b') as f:
+                    f.truncate(good_bytes)
+            self._journal_offset = good_bytes
+        if version < KEY_VERSION and self.patterns:
+            self._rekey()
+        self._evict(None)
+        self._rebuild_top()
+        if version < VERSION and self.patterns:
+            self._save()
+        return self.patterns
+
+    def refresh(self):
+        """Pick up other processes' writes: two stats when nothing changed, else the new journal lines"""
+        with self._lock:
+            self._refresh(self.load_patterns)
+
+    def _refresh(self, reload):
+        if _file_id(self.db_path) != self._snapshot_id:
+            reload()  # another process wrote a new snapshot
+            return
+        size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+        if size < self._journal_offset:
+            reload()
+        elif size > self._journal_offset:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(self._journal_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # still being written
+                    event = json.loads(line)
+                    if event["seq"] > self.seq:
+                        self._apply(event)
+                    self._journal_offset += len(line)
+
+    @contextmanager
+    def _writing(self):
+        """Both locks, with this process caught up and any torn journal tail removed"""
+        with self._lock, self._file_lock():
+            self._refresh(self._load)
+            if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > self._journal_offset:
+                with open(self.journal_path, 'r+b') as f:
+                    f.truncate(self._journal_offset)
+            yield
+
+    def _rekey(self):
+        """Re-derive keys of patterns learned with the old regex extractor, merging ones that now coincide"""
+        patterns, self.patterns = self.patterns, {}
+        self.index = CommandIndex(self.index.threshold)
+        for details in patterns.values():
+            key = pattern_key(details["command_example"])
+            merged = self.patterns.get(key)
+            if merged is None:
+                self.patterns[key] = dict(details, lesson=f"Command pattern '{key[:50]}' fails with: {details['error'][:100]}")
+                self.index.add(key, details["command_example"])
+            else:
+                merged["count"] += details["count"]
+                merged["titles"] = (merged["titles"] + [t for t in details["titles"] if t not in merged["titles"]])[-MAX_TITLES:]
+                seen = max(merged["last_seen"], details["last_seen"])
+                merged["score"] = self._decayed(merged, seen) + self._decayed(details, seen)
+                merged["last_seen"] = seen
     
     def save_patterns(self):
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        with open(self.db_path, 'w') as f:
-            json.dump(self.patterns, f, indent=2)
+        """Write a snapshot of every event so far, then start an empty journal"""
+        with self._writing():
+            self._save()
+
+    def _save(self):
+        # Caller holds both locks
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        tmp = self.db_path + ".tmp"
+        with open(tmp, 'w') as f:
+            f.write(json.dumps({"version": VERSION, "seq": self.seq, "patterns": self.patterns}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.db_path)
+        # A crash before the truncate is harmless: replay skips events <= seq
+        open(self.journal_path, 'w').close()
+        self._snapshot_id = _file_id(self.db_path)
+        self._journal_offset = 0
+        self.snapshot_seq = self.seq
+
+    def _append(self, events):
+        """One write for a batch of events; caller holds both locks"""
+        if self._journal is None:
+            os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+            self._journal = open(self.journal_path, 'a')
+        self._journal.write("".join(json.dumps(event) + "\n" for event in events))
+        self._journal.flush()
+        if FSYNC:
+            os.fsync(self._journal.fileno())
+        self._journal_offset = os.fstat(self._journal.fileno()).st_size
     
     def extract_pattern(self, command: str) -> str:
-        """Extract command pattern for matching"""
-        # Remove specific paths/filenames but keep structure
-        pattern = re.sub(r'/[\w\-\.]+', '/<PATH>', command)
-        # Remove specific numbers but keep pattern
-        pattern = re.sub(r'\d+', '<NUM>', pattern)
-        # Keep first command as key identifier
-        first_cmd = command.split()[0] if command.split() else command
-        return f"{first_cmd}:{pattern[:100]}"  # Limit length
+        """Extract command pattern for matching (see command_matcher.normalize)"""
+        return pattern_key(command)
+
+    def match_pattern(self, command: str) -> Optional[str]:
+        """Key of the learned pattern this command is, or nearly is; None if it is new"""
+        return self.index.match(command)[0]
     
     def learn_failure(self, command: str, error: str, title: str = ""):
-        """Record a failed command pattern"""
-        pattern = self.extract_pattern(command)
-        
-        if pattern not in self.patterns:
-            self.patterns[pattern] = {
-                "command_example": command[:200],
-                "error": error[:200],
+        """Record a failed command pattern with one journal append; near-duplicates join their pattern"""
+        self.learn_failures([{"command": command, "error": error, "title": title}])
+
+    def learn_failures(self, failures):
+        """Record a batch of failed steps ({bash or command, stderr or error, title}) with one locked append"""
+        with self._writing():
+            events, repeated = [], []
+            for failure in failures:
+                command = failure.get("bash") or failure.get("command") or ""
+                error = failure.get("stderr") or failure.get("error") or "Unknown error"
+                pattern = self.match_pattern(command) or self.extract_pattern(command)
+                event = {"seq": self.seq + 1, "pattern": pattern, "command": command[:200],
+                         "error": error[:200], "title": failure.get("title") or "", "ts": time.time()}
+                self._apply(event)
+                events.append(event)
+                # Trigger system agent if pattern repeats 3+ times
+                if self.patterns[pattern]["count"] == 3:
+                    repeated.append(pattern)
+            if not events:
+                return 0
+            try:
+                self._append(events)
+            except OSError:
+                self._load()  # drop the in-memory events that never reached the journal
+                raise
+
+            for pattern in repeated:
+                if pattern in self.patterns:
+                    self.request_system_agent(pattern)
+            if self.seq - self.snapshot_seq >= self.snapshot_every:
+                self._save()
+            return len(events)
+
+    def _apply(self, event):
+        pattern, error, title, ts = event["pattern"], event["error"], event["title"], event["ts"]
+        details = self.patterns.get(pattern)
+        if details is None:
+            self.index.add(pattern, event["command"])
+            details = self.patterns[pattern] = {
+                "command_example": event["command"],
+                "error": error,
                 "count": 1,
                 "titles": [title] if title else [],
-                "lesson": f"Command pattern '{pattern[:50]}' fails with: {error[:100]}"
+                "lesson": f"Command pattern '{pattern[:50]}' fails with: {error[:100]}",
+                "score": 1.0,
+                "last_seen": ts
             }
         else:
-            self.patterns[pattern]["count"] += 1
-            if title and title not in self.patterns[pattern]["titles"]:
-                self.patterns[pattern]["titles"].append(title)
-        
-        # Trigger system agent if pattern repeats 3+ times
-        if self.patterns[pattern]["count"] == 3:
-            self.request_system_agent(pattern)
-        
-        self.save_patterns()
+            details["count"] += 1
+            if title and title not in details["titles"]:
+                details["titles"] = details["titles"][1 - MAX_TITLES:] + [title]
+            details["score"] = self._decayed(details, ts) + 1
+            details["last_seen"] = max(details["last_seen"], ts)
+        self.seq = event["seq"]
+        self._summary = None
+        self._evict(pattern)
+        if details["count"] >= 2 and pattern not in self._top:
+            self._offer_top(pattern)
+
+    def _decayed(self, details, now):
+        """Score as of now: halves every half_life seconds since the pattern last failed"""
+        return details["score"] * 0.5 ** (max(0.0, now - details["last_seen"]) / self.half_life)
+
+    def _rank(self, pattern):
+        """log2 of the decayed score at a fixed reference time: comparable without decaying every pattern"""
+        details = self.patterns[pattern]
+        return math.log2(details["score"]) + details["last_seen"] / self.half_life
+
+    def _evict(self, keep):
+        """Past max_patterns, drop the lowest-ranked tenth (never keep, the pattern just learned)"""
+        excess = len(self.patterns) - self.max_patterns
+        if excess <= 0:
+            return
+        excess += self.max_patterns // 10
+        candidates = (p for p in self.patterns if p != keep)
+        for pattern in heapq.nsmallest(excess, candidates, key=self._rank):
+            del self.patterns[pattern]
+            self.index.remove(pattern)
+            if pattern in self._top:
+                self._top = set()  # refilled below
+        if not self._top:
+            self._rebuild_top()
+
+    def _rebuild_top(self):
+        repeated = (p for p, d in self.patterns.items() if d["count"] >= 2)
+        self._top = set(heapq.nlargest(self.top_k, repeated, key=self._rank))
+        self._summary = None
+
+    def _offer_top(self, pattern):
+        """Ranks only rise when a pattern fails again, so a newcomer can only displace the lowest entry"""
+        if len(self._top) < self.top_k:
+            self._top.add(pattern)
+            return
+        lowest = min(self._top, key=self._rank)
+        if self._rank(pattern) > self._rank(lowest):
+            self._top.discard(lowest)
+            self._top.add(pattern)
     
     def should_skip(self, command: str) -> Tuple[bool, Optional[str]]:
         """Check if command matches a known failure pattern"""
-        pattern = self.extract_pattern(command)
-        
-        if pattern in self.patterns and self.patterns[pattern]["count"] >= 3:
-            lesson = self.patterns[pattern]["lesson"]
-            return True, f"Skipping - known failure pattern (failed {self.patterns[pattern]['count']} times): {lesson}"
-        
-        return False, None
+        return self.should_skip_many([command])[0]
+
+    def should_skip_many(self, steps) -> list:
+        """should_skip for a whole plan (commands or {"bash": ...} steps) in one pass"""
+        results = []
+        with self._lock:
+            self.refresh()
+            for step in steps:
+                command = step.get("bash", "") if isinstance(step, dict) else step
+                details = self.patterns.get(self.match_pattern(command))
+                if details and details["count"] >= 3:
+                    results.append((True, f"Skipping - known failure pattern (failed {details['count']} times): {details['lesson']}"))
+                else:
+                    results.append((False, None))
+        return results
     
     def request_system_agent(self, pattern: str):
         """Create a request for system agent intervention"""
@@ -80,16 +364,17 @@ class FailureDB:
         print(f"System agent requested for repeated failure: {pattern}")
     
     def get_failure_summary(self) -> str:
-        """Get summary of all failure patterns for system agent"""
-        if not self.patterns:
-            return "No failure patterns recorded yet."
-        
-        summary = "Known Failure Patterns:\n"
-        for pattern, details in self.patterns.items():
-            if details["count"] >= 2:  # Only show repeated failures
-                summary += f"- {pattern[:50]}: {details['count']} failures\n"
-        
-        return summary
+        """The top_k most relevant repeated failures (by decayed score), for the planner and system agent"""
+        with self._lock:
+            self.refresh()
+            if not self.patterns:
+                return "No failure patterns recorded yet."
+            if self._summary is None:
+                summary = "Known Failure Patterns:\n"
+                for pattern in sorted(self._top, key=self._rank, reverse=True):
+                    summary += f"- {pattern[:50]}: {self.patterns[pattern]['count']} failures\n"
+                self._summary = summary
+            return self._summary
 
 # Global instance
 failure_db = FailureDB()
\ No newline at end of file
@@ -0,0 +1,253 @@
+# gemini_client.py - Process-wide Gemini client: shared models, rate limits, retries and usage accounting
+#
+# Every model call in a service goes through the global `gemini` client (via
+# llm_backend.py), which
+#   - reuses one GenerativeModel per model name instead of building one per request,
+#   - paces calls with token buckets for requests (GEMINI_RPM) and tokens
+#     (GEMINI_TPM) per minute, and caps concurrent calls at GEMINI_MAX_IN_FLIGHT,
+#   - retries 408/429/5xx and connection errors with full-jitter exponential
+#     backoff, within GEMINI_DEADLINE_SEC of the first attempt,
+#   - records per-model latency, retries, throttling time and token usage.
+# Limits are per process; give each service its share of the project quota.
+import os
+import time
+import random
+import threading
+from collections import deque
+
+RPM = float(os.environ.get("GEMINI_RPM", "0"))          # requests per minute, 0 = unlimited
+TPM = float(os.environ.get("GEMINI_TPM", "0"))          # prompt + output tokens per minute, 0 = unlimited
+MAX_IN_FLIGHT = int(os.environ.get("GEMINI_MAX_IN_FLIGHT", "4"))
+MAX_ATTEMPTS = int(os.environ.get("GEMINI_MAX_ATTEMPTS", "5"))
+DEADLINE_SEC = float(os.environ.get("GEMINI_DEADLINE_SEC", "120"))
+BACKOFF_SEC = float(os.environ.get("GEMINI_BACKOFF_SEC", "1"))
+BACKOFF_MAX_SEC = float(os.environ.get("GEMINI_BACKOFF_MAX_SEC", "30"))
+BURST_SHARE = 0.1       # bucket capacity, as a share of a minute's allowance
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+CHARS_PER_TOKEN = 4
+LATENCY_SAMPLES = 1000  # per model, for the percentiles
+
+_genai = None
+_genai_lock = threading.Lock()
+
+
+class DeadlineExceeded(TimeoutError):
+    """The call could not be made (or retried) within its deadline"""
+
+
+def genai():
+    """The configured google.generativeai module, imported only when the API is used"""
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            import google.generativeai
+            google.generativeai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
+            _genai = google.generativeai
+    return _genai
+
+
+def estimate_tokens(value):
+    return len(str(value)) // CHARS_PER_TOKEN + 1
+
+
+def usage(response):
+    """(prompt tokens, output tokens) reported with a response or stream chunk, or None"""
+    meta = getattr(response, "usage_metadata", None)
+    if not meta:
+        return None
+    return (getattr(meta, "prompt_token_count", 0) or 0, getattr(meta, "candidates_token_count", 0) or 0)
+
+
+def retryable(error):
+    """Rate limiting, server errors, timeouts and dropped connections; not bad requests"""
+    if isinstance(error, DeadlineExceeded):
+        return False
+    code = getattr(error, "code", None)  # google.api_core exceptions carry the HTTP status
+    if isinstance(code, int) and code in RETRY_STATUS:
+        return True
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class TokenBucket:
+    """rate units per second, bursting up to capacity; a rate of 0 means unlimited"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._level = self.capacity
+        self._ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._level = min(self.capacity, self._level + (now - self._ts) * self.rate)
+        self._ts = now
+
+    def acquire(self, amount, deadline):
+        """Seconds spent waiting for amount; raises DeadlineExceeded rather than wait past deadline"""
+        if not self.rate:
+            return 0.0
+        amount = min(amount, self.capacity)  # a request larger than the burst still gets through
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._level >= amount:
+                    self._level -= amount
+                    return now - start
+                wait = (amount - self._level) / self.rate
+            if now + wait > deadline:
+                raise DeadlineExceeded(f"rate limit: {amount:.0f} units not available before the deadline")
+            time.sleep(wait)
+
+    def debit(self, amount):
+        """Charge usage learned after the call (may go negative, delaying later calls)"""
+        if not self.rate or not amount:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._level -= amount
+
+
+class GeminiClient:
+    """Rate-limited, retrying calls with per-model accounting.
+
+    call() and stream() take the model name (for accounting), a send(timeout)
+    function that makes one attempt, and the estimated prompt tokens. send
+    returns (result, usage) for call(), or yields (text, usage or None) chunks
+    for stream(); usage is (prompt tokens, output tokens) when the API reports it.
+    """
+
+    def __init__(self, rpm=RPM, tpm=TPM, max_in_flight=MAX_IN_FLIGHT, max_attempts=MAX_ATTEMPTS,
+                 deadline_sec=DEADLINE_SEC, backoff_sec=BACKOFF_SEC, backoff_max_sec=BACKOFF_MAX_SEC):
+        self.requests = TokenBucket(rpm / 60, rpm * BURST_SHARE)
+        self.tokens = TokenBucket(tpm / 60, tpm * BURST_SHARE)
+        self.max_in_flight = max(1, max_in_flight)
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self.max_attempts = max(1, max_attempts)
+        self.deadline_sec = deadline_sec
+        self.backoff_sec = backoff_sec
+        self.backoff_max_sec = backoff_max_sec
+        self._models = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._in_flight = 0
+
+    def model(self, name):
+        """The shared GenerativeModel for name"""
+        with self._lock:
+            model = self._models.get(name)
+            if model is None:
+                model = self._models[name] = genai().GenerativeModel(name)
+        return model
+
+    def _model_stats(self, model):
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = {"calls": 0, "attempts": 0, "retries": 0, "failures": 0,
+                                          "throttled_ms": 0.0, "prompt_tokens": 0, "output_tokens": 0,
+                                          "latency_ms": deque(maxlen=LATENCY_SAMPLES)}
+        return stats
+
+    def _record(self, model, **fields):
+        with self._lock:
+            stats = self._model_stats(model)
+            for field, value in fields.items():
+                if field == "latency_ms":
+                    stats["latency_ms"].append(value)
+                else:
+                    stats[field] += value
+
+    def _admit(self, model, estimate, deadline):
+        """Wait for rate-limit budget and a free slot"""
+        waited = self.requests.acquire(1, deadline) + self.tokens.acquire(estimate, deadline)
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=max(0.0, deadline - start)):
+            raise DeadlineExceeded(f"{self.max_in_flight} calls still in flight at the deadline")
+        waited += time.monotonic() - start
+        with self._lock:
+            self._in_flight += 1
+        self._record(model, attempts=1, throttled_ms=waited * 1000)
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _settle(self, model, estimate, reported, output_chars, started):
+        """Account one successful attempt; reported usage replaces the estimate in the token bucket"""
+        prompt_tokens, output_tokens = reported or (estimate, output_chars // CHARS_PER_TOKEN)
+        self.tokens.debit(prompt_tokens + output_tokens - estimate)
+        self._record(model, calls=1, prompt_tokens=prompt_tokens, output_tokens=output_tokens,
+                     latency_ms=(time.monotonic() - started) * 1000)
+
+    def _backoff(self, model, attempt, error, deadline):
+        """Sleep before the next attempt, or re-raise error if it is final"""
+        if not retryable(error) or attempt + 1 >= self.max_attempts:
+            self._record(model, failures=1)
+            raise error
+        delay = random.uniform(0, min(self.backoff_max_sec, self.backoff_sec * 2 ** attempt))
+        if time.monotonic() + delay >= deadline:
+            self._record(model, failures=1)
+            raise error
+        self._record(model, retries=1)
+        time.sleep(delay)
+
+    def call(self, model, send, estimate):
+        """send(timeout)'s result, retried on transient errors"""
+        deadline = time.monotonic() + self.deadline_sec
+        for attempt in range(self.max_attempts):
+            self._admit(model, estimate, deadline)
+            started = time.monotonic()
+            try:
+                result, reported = send(max(1.0, deadline - started))
+            except Exception as e:
+                error = e
+            else:
+                self._settle(model, estimate, reported, len(result) if isinstance(result, str) else 0, started)
+                return result
+            finally:
+                self._release()
+            self._backoff(model, attempt, error, deadline)
+
+    def stream(self, model, send, estimate):
+        """Text chunks of send(timeout); retried on transient errors until the first chunk arrives"""
+        deadline = time.monotonic() + self.deadline_sec
+        for attempt in range(self.max_attempts):
+            self._admit(model, estimate, deadline)
+            started = time.monotonic()
+            chars, reported, first = 0, None, True
+            try:
+                for text, chunk_usage in send(max(1.0, deadline - started)):
+                    first = False
+                    chars += len(text)
+                    reported = chunk_usage or reported
+                    yield text
+            except Exception as e:
+                if not first:  # part of the output is already with the caller
+                    self._record(model, failures=1)
+                    raise
+                error = e
+            else:
+                self._settle(model, estimate, reported, chars, started)
+                return
+            finally:
+                self._release()
+            self._backoff(model, attempt, error, deadline)
+
+    def stats(self):
+        """Per-model counters plus p50/p95 latency, and the calls in flight now"""
+        with self._lock:
+            models = {}
+            for model, stats in self._stats.items():
+                entry = {k: v for k, v in stats.items() if k != "latency_ms"}
+                latencies = sorted(stats["latency_ms"])
+                if latencies:
+                    entry["p50_ms"] = latencies[len(latencies) // 2]
+                    entry["p95_ms"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+                models[model] = entry
+            return {"in_flight": self._in_flight, "max_in_flight": self.max_in_flight, "models": models}
+
+
+# Global instance
+gemini = GeminiClient()
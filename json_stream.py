@@ -0,0 +1,64 @@
+# json_stream.py - Incremental extraction of array items from a JSON document as it streams in
+import json
+
+
+class ArrayItemStream:
+    """Yields the items of one array-valued key of the top-level object as soon as each is complete.
+
+    Feed it the model's output chunk by chunk (code fences around the JSON are
+    fine). Only object items are extracted; scanning is linear in the input,
+    resuming where the previous chunk ended.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string = None   # last string closed directly inside the top-level object
+        self._array_depth = None   # depth inside the wanted array, while in it
+        self._array_done = False
+        self._item_start = None
+
+    def feed(self, chunk):
+        """Items completed by this chunk, in order"""
+        self.text += chunk
+        items = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = text[self._string_start + 1:i]
+            elif c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c == "{" or c == "[":
+                self._depth += 1
+                if c == "[" and self._depth == 2 and not self._array_done and self._last_string == self.key:
+                    self._array_depth = 2
+                elif c == "{" and self._array_depth is not None and self._depth == self._array_depth + 1:
+                    self._item_start = i
+            elif c == "}" or c == "]":
+                if self._array_depth is not None:
+                    if c == "}" and self._item_start is not None and self._depth == self._array_depth + 1:
+                        try:
+                            items.append(json.loads(text[self._item_start:i + 1]))
+                        except ValueError:
+                            pass  # malformed item: left to the final parse of the whole document
+                        self._item_start = None
+                    elif c == "]" and self._depth == self._array_depth:
+                        self._array_depth = None
+                        self._array_done = True
+                self._depth -= 1
+        self._pos = len(text)
+        return items
@@ -0,0 +1,225 @@
+# llm_backend.py - Pluggable model backend: live Gemini API, record to disk, or local replay
+#
+# LLM_BACKEND=live    call the API (default)
+# LLM_BACKEND=record  call the API and save every prompt/response pair under LLM_RECORDINGS_DIR
+# LLM_BACKEND=replay  serve saved responses locally, with synthetic latency and failures:
+#                     LLM_REPLAY_LATENCY_MS (+/- LLM_REPLAY_JITTER_MS) plus LLM_REPLAY_LATENCY_SCALE
+#                     times the latency measured when the response was recorded, plus
+#                     LLM_REPLAY_MS_PER_CHAR per character of output (generation time), and
+#                     LLM_REPLAY_FAILURE_RATE as the fraction of calls that raise ReplayFailure
+#
+# Replay looks a prompt up by its exact hash first. Loop prompts rarely repeat
+# exactly (they embed fresh context), so on a miss it picks a recording made
+# with the same model and system prompt, deterministically by prompt hash.
+# generate_stream() replays a recording in REPLAY_CHUNK_CHARS pieces with the
+# synthetic latency spread across them, so streaming consumers can be measured.
+# Live and replayed calls alike go through gemini_client.py, so replays are
+# subject to the same rate limits and retries (injected failures are retried).
+# Embeddings are never recorded (embedding_cache.py already persists them);
+# in replay they are synthesized from a hash of the text.
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from gemini_client import gemini, genai, usage, estimate_tokens
+
+BACKEND = os.environ.get("LLM_BACKEND", "live")
+RECORDINGS_DIR = os.environ.get("LLM_RECORDINGS_DIR", "data/llm_recordings")
+REPLAY_LATENCY_MS = float(os.environ.get("LLM_REPLAY_LATENCY_MS", "0"))
+REPLAY_JITTER_MS = float(os.environ.get("LLM_REPLAY_JITTER_MS", "0"))
+REPLAY_LATENCY_SCALE = float(os.environ.get("LLM_REPLAY_LATENCY_SCALE", "0"))
+REPLAY_FAILURE_RATE = float(os.environ.get("LLM_REPLAY_FAILURE_RATE", "0"))
+REPLAY_EMBEDDING_DIM = int(os.environ.get("LLM_REPLAY_EMBEDDING_DIM", "768"))
+REPLAY_MS_PER_CHAR = float(os.environ.get("LLM_REPLAY_MS_PER_CHAR", "0"))
+REPLAY_CHUNK_CHARS = int(os.environ.get("LLM_REPLAY_CHUNK_CHARS", "200"))
+
+
+class ReplayFailure(RuntimeError):
+    """Injected failure standing in for an API error during replay (retried like a 503)"""
+    code = 503
+
+
+def _digest(value):
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def prompt_key(model, contents):
+    return _digest(model + "\0" + json.dumps(contents, sort_keys=True, ensure_ascii=False))
+
+
+def system_key(model, contents):
+    """Hash of the model plus the system message, which identifies the calling service"""
+    system = ""
+    if isinstance(contents, list) and contents and isinstance(contents[0], dict) \
+            and contents[0].get("role") == "system":
+        system = json.dumps(contents[0].get("parts", []), ensure_ascii=False)
+    return _digest(model + "\0" + system)
+
+
+class Recordings:
+    """Prompt/response pairs on disk, one JSON file per prompt hash"""
+
+    def __init__(self, path=RECORDINGS_DIR):
+        self.path = path
+        self._lock = threading.Lock()
+        self._texts = None      # prompt key -> (response text, recorded latency ms)
+        self._by_system = None  # system key -> sorted prompt keys
+
+    def save(self, model, contents, text, latency_ms):
+        key = prompt_key(model, contents)
+        record = {"key": key, "system_key": system_key(model, contents), "model": model,
+                  "contents": contents, "text": text, "latency_ms": latency_ms, "ts": time.time()}
+        os.makedirs(self.path, exist_ok=True)
+        target = os.path.join(self.path, f"{key}.json")
+        tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp, target)
+        with self._lock:
+            if self._texts is not None:
+                self._index(record)
+
+    def _index(self, record):
+        self._texts[record["key"]] = (record["text"], record.get("latency_ms", 0))
+        keys = self._by_system.setdefault(record["system_key"], [])
+        if record["key"] not in keys:
+            keys.append(record["key"])
+            keys.sort()
+
+    def _load(self):
+        with self._lock:
+            if self._texts is not None:
+                return
+            self._texts, self._by_system = {}, {}
+            if not os.path.isdir(self.path):
+                return
+            for name in sorted(os.listdir(self.path)):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(self.path, name), 'r') as f:
+                        self._index(json.load(f))
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Skipping unreadable recording {name}: {e}")
+
+    def lookup(self, model, contents):
+        """(text, latency_ms) recorded for this prompt, or for another prompt of the same service"""
+        self._load()
+        key = prompt_key(model, contents)
+        if key in self._texts:
+            return self._texts[key]
+        candidates = self._by_system.get(system_key(model, contents))
+        if not candidates:
+            raise LookupError(f"No recordings for this prompt's model/system message in {self.path}; "
+                              f"run with LLM_BACKEND=record first")
+        return self._texts[candidates[int(key, 16) % len(candidates)]]
+
+    def __len__(self):
+        self._load()
+        return len(self._texts)
+
+
+recordings = Recordings()
+stats = {"calls": 0, "failures": 0, "injected_failures": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(field):
+    with _stats_lock:
+        stats[field] += 1
+
+
+def _replay_latency_ms(recorded_ms, chars):
+    delay = REPLAY_LATENCY_MS + REPLAY_LATENCY_SCALE * recorded_ms + REPLAY_MS_PER_CHAR * chars
+    if REPLAY_JITTER_MS:
+        delay += random.uniform(-REPLAY_JITTER_MS, REPLAY_JITTER_MS)
+    return max(0.0, delay)
+
+
+def _replay_failure():
+    if REPLAY_FAILURE_RATE and random.random() < REPLAY_FAILURE_RATE:
+        _count("injected_failures")
+        raise ReplayFailure("Injected replay failure")
+
+
+def _replay_delay(recorded_ms, chars):
+    delay = _replay_latency_ms(recorded_ms, chars)
+    if delay > 0:
+        time.sleep(delay / 1000)
+    _replay_failure()
+
+
+def generate(model, contents):
+    """Text of one generate_content call: contents is a prompt string or a list of {role, parts} messages"""
+    _count("calls")
+
+    def send(timeout):
+        if BACKEND == "replay":
+            text, recorded_ms = recordings.lookup(model, contents)
+            _replay_delay(recorded_ms, len(text))
+            return text, None
+        start = time.perf_counter()
+        response = gemini.model(model).generate_content(contents, request_options={"timeout": timeout})
+        if BACKEND == "record":
+            recordings.save(model, contents, response.text, (time.perf_counter() - start) * 1000)
+        return response.text, usage(response)
+
+    try:
+        return gemini.call(model, send, estimate_tokens(contents))
+    except Exception:
+        _count("failures")
+        raise
+
+
+def generate_stream(model, contents):
+    """Text chunks of one streaming generate_content call; joined, they are what generate() returns"""
+    _count("calls")
+
+    def send(timeout):
+        if BACKEND == "replay":
+            text, recorded_ms = recordings.lookup(model, contents)
+            pieces = [text[i:i + REPLAY_CHUNK_CHARS] for i in range(0, len(text), REPLAY_CHUNK_CHARS)] or [""]
+            delay = _replay_latency_ms(recorded_ms, len(text)) / 1000 / len(pieces)
+            _replay_failure()
+            for piece in pieces:
+                if delay > 0:
+                    time.sleep(delay)
+                yield piece, None
+            return
+        start = time.perf_counter()
+        parts = []
+        response = gemini.model(model).generate_content(contents, stream=True, request_options={"timeout": timeout})
+        for chunk in response:
+            parts.append(chunk.text)
+            yield chunk.text, usage(chunk)
+        if BACKEND == "record":
+            recordings.save(model, contents, "".join(parts), (time.perf_counter() - start) * 1000)
+
+    try:
+        yield from gemini.stream(model, send, estimate_tokens(contents))
+    except Exception:
+        _count("failures")
+        raise
+
+
+def hashed_embedding(text, dim=REPLAY_EMBEDDING_DIM):
+    """Deterministic stand-in embedding seeded by the text"""
+    import numpy as np  # only replayed embeddings need it; agents that never embed skip the import
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(dim, dtype=np.float32).tolist()
+
+
+def embed_content(model, content, task_type="RETRIEVAL_DOCUMENT"):
+    """Same call and result shape as genai.embed_content; content may be a string or a list"""
+    if BACKEND == "replay":
+        if isinstance(content, list):
+            return {"embedding": [hashed_embedding(text) for text in content]}
+        return {"embedding": hashed_embedding(content)}
+
+    def send(timeout):
+        return genai().embed_content(model=model, content=content, task_type=task_type,
+                                     request_options={"timeout": timeout}), None
+
+    return gemini.call(model, send, estimate_tokens(content))
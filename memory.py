@@ -1,39 +1,51 @@
 # memory.py — simple vector memory service
-import os
 import json
-import numpy as np
 from http.server import BaseHTTPRequestHandler, HTTPServer
-import google.generativeai as genai
+import llm_backend
+from embedding_cache import embedding_cache
+from vector_store import VectorStore
+from vector_index import VectorIndex
 
-genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
 PORT = 10004
-MEMORY_FILE = "data/memory_vectors.json" # Relative path
+MEMORY_FILE = "data/memory_vectors.json" # Relative path, legacy format
+STORE_DIR = "data/memory_store"
 EMBEDDING_MODEL = "text-embedding-004"
 
-def get_embedding(text):
+def get_embedding(text, task_type="RETRIEVAL_DOCUMENT"):
+    cached = embedding_cache.get(EMBEDDING_MODEL, task_type, text)
+    if cached:
+        return cached
     try:
-        result = genai.embed_content(model=f"models/{EMBEDDING_MODEL}", content=text, task_type="RETRIEVAL_DOCUMENT")
+        result = llm_backend.embed_content(model=f"models/{EMBEDDING_MODEL}", content=text, task_type=task_type)
+        embedding_cache.put(EMBEDDING_MODEL, task_type, text, result['embedding'])
         return result['embedding']
     except Exception as e:
         print(f"Error getting embedding: {e}")
         return []
 
-def cosine_similarity(v1, v2):
-    return np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
+_store = None
+_index = None
 
-def load_memory():
-    if not os.path.exists(MEMORY_FILE):
-        return []
-    with open(MEMORY_FILE, 'r') as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return []
+def get_store():
+    global _store
+    if _store is None:
+        store = VectorStore(STORE_DIR)
+        store.migrate_json(MEMORY_FILE)
+        _store = store
+    return _store
 
-def save_memory(memory):
-    os.makedirs(os.path.dirname(MEMORY_FILE), exist_ok=True)
-    with open(MEMORY_FILE, 'w') as f:
-        json.dump(memory, f)
+def get_index():
+    """Resident, pre-normalized index over the store, built once and kept between requests"""
+    global _index
+    if _index is None:
+        store = get_store()
+        index = VectorIndex()
+        entries = store.live_entries()
+        if entries:
+            index.add_many([e["id"] for _, e in entries], [e["text"] for _, e in entries],
+                           store.read([row for row, _ in entries]))
+        _index = index
+    return _index
 
 class H(BaseHTTPRequestHandler):
     def do_POST(self):
@@ -50,12 +62,12 @@ class H(BaseHTTPRequestHandler):
             if not embedding:
                 self.send_response(500); self.end_headers(); self.wfile.write(b'{"error":"Failed to generate embedding"}'); return
             
-            memory = load_memory()
-            memory = [entry for entry in memory if entry.get("id") != doc_id]
-            memory.append({"id": doc_id, "text": text_to_add, "embedding": embedding})
-            save_memory(memory)
+            store = get_store()
+            store.add(doc_id, text_to_add, embedding)
+            get_index().add(doc_id, text_to_add, embedding)
+            store.maybe_compact()
             self.send_response(200); self.send_header("Content-Type", "application/json"); self.end_headers()
-            self.wfile.write(json.dumps({"status": "ok", "entries": len(memory)}).encode("utf-8"))
+            self.wfile.write(json.dumps({"status": "ok", "entries": len(store)}).encode("utf-8"))
 
         elif self.path == "/_py/query":
             query_text = data.get("query", "")
@@ -67,15 +79,7 @@ class H(BaseHTTPRequestHandler):
             if not query_embedding:
                 self.send_response(500); self.end_headers(); self.wfile.write(b'{"error":"Failed to generate query embedding"}'); return
             
-            memory = load_memory()
-            if not memory:
-                self.send_response(200); self.send_header("Content-Type", "application/json"); self.end_headers()
-                self.wfile.write(json.dumps({"results": []}).encode("utf-8")); return
-
-            scores = [(cosine_similarity(query_embedding, entry["embedding"]), entry["text"]) for entry in memory if "embedding" in entry and entry["embedding"]]
-            scores.sort(key=lambda x: x[0], reverse=True)
-            
-            results = [{"score": float(score), "text": text} for score, text in scores[:top_k]]
+            results = [{"score": score, "text": text} for score, _, text in get_index().search(query_embedding, top_k)]
             self.send_response(200); self.send_header("Content-Type", "application/json"); self.end_headers()
             self.wfile.write(json.dumps({"results": results}).encode("utf-8"))
 
@@ -1,54 +1,256 @@
 # memory_v2.py - Enhanced with intelligent compression
 import os
-import json
+import time
+import threading
 import numpy as np
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import google.generativeai as genai
+import llm_backend
+from embedding_cache import embedding_cache
+from metadata_index import parse_id
+from ann_index import IVFIndex
+from quantize import VectorCodec, make_projection
+from service import JSONHandler, RWLock, serve
+from vector_index import VectorIndex
+from vector_store import VectorStore
 
-genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
 PORT = 10004
 MEMORY_FILE = "data/memory_vectors.json"
 LESSONS_FILE = "data/compressed_lessons.json"
+STORE_DIR = "data/memory_store"
 EMBEDDING_MODEL = "text-embedding-004"
+ADD_COALESCE_SEC = float(os.environ.get("MEMORY_ADD_COALESCE_MS", "20")) / 1000
+# 0 disables compression and keeps the full history searchable (pair with MEMORY_ANN=ivf)
+COMPRESSION_THRESHOLD = int(os.environ.get("MEMORY_COMPRESSION_THRESHOLD", "100"))
+KEEP_RECENT = int(os.environ.get("MEMORY_KEEP_RECENT", "50"))
+ANN_MODE = os.environ.get("MEMORY_ANN", "off")
+ANN_FILE = os.path.join(STORE_DIR, "ivf.npz")
+ANN_SAVE_EVERY = 1000
+# Compressed representations: codecs are float32 | float16 | int8, projection is none | random | pca
+INDEX_CODEC = os.environ.get("MEMORY_INDEX_CODEC", "float32")
+STORE_CODEC = os.environ.get("MEMORY_STORE_CODEC", "float32")
+PROJECTION = os.environ.get("MEMORY_PROJECTION", "none")
+PROJECTION_DIM = int(os.environ.get("MEMORY_PROJECTION_DIM", "256"))
+RERANK_K = int(os.environ.get("MEMORY_RERANK_K", "0"))
+META_FIELDS = ("kind", "loop_id", "source")
+FILTER_FIELDS = ("kinds", "sources", "since", "until", "last_loops")
 
-def get_embedding(text):
+def get_embedding(text, task_type="RETRIEVAL_DOCUMENT"):
+    cached = embedding_cache.get(EMBEDDING_MODEL, task_type, text)
+    if cached:
+        return cached
     try:
-        result = genai.embed_content(model=f"models/{EMBEDDING_MODEL}", content=text, task_type="RETRIEVAL_DOCUMENT")
+        result = llm_backend.embed_content(model=f"models/{EMBEDDING_MODEL}", content=text, task_type=task_type)
+        embedding_cache.put(EMBEDDING_MODEL, task_type, text, result['embedding'])
         return result['embedding']
     except Exception as e:
         print(f"Error getting embedding: {e}")
         return []
 
+def get_embeddings(texts, task_type="RETRIEVAL_DOCUMENT"):
+    """Embed many texts with one API call; cached texts are not re-sent"""
+    embeddings = [embedding_cache.get(EMBEDDING_MODEL, task_type, text) for text in texts]
+    missing = [i for i, e in enumerate(embeddings) if not e]
+    if not missing:
+        return embeddings
+    try:
+        result = llm_backend.embed_content(model=f"models/{EMBEDDING_MODEL}", content=[texts[i] for i in missing], task_type=task_type)
+        for i, embedding in zip(missing, result['embedding']):
+            embedding_cache.put(EMBEDDING_MODEL, task_type, texts[i], embedding)
+            embeddings[i] = embedding
+    except Exception as e:
+        print(f"Error getting batch embeddings: {e}")
+    return [e or [] for e in embeddings]
+
 def cosine_similarity(v1, v2):
     return np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
 
+def entry_metadata(entry):
+    """kind / loop_id / ts / source of a stored entry; older entries fall back to their id"""
+    meta = parse_id(entry.get("id"))
+    if entry.get("type") == "compressed_lesson":
+        meta["kind"] = "lesson"
+    for field in META_FIELDS:
+        if entry.get(field) is not None:
+            meta[field] = entry[field]
+    meta["ts"] = entry.get("ts", 0)
+    meta.setdefault("source", "unknown")
+    return meta
+
+_store = None
+_index = None
+_ann_saved = {"rows": 0, "trained_size": 0, "generation": 0}
+_lock = RWLock()  # queries share the index; adds and compression take it exclusively
+_open_lock = threading.Lock()
+
+def get_store():
+    """Memories and lessons share one store; legacy JSON files are migrated on first open"""
+    global _store
+    with _open_lock:
+        if _store is None:
+            store = VectorStore(STORE_DIR, codec=STORE_CODEC)
+            store.migrate_json(MEMORY_FILE, LESSONS_FILE)
+            _store = store
+    return _store
+
+def get_index():
+    """Resident index over memories + lessons, built once and kept between requests"""
+    global _index
+    if _index is None:
+        store = get_store()
+        with _open_lock:
+            if _index is None:
+                rows = store.live_rows()
+                projection = None
+                if store.dim:
+                    sample = store.read(rows[-4 * PROJECTION_DIM:]) if PROJECTION == "pca" else None
+                    projection = make_projection(PROJECTION, store.dim, PROJECTION_DIM, sample)
+                index = VectorIndex(codec=VectorCodec(INDEX_CODEC), projection=projection)
+                for start in range(0, len(rows), 65536):
+                    chunk = rows[start:start + 65536]
+                    entries = [store.entries[r] for r in chunk]
+                    index.add_many([e["id"] for e in entries], [e["text"] for e in entries], store.read(chunk),
+                                   [entry_metadata(e) for e in entries])
+                if ANN_MODE == "ivf":
+                    attach_ann(index, store, rows)
+                _index = index
+    return _index
+
+def read_exact(ids):
+    """Full-dimension embeddings from the store, used to re-rank approximate hits"""
+    store = get_store()
+    return store.read([store.row_of[doc_id] for doc_id in ids])
+
+def attach_ann(index, store, rows):
+    """Attach an IVF index, restoring centroids and list assignments from ANN_FILE when present"""
+    ann = IVFIndex(nlist=int(os.environ.get("MEMORY_ANN_NLIST", "0")) or None,
+                   nprobe=int(os.environ.get("MEMORY_ANN_NPROBE", "8")),
+                   min_train=int(os.environ.get("MEMORY_ANN_MIN_TRAIN", "4096")))
+    labels = None
+    if os.path.exists(ANN_FILE):
+        try:
+            labels = ann.load(ANN_FILE, rows, store.generation)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Ignoring unreadable ANN index: {e}")
+            ann = IVFIndex(nlist=ann.nlist, nprobe=ann.nprobe, min_train=ann.min_train)
+    index.attach_ann(ann, labels)
+    _ann_saved.update(rows=len(index), trained_size=ann.trained_size, generation=store.generation)
+
+def maybe_save_ann(index, store):
+    """Persist the IVF index after (re)training, store compaction, or every ANN_SAVE_EVERY rows"""
+    ann = index.ann
+    if ann is None or not ann.trained:
+        return
+    if (ann.trained_size == _ann_saved["trained_size"] and store.generation == _ann_saved["generation"]
+            and len(index) - _ann_saved["rows"] < ANN_SAVE_EVERY):
+        return
+    live = index.live_rows()
+    keys = np.array([store.row_of.get(index.ids[r], -1) for r in live], dtype=np.int64)
+    labels = ann.labels(len(index.ids))[live]
+    stored = keys >= 0
+    ann.save(ANN_FILE, keys[stored], labels[stored], store.generation)
+    _ann_saved.update(rows=len(index), trained_size=ann.trained_size, generation=store.generation)
+
 def compress_memories(memories):
-    """Every 100 memories, compress old ones into lessons"""
-    if len(memories) <= 100:
-        return memories
-    
+    """Every 100 memories, compress old ones into lessons.
+
+    Runs on the compactor thread: the LLM and embedding calls happen without
+    holding the index lock, then the lesson insert and the tombstones are
+    applied in one write-locked step so readers switch over atomically.
+    """
     # Group similar memories by clustering
-    old_memories = memories[:-50]  # Keep recent 50
+    old_memories = memories[:-KEEP_RECENT] if KEEP_RECENT else memories  # Keep recent 50
+    if not old_memories:
+        return memories
     
     # Extract patterns and create compressed lesson
     patterns = extract_patterns(old_memories)
     lesson_text = f"Learned from {len(old_memories)} experiences: {patterns}"
     
-    lesson = {
-        "id": f"lesson_{int(time.time())}",
-        "type": "compressed_lesson",
-        "count": len(old_memories),
-        "text": lesson_text,
-        "embedding": get_embedding(lesson_text)
-    }
-    
-    # Save compressed lessons separately
-    lessons = load_lessons()
-    lessons.append(lesson)
-    save_lessons(lessons)
+    lesson_id = f"lesson_{int(time.time())}"
+    embedding = get_embedding(lesson_text)
+
+    with _lock.write():
+        store = get_store()
+        index = get_index()
+        if embedding:
+            store.add(lesson_id, lesson_text, embedding, type="compressed_lesson", count=len(old_memories),
+                      ts=time.time(), source="compressor")
+            index.add(lesson_id, lesson_text, embedding, entry_metadata(store.get(lesson_id)))
+
+        # Tombstone the compressed memories; compaction reclaims their rows
+        # (skipping ids that were re-added since the snapshot was taken)
+        old_ids = [m["id"] for m in old_memories
+                   if m["id"] in store.row_of and store.entries[store.row_of[m["id"]]] is m]
+        store.delete(old_ids)
+        for doc_id in old_ids:
+            index.remove(doc_id)
+        store.maybe_compact()
+        maybe_save_ann(index, store)
     
     # Return only recent memories + pointer to lessons
-    return memories[-50:]
+    return memories[len(old_memories):]
+
+class MemoryCompactor:
+    """Background worker that runs compress_memories off the request path.
+
+    Compression is due when there are more than `threshold` memories, or when
+    the oldest memory outside the recent window is older than `max_age`
+    seconds. Runs are at least `min_interval` seconds apart.
+    """
+
+    def __init__(self, threshold, max_age=0, min_interval=60, poll_interval=60):
+        self.threshold = threshold
+        self.max_age = max_age
+        self.min_interval = min_interval
+        self.poll_interval = poll_interval
+        self.last_run = 0.0
+        self.runs = 0
+        self._wake = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def schedule(self):
+        """Ask the worker to re-check the policy, starting it on first use"""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="memory-compactor", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def due(self, memories, now):
+        if not self.threshold and not self.max_age:
+            return False
+        if now - self.last_run < self.min_interval:
+            return False
+        if self.threshold and len(memories) > self.threshold:
+            return True
+        old = memories[:-KEEP_RECENT] if KEEP_RECENT else memories
+        return bool(self.max_age and old and now - old[0].get("ts", 0) > self.max_age)
+
+    def run_once(self):
+        with _lock.read():
+            memories = load_memory()
+        now = time.time()
+        if not self.due(memories, now):
+            return False
+        self.last_run = now
+        compress_memories(memories)
+        self.runs += 1
+        return True
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Memory compaction failed: {e}")
+
+compactor = MemoryCompactor(
+    COMPRESSION_THRESHOLD,
+    max_age=float(os.environ.get("MEMORY_COMPRESSION_MAX_AGE_SEC", "0")),
+    min_interval=float(os.environ.get("MEMORY_COMPRESSION_MIN_INTERVAL_SEC", "60")),
+)
 
 def extract_patterns(memories):
     """Use LLM to extract key patterns from memories"""
@@ -62,96 +264,150 @@ def extract_patterns(memories):
     prompt = f"Extract the single most important pattern from these experiences in 20 words: {texts}"
     
     try:
-        model = genai.GenerativeModel("gemini-1.5-pro-latest")
-        response = model.generate_content(prompt)
-        return response.text[:100]  # Limit response length
+        response = llm_backend.generate("gemini-1.5-pro-latest", prompt)
+        return response[:100]  # Limit response length
     except:
         return "General operational patterns observed"
 
 def load_memory():
-    if not os.path.exists(MEMORY_FILE):
-        return []
-    with open(MEMORY_FILE, 'r') as f:
-        try:
-            memories = json.load(f)
-            # Auto-compress if too many
-            if len(memories) > 100:
-                memories = compress_memories(memories)
-                save_memory(memories)
-            return memories
-        except json.JSONDecodeError:
-            return []
-
-def save_memory(memory):
-    os.makedirs(os.path.dirname(MEMORY_FILE), exist_ok=True)
-    with open(MEMORY_FILE, 'w') as f:
-        json.dump(memory, f)
+    return [e for _, e in get_store().live_entries() if e.get("type") != "compressed_lesson"]
 
 def load_lessons():
-    if not os.path.exists(LESSONS_FILE):
-        return []
-    with open(LESSONS_FILE, 'r') as f:
-        try:
-            return json.load(f)
-        except:
-            return []
-
-def save_lessons(lessons):
-    os.makedirs(os.path.dirname(LESSONS_FILE), exist_ok=True)
-    with open(LESSONS_FILE, 'w') as f:
-        json.dump(lessons, f)
-
-class H(BaseHTTPRequestHandler):
-    def do_POST(self):
-        l = int(self.headers.get("Content-Length", 0))
-        data = json.loads(self.rfile.read(l).decode("utf-8") or "{}")
-
-        if self.path == "/_py/add":
-            text_to_add = data.get("text", "")
-            doc_id = data.get("id", "")
-            if not text_to_add or not doc_id:
-                self.send_response(400); self.end_headers(); self.wfile.write(b'{"error":"text and id are required"}'); return
-
-            embedding = get_embedding(text_to_add)
-            if not embedding:
-                self.send_response(500); self.end_headers(); self.wfile.write(b'{"error":"Failed to generate embedding"}'); return
-            
-            memory = load_memory()
-            memory = [entry for entry in memory if entry.get("id") != doc_id]
-            memory.append({"id": doc_id, "text": text_to_add, "embedding": embedding})
-            save_memory(memory)
-            self.send_response(200); self.send_header("Content-Type", "application/json"); self.end_headers()
-            self.wfile.write(json.dumps({"status": "ok", "entries": len(memory)}).encode("utf-8"))
-
-        elif self.path == "/_py/query":
-            query_text = data.get("query", "")
-            top_k = int(data.get("top_k", 3))
-            if not query_text:
-                self.send_response(400); self.end_headers(); self.wfile.write(b'{"error":"query is required"}'); return
-
-            query_embedding = get_embedding(query_text)
-            if not query_embedding:
-                self.send_response(500); self.end_headers(); self.wfile.write(b'{"error":"Failed to generate query embedding"}'); return
-            
-            # Search both memories and lessons
-            memory = load_memory()
-            lessons = load_lessons()
-            all_searchable = memory + lessons
-            
-            if not all_searchable:
-                self.send_response(200); self.send_header("Content-Type", "application/json"); self.end_headers()
-                self.wfile.write(json.dumps({"results": []}).encode("utf-8")); return
-
-            scores = [(cosine_similarity(query_embedding, entry["embedding"]), entry["text"]) 
-                     for entry in all_searchable if "embedding" in entry and entry["embedding"]]
-            scores.sort(key=lambda x: x[0], reverse=True)
-            
-            results = [{"score": float(score), "text": text} for score, text in scores[:top_k]]
-            self.send_response(200); self.send_header("Content-Type", "application/json"); self.end_headers()
-            self.wfile.write(json.dumps({"results": results}).encode("utf-8"))
-
-        else:
-            self.send_response(404); self.end_headers()
+    return [e for _, e in get_store().live_entries() if e.get("type") == "compressed_lesson"]
+
+def add_documents(docs):
+    """Embed and apply a batch of {id, text} docs in one store append and one index update.
+
+    Docs may also carry kind / loop_id / source; anything missing is derived from the id.
+    """
+    embeddings = get_embeddings([d["text"] for d in docs])
+    added = [(d, e) for d, e in zip(docs, embeddings) if e]
+    failed = [d["id"] for d, e in zip(docs, embeddings) if not e]
+    with _lock.write():
+        if added:
+            now = time.time()
+            entries = [entry_metadata(dict(d, ts=now)) for d, _ in added]
+            get_store().add_many([dict(m, id=d["id"], text=d["text"]) for (d, _), m in zip(added, entries)],
+                                 [e for _, e in added])
+            index = get_index()
+            if index.projection is None and not len(index) and PROJECTION != "none":
+                # First vectors in a fresh store: the input dimension is known only now
+                index.projection = make_projection(PROJECTION, len(added[0][1]), PROJECTION_DIM)
+            index.add_many([d["id"] for d, _ in added], [d["text"] for d, _ in added], [e for _, e in added], entries)
+        entries = len(get_store())
+        maybe_save_ann(get_index(), get_store())
+    # Auto-compress if too many, in the background
+    compactor.schedule()
+    return {"added": len(added), "failed": failed, "entries": entries}
+
+class AddCoalescer:
+    """Merges single adds that arrive within `window` seconds into one add_documents call.
+
+    The first caller of a batch becomes its leader: it takes everything queued
+    so far and applies it; the others block until their batch is done. The
+    leader waits out the window first only while another batch is being
+    applied, so a lone add does not pay for it.
+    """
+
+    def __init__(self, apply, window):
+        self.apply = apply
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = []
+        self._applying = 0  # batches taken but not yet applied
+
+    def submit(self, doc):
+        slot = {"doc": doc, "done": threading.Event(), "result": None, "error": None}
+        with self._lock:
+            self._pending.append(slot)
+            leader = len(self._pending) == 1
+            contended = self._applying > 0
+        if leader:
+            if contended:
+                time.sleep(self.window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._applying += 1
+            try:
+                result = self.apply([s["doc"] for s in batch])
+                for s in batch:
+                    s["result"] = result
+            except Exception as e:
+                for s in batch:
+                    s["error"] = e
+            finally:
+                with self._lock:
+                    self._applying -= 1
+                for s in batch:
+                    s["done"].set()
+        slot["done"].wait()
+        if slot["error"]:
+            raise slot["error"]
+        return slot["result"]
+
+add_coalescer = AddCoalescer(add_documents, ADD_COALESCE_SEC)
+
+class H(JSONHandler):
+    post_routes = {"/_py/add": "handle_add", "/_py/add_batch": "handle_add_batch", "/_py/query": "handle_query"}
+    get_routes = {"/_py/stats": "handle_stats"}
+
+    def handle_add(self, data):
+        text_to_add = data.get("text", "")
+        doc_id = data.get("id", "")
+        if not text_to_add or not doc_id:
+            self.send_json({"error": "text and id are required"}, 400); return
+
+        doc = {"id": doc_id, "text": text_to_add}
+        doc.update({f: data[f] for f in META_FIELDS if data.get(f) is not None})
+        result = add_coalescer.submit(doc)
+        if doc_id in result["failed"]:
+            self.send_json({"error": "Failed to generate embedding"}, 500); return
+
+        self.send_json({"status": "ok", "entries": result["entries"]})
+
+    def handle_add_batch(self, data):
+        docs = [dict({f: d[f] for f in META_FIELDS if d.get(f) is not None}, id=d.get("id"), text=d.get("text"))
+                for d in data.get("documents", [])]
+        invalid = [d["id"] for d in docs if not d["text"] or not d["id"]]
+        docs = [d for d in docs if d["text"] and d["id"]]
+        if not docs:
+            self.send_json({"error": "documents with text and id are required"}, 400); return
+
+        result = add_documents(docs)
+        result["failed"] += invalid
+        if not result["added"]:
+            self.send_json({"error": "Failed to generate embeddings"}, 500); return
+
+        self.send_json(dict(result, status="ok"))
+
+    def handle_query(self, data):
+        query_text = data.get("query", "")
+        top_k = int(data.get("top_k", 3))
+        exact = bool(data.get("exact", False))
+        nprobe = int(data["nprobe"]) if data.get("nprobe") else None
+        where = {k: v for k, v in (data.get("filter") or {}).items() if k in FILTER_FIELDS and v is not None}
+        if not query_text:
+            self.send_json({"error": "query is required"}, 400); return
+
+        query_embedding = get_embedding(query_text)
+        if not query_embedding:
+            self.send_json({"error": "Failed to generate query embedding"}, 500); return
+
+        # Search both memories and lessons, or only the entries matching the filter
+        with _lock.read():
+            hits = get_index().search(query_embedding, top_k, exact=exact, nprobe=nprobe,
+                                      rerank=read_exact if RERANK_K else None, rerank_k=RERANK_K, where=where)
+        results = [{"score": score, "id": doc_id, "text": text} for score, doc_id, text in hits]
+        self.send_json({"results": results})
+
+    def handle_stats(self, data):
+        with _lock.read():
+            index = get_index()
+            entries = len(index)
+            index_bytes = index.nbytes()
+            kinds = index.meta.counts("kind", index.live_rows())
+        self.send_json({"entries": entries, "index_bytes": index_bytes, "index_codec": index.codec.kind,
+                        "kinds": kinds, "embedding_cache": embedding_cache.stats()})
 
 if __name__ == "__main__":
-    HTTPServer(("0.0.0.0", PORT), H).serve_forever()
\ No newline at end of file
+    serve(H, PORT)
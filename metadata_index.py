@@ -0,0 +1,145 @@
+# metadata_index.py - Per-row metadata and filter indexes for the memory index
+import re
+import bisect
+import numpy as np
+
+# Ids follow the server's conventions: report_<loopId>, reflection_<loopId>, lesson_<ts>
+ID_PATTERN = re.compile(r'^(report|reflection|lesson)_(\d+)$')
+BITMAP_FIELDS = ("kind", "source")
+
+
+def parse_id(doc_id):
+    """Derive {"kind", "loop_id"} from a conventional memory id"""
+    match = ID_PATTERN.match(doc_id or "")
+    if not match:
+        return {"kind": "memory", "loop_id": -1}
+    kind, number = match.group(1), int(match.group(2))
+    return {"kind": kind, "loop_id": number if kind != "lesson" else -1}
+
+
+class MetadataIndex:
+    """Row-aligned metadata with a bitmap per kind/source value and a time-sorted row order.
+
+    select() turns a filter into the matching rows without touching vectors,
+    so filtered searches only score that subset.
+    """
+
+    def __init__(self, capacity=1024):
+        self._capacity = capacity
+        self._n = 0
+        self.ts = np.zeros(0, dtype=np.float64)
+        self.loop_id = np.zeros(0, dtype=np.int64)
+        self.bitmaps = {field: {} for field in BITMAP_FIELDS}
+        self._in_time_order = True  # rows were appended with non-decreasing ts
+        self._last_ts = 0.0
+        self._time_order = None     # cached argsort of ts when they were not
+        self._loops = []           # distinct loop ids with a live row, sorted
+        self._loop_rows = {}       # loop id -> live rows
+
+    def _reserve(self, rows):
+        if self._n + rows <= len(self.ts):
+            return
+        capacity = max(self._capacity, 2 * (self._n + rows))
+        self.ts = np.resize(self.ts, capacity)
+        self.loop_id = np.resize(self.loop_id, capacity)
+        for values in self.bitmaps.values():
+            for value, bitmap in values.items():
+                grown = np.zeros(capacity, dtype=bool)
+                grown[:self._n] = bitmap[:self._n]
+                values[value] = grown
+
+    def _bitmap(self, field, value):
+        values = self.bitmaps[field]
+        if value not in values:
+            values[value] = np.zeros(len(self.ts), dtype=bool)
+        return values[value]
+
+    def add(self, start, metas):
+        """Record metadata for rows start..start+len(metas); rows must be appended in order"""
+        self._reserve(start + len(metas) - self._n)
+        for offset, meta in enumerate(metas):
+            row = start + offset
+            ts = float(meta.get("ts") or 0)
+            loop_id = int(meta.get("loop_id", -1))
+            self.ts[row] = ts
+            self.loop_id[row] = loop_id
+            for field in BITMAP_FIELDS:
+                self._bitmap(field, meta.get(field) or "unknown")[row] = True
+            if ts < self._last_ts:
+                self._in_time_order = False
+            self._last_ts = max(self._last_ts, ts)
+            if loop_id >= 0:
+                self._loop_rows[loop_id] = self._loop_rows.get(loop_id, 0) + 1
+                if self._loop_rows[loop_id] == 1:
+                    bisect.insort(self._loops, loop_id)
+        self._n = start + len(metas)
+        self._time_order = None
+
+    def remove(self, row):
+        """Note that a row was tombstoned; a loop whose last live row goes no longer counts"""
+        if row >= self._n:
+            return  # replaced within the batch being added, before its metadata was recorded
+        loop_id = int(self.loop_id[row])
+        if loop_id < 0 or loop_id not in self._loop_rows:
+            return
+        self._loop_rows[loop_id] -= 1
+        if not self._loop_rows[loop_id]:
+            del self._loop_rows[loop_id]
+            del self._loops[bisect.bisect_left(self._loops, loop_id)]
+
+    def compact(self, live):
+        """Keep only `live` rows, renumbered 0..len(live)-1"""
+        self.ts = self.ts[live].copy()
+        self.loop_id = self.loop_id[live].copy()
+        for values in self.bitmaps.values():
+            for value in list(values):
+                values[value] = values[value][live].copy()
+        self._n = len(live)
+        self._time_order = None
+        loops, rows = np.unique(self.loop_id[self.loop_id >= 0], return_counts=True)
+        self._loop_rows = dict(zip(loops.tolist(), rows.tolist()))
+        self._loops = loops.tolist()
+
+    def _sorted_times(self):
+        if self._in_time_order:
+            return np.arange(self._n), self.ts[:self._n]
+        if self._time_order is None:
+            self._time_order = np.argsort(self.ts[:self._n], kind="stable")
+        return self._time_order, self.ts[self._time_order]
+
+    def select(self, kinds=None, sources=None, since=None, until=None, last_loops=None):
+        """Rows matching every given condition, in ascending row order"""
+        if since is not None or until is not None:
+            order, times = self._sorted_times()
+            lo = np.searchsorted(times, since, side="left") if since is not None else 0
+            hi = np.searchsorted(times, until, side="right") if until is not None else len(times)
+            mask = np.zeros(self._n, dtype=bool)
+            mask[order[lo:hi]] = True
+        else:
+            mask = np.ones(self._n, dtype=bool)
+
+        for field, wanted in (("kind", kinds), ("source", sources)):
+            if wanted:
+                wanted = [wanted] if isinstance(wanted, str) else wanted
+                values = self.bitmaps[field]
+                allowed = np.zeros(self._n, dtype=bool)
+                for value in wanted:
+                    if value in values:
+                        allowed |= values[value][:self._n]
+                mask &= allowed
+
+        if last_loops:
+            if not self._loops:
+                return np.zeros(0, dtype=np.int64)
+            threshold = self._loops[-min(int(last_loops), len(self._loops))]
+            mask &= self.loop_id[:self._n] >= threshold
+        return np.flatnonzero(mask)
+
+    def counts(self, field="kind", rows=None):
+        """Number of rows (all, or only `rows`) per value of a bitmap field"""
+        counts = {}
+        for value, bitmap in self.bitmaps[field].items():
+            hits = int(bitmap[:self._n].sum() if rows is None else bitmap[rows].sum())
+            if hits:
+                counts[value] = hits
+        return counts
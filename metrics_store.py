@@ -0,0 +1,154 @@
+# metrics_store.py - Incrementally maintained system metrics for the system agent
+#
+# server_v2.js reports one event per loop (POST /_py/metrics/loop on the system
+# agent); each event updates running totals, gauges and rolling windows that
+# are saved to data/metrics.json, so reading the metrics never scans data/.
+# Byte totals only see the per-loop files the loop writes under data/ and the
+# files its cleanups delete there (not site/, and not the caches and stores
+# that grow in place); run `python3 metrics_store.py rebuild` to re-measure
+# data/ from disk.
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+
+WINDOWS = (10, 100)  # rolling windows, in loops
+TOTALS = ("loops", "loops_errored", "loops_with_failures", "steps_succeeded", "steps_failed",
+          "steps_skipped", "bytes_written", "bytes_freed")
+
+
+class MetricsStore:
+    def __init__(self, path="data/metrics.json"):
+        self.path = path
+        self._lock = threading.Lock()
+        self.totals = dict.fromkeys(TOTALS, 0)
+        self.gauges = {"data_bytes": 0, "memory_entries": 0, "last_loop_id": None, "last_loop_ts": None}
+        self.recent = deque(maxlen=max(WINDOWS))  # per loop: {"loop_id", "failed", "duration_ms"}
+        self._sums = {w: {"failed": 0, "duration_ms": 0.0} for w in WINDOWS}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            data_dir = os.path.dirname(self.path) or "."
+            if os.path.isdir(data_dir) and os.listdir(data_dir):
+                # Upgraded node: data/ predates the metrics, so measure it rather than start blank
+                print(f"No {self.path}; rebuilding metrics from {data_dir}")
+                self.rebuild(data_dir)
+            return
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable metrics {self.path}: {e}; run `python3 metrics_store.py rebuild`")
+            return
+        self.totals.update(saved.get("totals", {}))
+        self.gauges.update(saved.get("gauges", {}))
+        for loop in saved.get("recent", []):
+            self._push(loop)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as f:
+            f.write(json.dumps({"totals": self.totals, "gauges": self.gauges, "recent": list(self.recent)}))
+        os.replace(tmp, self.path)
+
+    def _push(self, loop):
+        """Append to the rolling windows, subtracting the loops that fall out of each"""
+        for w, sums in self._sums.items():
+            if len(self.recent) >= w:
+                leaving = self.recent[-w]
+                sums["failed"] -= leaving["failed"]
+                sums["duration_ms"] -= leaving["duration_ms"]
+            sums["failed"] += loop["failed"]
+            sums["duration_ms"] += loop["duration_ms"]
+        self.recent.append(loop)
+
+    def record_loop(self, event):
+        """Fold one loop's event into the metrics.
+
+        event: {loop_id, error, steps_succeeded, steps_failed, steps_skipped,
+        duration_ms, bytes_written, bytes_freed, memory_entries}; missing fields count as 0.
+        """
+        steps_failed = int(event.get("steps_failed") or 0)
+        failed = bool(event.get("error")) or steps_failed > 0
+        with self._lock:
+            t = self.totals
+            t["loops"] += 1
+            t["loops_errored"] += bool(event.get("error"))
+            t["loops_with_failures"] += failed
+            t["steps_succeeded"] += int(event.get("steps_succeeded") or 0)
+            t["steps_failed"] += steps_failed
+            t["steps_skipped"] += int(event.get("steps_skipped") or 0)
+            written, freed = int(event.get("bytes_written") or 0), int(event.get("bytes_freed") or 0)
+            t["bytes_written"] += written
+            t["bytes_freed"] += freed
+            g = self.gauges
+            g["data_bytes"] = max(0, g["data_bytes"] + written - freed)
+            if event.get("memory_entries") is not None:
+                g["memory_entries"] = int(event["memory_entries"])
+            g["last_loop_id"] = event.get("loop_id")
+            g["last_loop_ts"] = time.time()
+            self._push({"loop_id": event.get("loop_id"), "failed": int(failed),
+                        "duration_ms": float(event.get("duration_ms") or 0)})
+            self.save()
+
+    def snapshot(self):
+        """Totals, gauges and per-window failure rate and mean loop time, without touching the disk"""
+        with self._lock:
+            windows = {}
+            for w, sums in self._sums.items():
+                n = min(w, len(self.recent))
+                windows[str(w)] = {"loops": n,
+                                   "failure_rate": sums["failed"] / n if n else 0,
+                                   "mean_duration_ms": sums["duration_ms"] / n if n else 0}
+            return {"totals": dict(self.totals), "gauges": dict(self.gauges), "windows": windows}
+
+    def rebuild(self, data_dir="data"):
+        """Recover from the files on disk: re-measure data_bytes and memory_entries, and if no
+        history survives, estimate loop counts and the rolling windows from artifacts"""
+        data_bytes = 0
+        pending = [data_dir]
+        while pending:
+            with os.scandir(pending.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        data_bytes += entry.stat(follow_symlinks=False).st_size
+
+        memory_entries = 0
+        if os.path.exists(os.path.join(data_dir, "memory_store")):
+            from vector_store import VectorStore
+            # Read-only: memory_v2 may be appending, and a repairing open would truncate under it
+            memory_entries = len(VectorStore(os.path.join(data_dir, "memory_store"), read_only=True))
+
+        artifacts = os.path.join(data_dir, "artifacts")
+        names = sorted(os.listdir(artifacts)) if os.path.isdir(artifacts) else []
+        with self._lock:
+            self.gauges["data_bytes"] = data_bytes
+            self.gauges["memory_entries"] = memory_entries
+            if not self.recent:
+                reports = [n for n in names if n.endswith("_report.md")][-max(WINDOWS):]
+                for name in reports:
+                    with open(os.path.join(artifacts, name), 'r', errors="replace") as f:
+                        failed = int("FAILED" in f.read())
+                    self._push({"loop_id": name.split("_", 1)[0], "failed": failed, "duration_ms": 0.0})
+                self.totals["loops"] = max(self.totals["loops"], sum(n.endswith("_plan.json") for n in names))
+                self.totals["loops_with_failures"] = max(self.totals["loops_with_failures"],
+                                                         sum(loop["failed"] for loop in self.recent))
+            self.save()
+        return self.snapshot()
+
+
+if __name__ == "__main__":
+    # Usage: python3 metrics_store.py rebuild|show [data_dir]
+    command = sys.argv[1] if len(sys.argv) > 1 else "show"
+    data_dir = sys.argv[2] if len(sys.argv) > 2 else "data"
+    store = MetricsStore(os.path.join(data_dir, "metrics.json"))
+    if command == "rebuild":
+        print(json.dumps(store.rebuild(data_dir), indent=2))
+    else:
+        print(json.dumps(store.snapshot(), indent=2))
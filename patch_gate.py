@@ -0,0 +1,248 @@
+# patch_gate.py - Compile, import and benchmark system agent patches before they touch the live tree
+#
+# A patch set is applied to a scratch copy of the source tree (data/, site/ and
+# .git are left out). Touched Python files must byte-compile and import,
+# touched JS and shell files must pass `node --check` / `bash -n`, and every
+# benchmark in PATCH_GATE_BENCHMARKS must stay within PATCH_GATE_MAX_REGRESSION
+# of the unpatched tree, itself measured from a second scratch copy so both
+# run alike and neither touches live data. Only then are the touched files
+# copied into the live tree. Benchmarks run in subprocesses so each tree is
+# imported fresh:
+#   python3 patch_gate.py bench <tree> [benchmark ...]   prints {name: {"ms_per_op"} or {"error"}}
+import gc
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+
+MAX_REGRESSION = float(os.environ.get("PATCH_GATE_MAX_REGRESSION", "0.10"))
+BENCHMARKS = [b for b in os.environ.get("PATCH_GATE_BENCHMARKS", "memory_query,failure_lookup,executor").split(",") if b]
+REPEATS = 5          # timed runs per benchmark, at least
+MIN_SECONDS = 0.5    # ...and keep timing until this much has been spent
+ROUNDS = 3           # baseline and patched trees are measured alternately, keeping each one's best
+TIMEOUT = 300
+SCRATCH_IGNORE = shutil.ignore_patterns("data", "site", ".git", "node_modules", "__pycache__", "*.pyc")
+
+
+# --- Benchmarks: each returns (callable, operations per call), run in the tree being measured ---
+
+def bench_memory_query():
+    """Exact top-3 search over 5000 random 256-dim memories"""
+    import numpy as np
+    from vector_index import VectorIndex
+    rng = np.random.default_rng(0)
+    index = VectorIndex()
+    vectors = rng.standard_normal((5000, 256), dtype=np.float32)
+    index.add_many([f"m{i}" for i in range(5000)], [f"memory {i}" for i in range(5000)], vectors)
+    queries = rng.standard_normal((50, 256), dtype=np.float32).tolist()
+
+    def run():
+        for query in queries:
+            index.search(query, 3, exact=True)
+    return run, len(queries)
+
+
+def bench_failure_lookup():
+    """should_skip_many over 200 commands against 500 learned patterns"""
+    from failure_db import FailureDB
+    workdir = tempfile.mkdtemp(prefix="gate_failure_db_")
+    db = FailureDB(os.path.join(workdir, "failure_patterns.json"), snapshot_every=10 ** 9)
+    # Two failures each: a third would file a system agent request in the tree being measured
+    db.learn_failures([{"bash": f"tool{i % 500} --flag{i % 7} data/file{i}.txt", "stderr": "exit 1"}
+                       for i in range(1000)])
+    shutil.rmtree(workdir, ignore_errors=True)
+    commands = [f"tool{i % 600} --flag{i % 5} other/path{i}.txt" for i in range(200)]
+
+    def run():
+        db.should_skip_many(commands)
+    return run, len(commands)
+
+
+def bench_executor():
+    """executor.py over ten trivial allowed steps: a chain of five and five independent ones"""
+    from executor import execute
+    steps = [{"id": f"s{i}", "title": f"step {i}", "bash": f"echo {i}", "timeout_sec": 10,
+              "depends_on": [f"s{i - 1}"] if 0 < i < 5 else []} for i in range(10)]
+
+    def run():
+        result = execute(steps)
+        if len(result["success"]) != len(steps):
+            raise RuntimeError(f"executor failed steps: {result['failed'][:2]}")
+    return run, 10
+
+
+def run_benchmarks(names):
+    """{name: {"ms_per_op"}} using the fastest timed run, or {name: {"error"}}"""
+    results = {}
+    for name in names:
+        try:
+            run, ops = globals()[f"bench_{name}"]()
+            run()  # warm-up
+            best, runs, spent = float("inf"), 0, 0.0
+            while runs < REPEATS or spent < MIN_SECONDS:
+                gc.collect()
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+                best, runs, spent = min(best, elapsed), runs + 1, spent + elapsed
+            results[name] = {"ms_per_op": best / ops * 1000}
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"[:300]}
+    return results
+
+
+# --- Gate ---
+
+def _run(args, cwd):
+    env = dict(os.environ, LLM_BACKEND="replay", PYTHONDONTWRITEBYTECODE="1",
+               OMP_NUM_THREADS="1", OPENBLAS_NUM_THREADS="1", MKL_NUM_THREADS="1")  # steadier timings
+    return subprocess.run(args, cwd=cwd, env=env, capture_output=True, text=True, timeout=TIMEOUT)
+
+
+def measure(tree, names=None):
+    """Benchmarks for the source tree at tree, in a fresh interpreter"""
+    names = names or BENCHMARKS
+    out = _run([sys.executable, os.path.abspath(__file__), "bench", os.path.abspath(tree)] + names, tree)
+    try:
+        return json.loads(out.stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        return {name: {"error": f"benchmark runner failed: {out.stderr[-300:]}"} for name in names}
+
+
+def _keep_best(best, results):
+    """Fold one round into best: the fastest time per benchmark, errors sticking"""
+    for name, result in results.items():
+        previous = best.get(name)
+        if previous is None or "error" in result:
+            best[name] = result
+        elif "error" not in previous:
+            previous["ms_per_op"] = min(previous["ms_per_op"], result["ms_per_op"])
+
+
+def check_file(tree, filename):
+    """None if the file compiles (and imports, for Python), else the error"""
+    if filename.endswith(".py"):
+        module = filename[:-3].replace("/", ".")
+        args = [sys.executable, "-c", "import py_compile, importlib, sys; "
+                "py_compile.compile(sys.argv[1], doraise=True); importlib.import_module(sys.argv[2])",
+                filename, module]
+    elif filename.endswith(".js"):
+        args = ["node", "--check", filename]
+    elif filename.endswith(".sh"):
+        args = ["bash", "-n", filename]
+    elif filename.endswith(".json"):
+        args = [sys.executable, "-c", "import json, sys; json.load(open(sys.argv[1]))", filename]
+    else:
+        return None
+    try:
+        out = _run(args, tree)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return str(e)
+    return None if out.returncode == 0 else (out.stderr or out.stdout)[-500:]
+
+
+def apply_to(tree, patches):
+    """Apply patches inside tree; returns (per-patch results, touched files)"""
+    results, touched = [], []
+    for patch in patches:
+        filename = patch.get("file", "")
+        path = os.path.normpath(os.path.join(tree, filename))
+        if os.path.isabs(filename) or not path.startswith(os.path.abspath(tree) + os.sep):
+            results.append({"file": filename, "status": "outside the source tree"})
+            continue
+        if not os.path.exists(path):
+            results.append({"file": filename, "status": "not found"})
+            continue
+        with open(path, 'r') as f:
+            content = f.read()
+        if patch.get("old_code") and patch["old_code"] in content:
+            with open(path, 'w') as f:
+                f.write(content.replace(patch["old_code"], patch.get("new_code", "")))
+            results.append({"file": filename, "status": "patched", "description": patch.get("description", "")})
+            rel = os.path.relpath(path, tree)
+            if rel not in touched:
+                touched.append(rel)
+        else:
+            results.append({"file": filename, "status": "pattern not found"})
+    return results, touched
+
+
+def gate(patches, root=".", max_regression=MAX_REGRESSION, benchmarks=None):
+    """Apply patches to the live tree at root only if they compile, import and keep the benchmarks in budget.
+
+    Returns {"promoted", "reason", "patch_results", "checks", "benchmarks", "max_regression"};
+    benchmarks maps each name to baseline/patched ms per operation and the relative delta.
+    """
+    root = os.path.abspath(root)
+    report = {"promoted": False, "reason": "", "patch_results": [], "checks": {}, "benchmarks": {},
+              "max_regression": max_regression}
+    scratch = tempfile.mkdtemp(prefix="patch_gate_")
+    try:
+        _evaluate(report, patches, root, scratch, max_regression, benchmarks)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    if not report["promoted"]:
+        for result in report["patch_results"]:
+            if result["status"] == "patched":
+                result["status"] = f"rejected: {report['reason']}"
+    return report
+
+
+def _evaluate(report, patches, root, scratch, max_regression, benchmarks):
+    base, tree = os.path.join(scratch, "baseline"), os.path.join(scratch, "patched")
+    for copy in (base, tree):
+        shutil.copytree(root, copy, ignore=SCRATCH_IGNORE, symlinks=True)
+    report["patch_results"], touched = apply_to(tree, patches)
+    if not touched:
+        report["reason"] = "no patch applied"
+        return
+
+    for filename in touched:
+        report["checks"][filename] = check_file(tree, filename) or "ok"
+    broken = [f for f, status in report["checks"].items() if status != "ok"]
+    if broken:
+        report["reason"] = f"does not compile/import: {', '.join(broken)}"
+        return
+
+    baseline, patched = {}, {}
+    for _ in range(ROUNDS):
+        _keep_best(baseline, measure(base, benchmarks))
+        _keep_best(patched, measure(tree, benchmarks))
+    regressions = []
+    for name, before in baseline.items():
+        after = patched.get(name, {"error": "missing"})
+        entry = {"baseline_ms": before.get("ms_per_op"), "patched_ms": after.get("ms_per_op")}
+        if "error" in after and "error" not in before:
+            entry["error"] = after["error"]
+            regressions.append(f"{name} broke")
+        elif "error" in before:
+            entry["error"] = f"baseline: {before['error']}"  # nothing to compare against
+        else:
+            entry["delta"] = after["ms_per_op"] / before["ms_per_op"] - 1
+            if entry["delta"] > max_regression:
+                regressions.append(f"{name} {entry['delta']:+.1%}")
+        report["benchmarks"][name] = entry
+    if regressions:
+        report["reason"] = f"over the {max_regression:.0%} regression budget: {', '.join(regressions)}"
+        return
+
+    for filename in touched:
+        src, dst = os.path.join(tree, filename), os.path.join(root, filename)
+        tmp = f"{dst}.gate.tmp"
+        shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+    report["promoted"] = True
+    report["reason"] = "ok"
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "bench":
+        tree = sys.argv[2]
+        sys.path[0] = tree  # measure the tree's modules, not the ones next to this script
+        os.chdir(tree)
+        print(json.dumps(run_benchmarks(sys.argv[3:] or BENCHMARKS)))
+    else:
+        print("Usage: python3 patch_gate.py bench <tree> [benchmark ...]")
@@ -1,11 +1,10 @@
 # planner.py — Gemini agent for generating a sequence of shell commands
-import os
 import json
 import re
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import google.generativeai as genai
+from llm_backend import generate, generate_stream
+from json_stream import ArrayItemStream
+from service import JSONHandler, serve
 
-genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
 PORT = 10005
 
 SYSTEM = """You are an expert AI planner. Your job is to break down a high-level mission into a series of small, concrete, and executable bash steps.
@@ -19,6 +18,7 @@ RULES:
 4.  **Filesystem**: Assume you are running in `/app`. All file paths should be relative to `/app`. Use `/app/data/artifacts` for temporary or output files.
 5.  **Timeouts**: Suggest a reasonable `timeout_sec` for each step. 30-60 seconds for simple commands, up to 300 for more complex tasks like analysis.
 6.  **Network**: Note if a step requires network access with `allow_net: true`. The executor policy may deny this.
+7.  **Dependencies**: Give every step a short unique `id` and list in `depends_on` the ids of the steps whose results it needs. Steps with an empty `depends_on` run in parallel, so only leave it empty when the step truly stands alone.
 
 OUTPUT: A strict JSON object with the following structure:
 {
@@ -26,23 +26,29 @@ OUTPUT: A strict JSON object with the following structure:
   "todo_md": "A markdown checklist of the steps you are proposing.",
   "steps": [
     {
+      "id": "s1",
       "title": "A short, descriptive title for the step",
       "bash": "The single, complete bash command to execute",
       "cwd": "/app",
       "allow_net": false,
-      "timeout_sec": 60
+      "timeout_sec": 60,
+      "depends_on": []
     }
   ]
 }
 """
 
-def plan(context: str, model: str):
-    m = genai.GenerativeModel(model)
-    r = m.generate_content([
+def messages(context: str):
+    return [
         {"role": "system", "parts": [SYSTEM]},
         {"role": "user", "parts": [context]}
-    ])
-    text = r.text or "{}"
+    ]
+
+def plan(context: str, model: str):
+    return parse_plan(generate(model, messages(context)))
+
+def parse_plan(text: str):
+    text = text or "{}"
     try:
         clean_text = re.sub(r'```json\n?|\n?```', '', text.strip())
         out = json.loads(clean_text)
@@ -55,17 +61,34 @@ def plan(context: str, model: str):
             "steps": []
         }
 
-class H(BaseHTTPRequestHandler):
-    def do_POST(self):
-        if self.path != "/_py/plan":
-            self.send_response(404); self.end_headers(); return
-        l = int(self.headers.get("Content-Length", 0))
-        data = json.loads(self.rfile.read(l).decode("utf-8") or "{}")
+def plan_stream(context: str, model: str):
+    """Yields {"type": "step", "index", "step"} as each step is generated, then {"type": "plan", "plan"}"""
+    parser = ArrayItemStream("steps")
+    steps, chunks = [], []
+    try:
+        for chunk in generate_stream(model, messages(context)):
+            chunks.append(chunk)
+            for step in parser.feed(chunk):
+                yield {"type": "step", "index": len(steps), "step": step}
+                steps.append(step)
+        out = parse_plan("".join(chunks))
+    except Exception as e:
+        out = parse_plan(f"stream failed: {e}")
+    if not out["steps"] and steps:
+        # The document as a whole did not parse (e.g. cut off); keep the steps already sent on
+        out["steps"] = steps
+    yield {"type": "plan", "plan": out}
+
+class H(JSONHandler):
+    post_routes = {"/_py/plan": "handle_plan"}
+
+    def handle_plan(self, data):
         model = data.get("model", "gemini-1.5-pro-latest")
         context = data.get("context", "")
+        if data.get("stream"):
+            self.send_ndjson(plan_stream(context, model)); return
         out = plan(context, model)
-        self.send_response(200); self.send_header("Content-Type", "application/json"); self.end_headers()
-        self.wfile.write(json.dumps(out).encode("utf-8"))
+        self.send_json(out)
 
 if __name__ == "__main__":
-    HTTPServer(("0.0.0.0", PORT), H).serve_forever()
+    serve(H, PORT)
@@ -0,0 +1,98 @@
+# quantize.py - Compressed embedding representations for the memory index and store
+import numpy as np
+
+CODECS = ("float32", "float16", "int8")
+
+
+class VectorCodec:
+    """Encodes float32 rows as float32, float16, or int8 with one float32 scale per row.
+
+    int8 rows are stored as a structured record {"q": int8[dim], "scale": float32}
+    so a single array (or memmap) holds both.
+    """
+
+    def __init__(self, kind="float32"):
+        if kind not in CODECS:
+            raise ValueError(f"Unknown vector codec '{kind}', expected one of {CODECS}")
+        self.kind = kind
+
+    def dtype(self, dim):
+        if self.kind == "int8":
+            return np.dtype([("q", np.int8, (dim,)), ("scale", np.float32)])
+        return np.dtype(self.kind)
+
+    def shape(self, rows, dim):
+        return (rows,) if self.kind == "int8" else (rows, dim)
+
+    def empty(self, rows, dim):
+        return np.zeros(self.shape(rows, dim), dtype=self.dtype(dim))
+
+    def bytes_per_vector(self, dim):
+        return self.dtype(dim).itemsize * (1 if self.kind == "int8" else dim)
+
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.kind != "int8":
+            return vectors.astype(self.kind)
+        codes = self.empty(len(vectors), vectors.shape[1])
+        scale = np.abs(vectors).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        codes["q"] = np.round(vectors / scale[:, None]).astype(np.int8)
+        codes["scale"] = scale
+        return codes
+
+    def decode(self, codes):
+        if self.kind != "int8":
+            return np.asarray(codes, dtype=np.float32)
+        return codes["q"].astype(np.float32) * codes["scale"][:, None]
+
+    def dot(self, codes, query, block=2048):
+        """codes @ query, decoding cache-sized blocks instead of the whole matrix"""
+        query = np.asarray(query, dtype=np.float32)
+        if self.kind == "float32":
+            return np.asarray(codes) @ query
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), block):
+            chunk = codes[start:start + block]
+            if self.kind == "int8":
+                scores[start:start + block] = (chunk["q"].astype(np.float32) @ query) * chunk["scale"]
+            else:
+                scores[start:start + block] = chunk.astype(np.float32) @ query
+        return scores
+
+
+class RandomProjection:
+    """Seeded Gaussian projection to a lower dimension (Johnson-Lindenstrauss)"""
+
+    def __init__(self, dim_in, dim_out, seed=0):
+        rng = np.random.default_rng(seed)
+        self.dim_out = dim_out
+        self.matrix = (rng.standard_normal((dim_in, dim_out)) / np.sqrt(dim_out)).astype(np.float32)
+
+    def __call__(self, vectors):
+        return np.asarray(vectors, dtype=np.float32) @ self.matrix
+
+
+class PCAProjection:
+    """Projection onto the top principal components of a sample"""
+
+    def __init__(self, sample, dim_out):
+        sample = np.asarray(sample, dtype=np.float32)
+        self.dim_out = dim_out
+        self.mean = sample.mean(axis=0)
+        _, _, vt = np.linalg.svd(sample - self.mean, full_matrices=False)
+        self.components = vt[:dim_out].astype(np.float32)
+
+    def __call__(self, vectors):
+        return (np.asarray(vectors, dtype=np.float32) - self.mean) @ self.components.T
+
+
+def make_projection(kind, dim_in, dim_out, sample=None, seed=0):
+    """Build a projection by name; PCA falls back to random without enough sample rows"""
+    if kind in (None, "", "none") or not dim_out or dim_out >= dim_in:
+        return None
+    if kind == "pca":
+        if sample is not None and len(sample) >= 2 * dim_out:
+            return PCAProjection(sample, dim_out)
+        print(f"Not enough vectors to fit PCA to {dim_out} dims, using a random projection")
+    return RandomProjection(dim_in, dim_out, seed)
@@ -1,10 +1,8 @@
 # reflector.py — short contemplation pass
-import os
 import json
 from http.server import BaseHTTPRequestHandler, HTTPServer
-import google.generativeai as genai
+from llm_backend import generate
 
-genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
 PORT=10002
 
 SYSTEM="""You are a contemplative AI agent, reflecting on a completed work cycle to guide the next one.
@@ -20,12 +18,11 @@ Keep the total reflection to ~150 words. Be insightful and forward-looking.
 """
 
 def reflect(prompt:str, model:str):
-    m = genai.GenerativeModel(model)
-    r = m.generate_content([
+    text = generate(model, [
         {"role":"system","parts":[SYSTEM]},
         {"role":"user","parts":[prompt]}
     ])
-    return {"reflection_md": r.text or "No reflection."}
+    return {"reflection_md": text or "No reflection."}
 
 class H(BaseHTTPRequestHandler):
     def do_POST(self):
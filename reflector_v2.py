@@ -1,10 +1,7 @@
 # reflector_v2.py - Enhanced with 30-word compression (Improvement #9)
-import os
-import json
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import google.generativeai as genai
+from llm_backend import generate
+from service import JSONHandler, serve
 
-genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
 PORT = 10002
 
 SYSTEM = """You are a contemplative AI agent, reflecting on a completed work cycle to guide the next one.
@@ -34,13 +31,12 @@ NEXT ACTION: Add execution time display to dashboard showing which commands are
 """
 
 def reflect(prompt: str, model: str):
-    m = genai.GenerativeModel(model)
-    r = m.generate_content([
+    reflection_text = generate(model, [
         {"role": "system", "parts": [SYSTEM]},
         {"role": "user", "parts": [prompt]}
     ])
     
-    reflection_text = r.text or "No reflection generated."
+    reflection_text = reflection_text or "No reflection generated."
     
     # Parse and enforce word limits
     lines = reflection_text.split('\n')
@@ -80,17 +76,14 @@ def reflect(prompt: str, model: str):
     
     return {"reflection_md": final_reflection}
 
-class H(BaseHTTPRequestHandler):
-    def do_POST(self):
-        if self.path != "/_py/reflect":
-            self.send_response(404); self.end_headers(); return
-        l = int(self.headers.get("Content-Length", 0))
-        data = json.loads(self.rfile.read(l).decode("utf-8") or "{}")
+class H(JSONHandler):
+    post_routes = {"/_py/reflect": "handle_reflect"}
+
+    def handle_reflect(self, data):
         model = data.get("model", "gemini-1.5-pro-latest")
         prompt = data.get("prompt", "")
         out = reflect(prompt, model)
-        self.send_response(200); self.send_header("Content-Type", "application/json"); self.end_headers()
-        self.wfile.write(json.dumps(out).encode("utf-8"))
+        self.send_json(out)
 
 if __name__ == "__main__":
-    HTTPServer(("0.0.0.0", PORT), H).serve_forever()
\ No newline at end of file
+    serve(H, PORT)
\ No newline at end of file
@@ -1,16 +1,17 @@
 # reviewer.py — Gemini reviewer/patcher for planned steps
-import os
 import json
 import re
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import google.generativeai as genai
+import queue
+import threading
+from llm_backend import generate
+from service import JSONHandler, serve
+from verdict_cache import verdict_cache
 
-genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
 PORT = 10001
 
 SYSTEM = """You are an autonomous code reviewer and security officer, acting as a critical AI human-in-the-loop.
 Input: {spec_md, todo_md, steps[]} from a planner.
-Each step = {title, bash, cwd?, allow_net?, timeout_sec?}
+Each step = {index, id?, title, bash, cwd?, allow_net?, timeout_sec?, depends_on?}
 
 Your job is to scrutinize, risk-assess, and patch every step for safety and efficiency.
 1.  **Risk Assessment**: For each step, provide a structured risk assessment.
@@ -27,10 +28,12 @@ Your job is to scrutinize, risk-assess, and patch every step for safety and effi
     - Example `apt-get install jq`: Patch to `echo '{"request": "install", "tool": "jq", "reason": "To parse JSON output from a previous step."}' > /app/data/tool_requests/$(date +%s)_jq.json`
 5.  **Timeouts**: Review the `timeout_sec` suggested by the planner. If it's missing or unreasonable, set a safe default (e.g., 60 for simple commands, 300 for complex ones).
 6.  **Policy**: Respect policy assumptions. If `allow_net=false`, do not approve commands that require the network (e.g., `curl`, `wget`).
+7.  **Index**: Every input step appears exactly once, in `approved_steps` or in `rejected`, carrying its `index` unchanged.
 
 Return strict JSON:
 {
   "approved_steps": [ {
+    "index": 0,
     "title": "...",
     "bash": "...",
     "cwd": "/app",
@@ -43,18 +46,17 @@ Return strict JSON:
     },
     "note": "Added a check to ensure the file exists before reading."
   } ],
-  "rejected": [ { "title": "...", "reason": "...", "original_bash": "..." } ],
+  "rejected": [ { "index": 1, "title": "...", "reason": "...", "original_bash": "..." } ],
   "summary_md": "Markdown summary of changes and justifications."
 }
 """
 
-def review(payload:dict, model:str):
-    m = genai.GenerativeModel(model)
-    r = m.generate_content([
+def review_with_model(payload:dict, model:str):
+    text = generate(model, [
         {"role":"system","parts":[SYSTEM]},
         {"role":"user","parts":[json.dumps(payload)]}
     ])
-    text = r.text or "{}"
+    text = text or "{}"
     try:
         clean_text = re.sub(r'```json\n?|\n?```', '', text.strip())
         out = json.loads(clean_text)
@@ -63,18 +65,136 @@ def review(payload:dict, model:str):
         out["summary_md"] = out.get("summary_md", "No summary.")
         return out
     except Exception as e:
-        return {"approved_steps": [], "rejected": [{"title":"parse_error","reason":f"LLM JSON parse failed: {e}","original_bash":text}], "summary_md":"Parse error."}
-
-class H(BaseHTTPRequestHandler):
-    def do_POST(self):
-        if self.path != "/_py/review":
-            self.send_response(404); self.end_headers(); return
-        l = int(self.headers.get("Content-Length",0))
-        data = json.loads(self.rfile.read(l).decode("utf-8") or "{}")
+        return {"approved_steps": [], "rejected": [{"title":"parse_error","reason":f"LLM JSON parse failed: {e}","original_bash":text}], "summary_md":"Parse error.", "parse_error": True}
+
+def _attribute(entries, pending, steps):
+    """Map the model's approved/rejected entries to plan indexes: by index, then by title"""
+    unclaimed = {i for i in pending}
+    by_title = {}
+    for i in pending:
+        by_title.setdefault(steps[i].get("title"), []).append(i)
+    attributed = []
+    for entry in entries:
+        i = entry.pop("index", None)
+        if not (isinstance(i, int) and i in unclaimed):
+            i = next((j for j in by_title.get(entry.get("title"), []) if j in unclaimed), None)
+        if i is not None:
+            unclaimed.discard(i)
+        attributed.append((i, entry))
+    return attributed
+
+def _with_plan_fields(i, entry, steps):
+    """Approved steps keep the plan's id and depends_on, which the executor schedules by.
+
+    Returns a copy: entry may be the verdict cache's own dict, shared with later plans.
+    """
+    entry = dict(entry)
+    if i < len(steps):
+        for field in ("id", "depends_on"):
+            if field in steps[i]:
+                entry[field] = steps[i][field]
+            else:
+                entry.pop(field, None)
+    return entry
+
+def review(payload:dict, model:str):
+    """Review only the steps without a cached verdict, then merge everything back in plan order"""
+    steps = payload.get("steps") or []
+    generation = verdict_cache.generation(SYSTEM, model)
+    cached = verdict_cache.get_many(steps, generation)
+    approved, rejected = [], []  # (plan index, entry)
+    for i, entry in enumerate(cached):
+        if entry and entry["approved"]:
+            approved.append((i, dict(entry["approved"], title=steps[i].get("title", entry["approved"].get("title")))))
+        if entry and entry["rejected"]:
+            rejected.append((i, dict(entry["rejected"], title=steps[i].get("title", entry["rejected"].get("title")))))
+    pending = [i for i, entry in enumerate(cached) if entry is None]
+    summary = f"All {len(steps)} steps had cached verdicts." if steps else "No steps to review."
+
+    if pending:
+        out = review_with_model(dict(payload, steps=[dict(steps[i], index=i) for i in pending]), model)
+        fresh_approved = _attribute(out["approved_steps"], pending, steps)
+        fresh_rejected = _attribute(out["rejected"], pending, steps)
+        if not out.get("parse_error"):
+            # Cache steps the model answered exactly once
+            answers = {}
+            for i, entry in fresh_approved:
+                answers.setdefault(i, []).append((entry, None))
+            for i, entry in fresh_rejected:
+                answers.setdefault(i, []).append((None, entry))
+            verdict_cache.put_many([(steps[i], *found[0]) for i, found in answers.items()
+                                    if i is not None and len(found) == 1], generation)
+        # Entries the model did not tie to a step keep their relative order after the attributed ones
+        approved += [(len(steps) if i is None else i, entry) for i, entry in fresh_approved]
+        rejected += [(len(steps) if i is None else i, entry) for i, entry in fresh_rejected]
+        summary = out["summary_md"]
+        if len(pending) < len(steps):
+            summary += f"\n\n{len(steps) - len(pending)} of {len(steps)} steps reused cached verdicts."
+
+    return {"approved_steps": [_with_plan_fields(i, entry, steps) for i, entry in sorted(approved, key=lambda item: item[0])],
+            "rejected": [entry for _, entry in sorted(rejected, key=lambda item: item[0])],
+            "summary_md": summary,
+            "cache": {"hits": len(steps) - len(pending), "misses": len(pending)}}
+
+def review_stream(lines, model:str):
+    """Review a plan while it is still being generated.
+
+    lines: {"type": "start", "model"?}, then {"type": "step", "step"} per step,
+    then {"type": "plan", "plan": {spec_md, todo_md}}. The steps that arrive
+    while one batch is with the model form the next batch, so reviewing early
+    steps overlaps with planning later ones. Returns the same shape as review().
+    """
+    arrived = queue.Queue()
+    errors = []
+
+    def read():
+        try:
+            for line in lines:
+                arrived.put(line)
+        except Exception as e:
+            errors.append(f"review stream broke off: {e}")
+        finally:
+            arrived.put(None)
+    threading.Thread(target=read, daemon=True).start()
+
+    payload, approved, rejected, summaries = {}, [], [], []
+    hits = misses = 0
+    done = False
+    while not done:
+        batch, item = [], arrived.get()
+        while True:
+            if item is None:
+                done = True
+                break
+            if item.get("type") == "start":
+                model = item.get("model") or model
+            elif item.get("type") == "step":
+                batch.append(item["step"])
+            elif item.get("type") == "plan":
+                payload.update({k: v for k, v in (item.get("plan") or {}).items() if k in ("spec_md", "todo_md")})
+            try:
+                item = arrived.get_nowait()
+            except queue.Empty:
+                break
+        if batch:
+            out = review(dict(payload, steps=batch), model)
+            approved += out["approved_steps"]
+            rejected += out["rejected"]
+            summaries.append(out["summary_md"])
+            hits, misses = hits + out["cache"]["hits"], misses + out["cache"]["misses"]
+    return {"approved_steps": approved, "rejected": rejected,
+            "summary_md": "\n\n".join(summaries + errors) or "No steps to review.",
+            "cache": {"hits": hits, "misses": misses}}
+
+class H(JSONHandler):
+    post_routes = {"/_py/review": "handle_review"}
+
+    def handle_review(self, data):
         model = data.get("model","gemini-1.5-pro-latest")
+        if self.is_ndjson():
+            self.send_json(review_stream(self.iter_ndjson(), model)); return
         out = review(data, model)
-        self.send_response(200); self.send_header("Content-Type","application/json"); self.end_headers()
-        self.wfile.write(json.dumps(out).encode("utf-8"))
+        self.send_json(out)
 
 if __name__ == "__main__":
-    HTTPServer(("0.0.0.0", PORT), H).serve_forever()
+    serve(H, PORT)
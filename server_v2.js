@@ -1,15 +1,21 @@
 // server_v2.js - Enhanced with selected improvements
 const express = require('express');
-const { execFile } = require('child_process');
+const { spawn } = require('child_process');
 const fs = require('fs');
 const fse = require('fs-extra');
 const path = require('path');
 const axios = require('axios');
+const http = require('http');
 
 const PORT = process.env.PORT || 10000;
 const MODEL = process.env.MODEL_GEMINI || 'gemini-1.5-pro-latest';
 const AUTO_THRESHOLD = parseFloat(process.env.AUTO_APPROVE_RISK_THRESHOLD || "0.4");
 const MAX_STEPS = parseInt(process.env.MAX_APPROVED_STEPS_PER_LOOP || "7");
+const STREAM_PLAN_REVIEW = (process.env.STREAM_PLAN_REVIEW || "1") === "1";
+// With service_host.py every Python agent answers on PY_HOST_PORT; otherwise each has its own port
+const PY_HOST_PORT = process.env.PY_HOST_PORT ? parseInt(process.env.PY_HOST_PORT) : null;
+const pyPort = (agentPort) => PY_HOST_PORT || agentPort;
+const pyUrl = (agentPort, route) => `http://127.0.0.1:${pyPort(agentPort)}${route}`;
 
 const ROOT = __dirname;
 const DATA = (...p) => path.join(ROOT, 'data', ...p);
@@ -20,9 +26,6 @@ const STATE_FILE = DATA('system_state.json');
 const MISSION_FILE = DATA('current_mission.md');
 const DEFAULT_MISSION = "Your primary mission is to maintain and improve the public dashboard at /site. Keep it simple, fast, and informative.";
 
-// Import failure database
-const { FailureDB } = require('./failure_db.js');
-const failureDB = new FailureDB();
 
 const app = express();
 app.use(express.json({ limit: '10mb' }));
@@ -33,28 +36,96 @@ let loopCounter = 0;
 // --- Agent Service Clients ---
 
 async function geminiPlan(context) {
-    const { data } = await axios.post('http://127.0.0.1:10005/_py/plan', { model: MODEL, context }, { timeout: 120000 });
+    const { data } = await axios.post(pyUrl(10005, '/_py/plan'), { model: MODEL, context }, { timeout: 120000 });
     return data;
 }
 
 async function geminiReview(plan) {
-    const { data } = await axios.post('http://127.0.0.1:10001/_py/review', { model: MODEL, ...plan }, { timeout: 120000 });
+    const { data } = await axios.post(pyUrl(10001, '/_py/review'), { model: MODEL, ...plan }, { timeout: 120000 });
     return data;
 }
 
+// Streams planner steps into the reviewer as they are generated (NDJSON both ways),
+// so reviewing the first steps overlaps with planning the rest
+function geminiPlanAndReviewStream(context) {
+    return new Promise((resolve, reject) => {
+        let plan = null;
+        const fail = (e) => { reviewReq.destroy(); planReq.destroy(); reject(e); };
+        const reviewReq = http.request({
+            host: '127.0.0.1', port: pyPort(10001), path: '/_py/review', method: 'POST', timeout: 300000,
+            headers: { 'Content-Type': 'application/x-ndjson' }
+        }, (res) => {
+            let body = '';
+            res.setEncoding('utf8');
+            res.on('data', (chunk) => { body += chunk; });
+            res.on('end', () => {
+                try {
+                    if (!plan) throw new Error("planner stream ended without a plan");
+                    resolve({ plan, review: JSON.parse(body) });
+                } catch (e) { reject(e); }
+            });
+        });
+        reviewReq.on('error', fail);
+        reviewReq.on('timeout', () => fail(new Error("review stream timeout")));
+        reviewReq.write(JSON.stringify({ type: 'start', model: MODEL }) + '\n');
+
+        const planReq = http.request({
+            host: '127.0.0.1', port: pyPort(10005), path: '/_py/plan', method: 'POST', timeout: 120000,
+            headers: { 'Content-Type': 'application/json' }
+        }, (res) => {
+            let pending = '';
+            res.setEncoding('utf8');
+            res.on('data', (chunk) => {
+                pending += chunk;
+                let nl;
+                while ((nl = pending.indexOf('\n')) >= 0) {
+                    const line = pending.slice(0, nl).trim();
+                    pending = pending.slice(nl + 1);
+                    if (!line) continue;
+                    let msg;
+                    try { msg = JSON.parse(line); } catch (e) { return fail(new Error(`bad planner stream line: ${e.message}`)); }
+                    if (msg.type === 'step') {
+                        reviewReq.write(JSON.stringify({ type: 'step', step: msg.step }) + '\n');
+                    } else if (msg.type === 'plan') {
+                        plan = msg.plan;
+                        reviewReq.end(JSON.stringify({ type: 'plan', plan: { spec_md: plan.spec_md, todo_md: plan.todo_md } }) + '\n');
+                    }
+                }
+            });
+            res.on('end', () => { if (!plan) fail(new Error("planner stream ended without a plan")); });
+        });
+        planReq.on('error', fail);
+        planReq.on('timeout', () => fail(new Error("plan stream timeout")));
+        planReq.end(JSON.stringify({ model: MODEL, context, stream: true }));
+    });
+}
+
+async function geminiPlanAndReview(context) {
+    if (STREAM_PLAN_REVIEW) {
+        try {
+            return await geminiPlanAndReviewStream(context);
+        } catch (e) {
+            console.error("Streaming plan/review failed, falling back to whole-plan requests:", e.message);
+        }
+    }
+    const plan = await geminiPlan(context);
+    const review = await geminiReview(plan);
+    return { plan, review };
+}
+
 async function geminiReflect(prompt) {
-    const { data } = await axios.post('http://127.0.0.1:10002/_py/reflect', { model: MODEL, prompt }, { timeout: 120000 });
+    const { data } = await axios.post(pyUrl(10002, '/_py/reflect'), { model: MODEL, prompt }, { timeout: 120000 });
     return data;
 }
 
 async function geminiStrategize(prompt) {
-    const { data } = await axios.post('http://127.0.0.1:10003/_py/strategize', { model: MODEL, prompt }, { timeout: 180000 });
+    const { data } = await axios.post(pyUrl(10003, '/_py/strategize'), { model: MODEL, prompt }, { timeout: 180000 });
     return data;
 }
 
 async function systemAgentImprove(trigger) {
     try {
-        const { data } = await axios.post('http://127.0.0.1:10006/_py/improve', { trigger }, { timeout: 300000 });
+        const { data } = await axios.post(pyUrl(10006, '/_py/improve'), { trigger }, { timeout: 300000 });
         return data;
     } catch (e) {
         console.error("System agent failed:", e.message);
@@ -62,17 +133,66 @@ async function systemAgentImprove(trigger) {
     }
 }
 
+// Failure patterns live in failure_db.py behind the system agent service
+async function failuresScreen(steps) {
+    try {
+        const { data } = await axios.post(pyUrl(10006, '/_py/failures/screen'), { steps }, { timeout: 30000 });
+        return data.results;
+    } catch (e) {
+        console.error("Failed to screen steps against failure patterns:", e.message);
+        return steps.map(() => ({ skip: false, reason: null }));
+    }
+}
+
+async function failuresLearn(failures) {
+    try {
+        await axios.post(pyUrl(10006, '/_py/failures/learn'), { failures }, { timeout: 30000 });
+    } catch (e) {
+        console.error("Failed to record failure patterns:", e.message);
+    }
+}
+
+async function failureSummary() {
+    try {
+        const { data } = await axios.get(pyUrl(10006, '/_py/failures/summary'), { timeout: 30000 });
+        return data.summary;
+    } catch (e) {
+        console.error("Failed to load failure summary:", e.message);
+        return 'Unavailable';
+    }
+}
+
+// One event per loop; the system agent folds it into data/metrics.json (metrics_store.py)
+async function metricsRecordLoop(event) {
+    try {
+        await axios.post(pyUrl(10006, '/_py/metrics/loop'), event, { timeout: 30000 });
+    } catch (e) {
+        console.error("Failed to record loop metrics:", e.message);
+    }
+}
+
 async function memoryAdd(id, text) {
     try {
-        await axios.post('http://127.0.0.1:10004/_py/add', { id, text });
+        await axios.post(pyUrl(10004, '/_py/add'), { id, text });
     } catch (e) {
         console.error("Failed to add to memory:", e.message);
     }
 }
 
-async function memoryQuery(query, top_k = 3) {
+async function memoryAddBatch(documents) {
+    try {
+        const { data } = await axios.post(pyUrl(10004, '/_py/add_batch'), { documents });
+        return data.entries;
+    } catch (e) {
+        console.error("Failed to add batch to memory:", e.message);
+        return null;
+    }
+}
+
+// filter: { kinds, sources, since, until, last_loops }, applied before scoring
+async function memoryQuery(query, top_k = 3, filter = null) {
     try {
-        const { data } = await axios.post('http://127.0.0.1:10004/_py/query', { query, top_k });
+        const { data } = await axios.post(pyUrl(10004, '/_py/query'), { query, top_k, filter });
         return data.results || [];
     } catch (e) {
         console.error("Failed to query memory:", e.message);
@@ -80,6 +200,21 @@ async function memoryQuery(query, top_k = 3) {
     }
 }
 
+// Bytes deleted under data/ by cleanups since the last loop's metrics were reported
+// (the data_bytes gauge measures data/ only; site/ is regenerated output)
+let bytesFreed = 0;
+
+async function removeCounted(filePath) {
+    const stat = await fs.promises.stat(filePath).catch(() => null);
+    if (stat && stat.isFile() && path.resolve(filePath).startsWith(DATA() + path.sep)) bytesFreed += stat.size;
+    await fse.remove(filePath);
+}
+
+async function fileBytes(paths) {
+    const stats = await Promise.all(paths.map(p => fs.promises.stat(p).catch(() => null)));
+    return stats.reduce((sum, stat) => sum + (stat ? stat.size : 0), 0);
+}
+
 // --- Logarithmic Retention (Improvement #2) ---
 async function logarithmicCleanup(currentLoopId) {
     const keepLoops = new Set([1]);
@@ -101,7 +236,7 @@ async function logarithmicCleanup(currentLoopId) {
         if (match) {
             const loopId = parseInt(match[1]);
             if (!keepLoops.has(loopId)) {
-                await fse.remove(ARTIFACTS(file));
+                await removeCounted(ARTIFACTS(file));
             }
         }
     }
@@ -120,7 +255,7 @@ async function autoCleanup() {
         });
         
         for (let i = 100; i < sorted.length; i++) {
-            await fse.remove(ARTIFACTS(sorted[i]));
+            await removeCounted(ARTIFACTS(sorted[i]));
         }
         console.log(`Auto-cleaned ${sorted.length - 100} old artifacts`);
     }
@@ -136,7 +271,7 @@ async function autoCleanup() {
         });
         
         for (const file of oldFiles) {
-            await fse.remove(SITE('loops', file));
+            await removeCounted(SITE('loops', file));
         }
         console.log(`Auto-cleaned ${oldFiles.length} old loop files`);
     }
@@ -158,52 +293,81 @@ async function getDirSize(dirPath) {
 }
 
 // --- Enhanced Executor with Failure Tracking ---
-async function runSteps(steps) {
-    console.log(`Executing ${steps.length} approved steps via run_steps.sh...`);
+// executor.py streams one NDJSON record per step as it completes; onStep(record)
+// sees each one (with its report_md section) before the whole run has finished
+async function runSteps(steps, { loopId, onStep } = {}) {
+    console.log(`Executing ${steps.length} approved steps via executor.py...`);
     
-    // Check failure patterns before execution (Improvement #3)
+    // Check failure patterns before execution (Improvement #3), one request for the whole plan
+    const screening = await failuresScreen(steps.map(s => ({ bash: s.bash || "" })));
     const filteredSteps = [];
-    for (const step of steps) {
-        const [shouldSkip, reason] = failureDB.should_skip(step.bash);
-        if (shouldSkip) {
+    steps.forEach((step, i) => {
+        const { skip, reason } = screening[i];
+        if (skip) {
             console.log(`Skipping step due to failure pattern: ${reason}`);
         } else {
             filteredSteps.push(step);
         }
-    }
+    });
     
+    const skipped = steps.length - filteredSteps.length;
     if (filteredSteps.length === 0) {
-        return { success: [], failed: [], final_report_md: "All steps skipped due to known failure patterns." };
+        return { success: [], failed: [], steps: [], skipped, final_report_md: "All steps skipped due to known failure patterns." };
     }
     
-    return new Promise((resolve, reject) => {
-        const stepsJson = JSON.stringify(filteredSteps);
-        const child = execFile('./run_steps.sh', [stepsJson], {
-            shell: '/bin/bash',
-            cwd: ROOT,
-            timeout: 600000
-        }, (error, stdout, stderr) => {
-            try {
-                const results = JSON.parse(stdout);
-                
-                // Track failures (Improvement #3)
-                if (results.failed && results.failed.length > 0) {
-                    for (const failure of results.failed) {
-                        failureDB.learn_failure(
-                            failure.bash || "",
-                            failure.stderr || "Unknown error",
-                            failure.title || ""
-                        );
-                    }
+    const args = ['executor.py', '--ndjson'];
+    if (loopId) args.push('--spill-prefix', ARTIFACTS(`${loopId}_`));
+    const results = await new Promise((resolve, reject) => {
+        const child = spawn('python3', args, { cwd: ROOT });
+        const records = [];
+        let done = null, pending = '', stderr = '', handling = Promise.resolve();
+        const timer = setTimeout(() => child.kill('SIGKILL'), 600000);
+        child.stdout.setEncoding('utf8');
+        child.stdout.on('data', (chunk) => {
+            pending += chunk;
+            const lines = pending.split('\n');
+            pending = lines.pop();
+            for (const line of lines) {
+                if (!line.trim()) continue;
+                let record;
+                try { record = JSON.parse(line); } catch (e) { continue; }
+                if (record.type === 'step') {
+                    records.push(record);
+                    console.log(`Step ${record.status}: ${record.title} (${Math.round(record.duration_ms)} ms)`);
+                    if (onStep) handling = handling.then(() => onStep(record)).catch(e => console.error("onStep failed:", e.message));
+                } else if (record.type === 'done' || record.error) {
+                    done = record;
                 }
-                
-                resolve(results);
-            } catch (parseError) {
-                console.error("Failed to parse JSON from run_steps.sh output:", parseError);
+            }
+        });
+        child.stderr.on('data', (chunk) => { if (stderr.length < 65536) stderr += chunk; });
+        child.on('error', (e) => { clearTimeout(timer); reject(e); });
+        child.on('close', async () => {
+            clearTimeout(timer);
+            await handling;
+            if (!done || done.error) {
+                console.error("Executor did not finish:", done && done.error, stderr);
                 reject(new Error("Failed to parse executor output."));
+                return;
             }
+            records.sort((a, b) => a.index - b.index);
+            resolve({
+                success: records.filter(r => r.status === 'success'),
+                failed: records.filter(r => r.status !== 'success'),
+                steps: records, final_report_md: done.final_report_md, duration_ms: done.duration_ms
+            });
         });
+        child.stdin.end(JSON.stringify(filteredSteps));
     });
+
+    // Track failures (Improvement #3); blocked steps never ran, so they say nothing about their command
+    const ranAndFailed = results.failed.filter(f => f.status !== 'blocked');
+    if (ranAndFailed.length > 0) {
+        await failuresLearn(ranAndFailed.map(f => ({
+            bash: f.bash || "", stderr: f.stderr || "Unknown error", title: f.title || ""
+        })));
+    }
+    return { ...results, skipped };
 }
 
 // --- Main Loop ---
@@ -211,6 +375,12 @@ async function oneLoop() {
     loopCounter++;
     const loopId = Date.now();
     console.log(`--- Starting Loop ${loopCounter} (${loopId}) ---`);
+    const loopMetrics = { loop_id: loopId, error: null, steps_succeeded: 0, steps_failed: 0, steps_skipped: 0, memory_entries: null };
+    // Files under data/ this loop writes, for the bytes_written metric
+    const loopFiles = [
+        ARTIFACTS(`${loopId}_plan.json`), ARTIFACTS(`${loopId}_review.json`), ARTIFACTS(`${loopId}_plan_review.diff`),
+        ARTIFACTS(`${loopId}_report.md`), DATA('reflections', `${loopId}_reflection.md`)
+    ];
     
     // Auto cleanup before starting (Improvement #6)
     await autoCleanup();
@@ -252,12 +422,10 @@ Recent reports (actions taken):
 ${recentReports.join('\n') || 'None'}
 ---
 Known failure patterns to avoid:
-${failureDB.get_failure_summary()}`;
+${await failureSummary()}`;
 
-        const plan = await geminiPlan(context);
+        const { plan, review } = await geminiPlanAndReview(context);
         await fse.outputJson(ARTIFACTS(`${loopId}_plan.json`), plan);
-
-        const review = await geminiReview(plan);
         await fse.outputJson(ARTIFACTS(`${loopId}_review.json`), review);
 
         const originalStepsBash = plan.steps.map(s => `# ${s.title}\n${s.bash}`).join('\n\n');
@@ -269,8 +437,22 @@ ${failureDB.get_failure_summary()}`;
             .filter(s => (s.risk && typeof s.risk.score === 'number' ? s.risk.score : 1) <= AUTO_THRESHOLD)
             .slice(0, MAX_STEPS);
 
-        const executionResults = await runSteps(approved);
+        // The report grows step by step while the executor runs, then is rewritten in plan order
         const reportPath = ARTIFACTS(`${loopId}_report.md`);
+        await fse.outputFile(reportPath, `# Execution Report (in progress)\n\n`);
+        let stepsDone = 0;
+        const executionResults = await runSteps(approved, {
+            loopId,
+            onStep: async (record) => {
+                stepsDone++;
+                await fs.promises.appendFile(reportPath, record.report_md || '');
+                await fse.outputJson(STATE_FILE, { status: 'running', loopId, startTime: loopId, stepsDone, stepsTotal: approved.length });
+            }
+        });
+        loopMetrics.steps_succeeded = (executionResults.success || []).length;
+        loopMetrics.steps_failed = (executionResults.failed || []).length;
+        loopMetrics.steps_skipped = executionResults.skipped || 0;
+        for (const r of executionResults.steps || []) loopFiles.push(...Object.values(r.artifacts || {}));
         await fse.outputFile(reportPath, executionResults.final_report_md || "No execution report was generated.");
 
         const reflectPrompt = `
@@ -287,10 +469,13 @@ Provide a reflection with these EXACT sections (30 words max each):
         const reflectionPath = DATA('reflections', `${loopId}_reflection.md`);
         await fse.outputFile(reflectionPath, reflection.reflection_md);
 
-        await memoryAdd(`report_${loopId}`, executionResults.final_report_md);
-        await memoryAdd(`reflection_${loopId}`, reflection.reflection_md);
+        loopMetrics.memory_entries = await memoryAddBatch([
+            { id: `report_${loopId}`, text: executionResults.final_report_md, source: 'loop' },
+            { id: `reflection_${loopId}`, text: reflection.reflection_md, source: 'loop' }
+        ]);
 
         await updateSite(loopId);
+        loopMetrics.bytes_written = await fileBytes(loopFiles);
         
         // Logarithmic cleanup after each loop (Improvement #2)
         await logarithmicCleanup(loopCounter);
@@ -298,6 +483,8 @@ Provide a reflection with these EXACT sections (30 words max each):
     } catch (error) {
         console.error(`Loop ${loopId} failed with error:`, error);
         await fse.outputFile(ARTIFACTS(`${loopId}_error.log`), error.stack);
+        loopMetrics.error = error.message;
+        loopMetrics.bytes_written = await fileBytes([...loopFiles, ARTIFACTS(`${loopId}_error.log`)]);
         
         // Request system agent for hairy issues
         if (error.message.includes("timeout") || error.message.includes("parse")) {
@@ -306,6 +493,8 @@ Provide a reflection with these EXACT sections (30 words max each):
         }
     } finally {
         console.log(`--- Finished Loop ${loopId} ---`);
+        await metricsRecordLoop({ ...loopMetrics, duration_ms: Date.now() - loopId, bytes_freed: bytesFreed });
+        bytesFreed = 0;
         await fse.outputJson(STATE_FILE, { status: 'idle', lastLoopId: loopId, endTime: Date.now() });
     }
 }
@@ -0,0 +1,168 @@
+# service.py - Shared HTTP serving for the Python agent services
+import os
+import json
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MAX_WORKERS = int(os.environ.get("PY_SERVICE_WORKERS", "8"))
+KEEPALIVE_SEC = float(os.environ.get("PY_SERVICE_KEEPALIVE_SEC", "30"))
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    """Base handler: JSON in/out, HTTP/1.1 keep-alive, path -> method routing.
+
+    Subclasses fill post_routes / get_routes with {path: method name}; each
+    method receives the decoded JSON body (or {} for GET). A request sent as
+    application/x-ndjson is not decoded up front: the method gets {} and reads
+    the lines with iter_ndjson(). send_ndjson() streams a response line by line.
+    Every service also answers GET /_py/llm/stats with its model call statistics.
+    """
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_SEC  # idle keep-alive connections are closed after this
+    # Headers and body go out in separate writes; with Nagle on, a kept-alive
+    # connection waits for the client's delayed ACK (~40 ms) on every response
+    disable_nagle_algorithm = True
+    post_routes = {}
+    get_routes = {}
+    shared_get_routes = {"/_py/llm/stats": "handle_llm_stats"}
+
+    def read_json(self):
+        l = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(l).decode("utf-8") or "{}")
+
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def is_ndjson(self):
+        return self.headers.get("Content-Type", "").startswith("application/x-ndjson")
+
+    def _body_chunks(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(self.rfile.readline().split(b";", 1)[0].strip() or b"0", 16)
+                if size == 0:
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass  # trailers
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()  # CRLF after the chunk
+        else:
+            remaining = int(self.headers.get("Content-Length", 0))
+            while remaining > 0:
+                chunk = self.rfile.read1(min(remaining, 65536))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+
+    def iter_ndjson(self):
+        """Decoded lines of an NDJSON request body, each as soon as it has fully arrived"""
+        pending = b""
+        for chunk in self._body_chunks():
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+        if pending.strip():
+            yield json.loads(pending)
+
+    def send_ndjson(self, items, status=200):
+        """Stream items as newline-delimited JSON using chunked transfer encoding"""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for item in items:
+            line = (json.dumps(item) + "\n").encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _dispatch(self, routes, has_body):
+        streaming = has_body and self.is_ndjson()
+        if streaming:
+            self.close_connection = True  # a handler may stop reading before the body ends
+        data = {} if streaming or not has_body else self.read_json()
+        handler = self.route(routes)
+        if handler is None:
+            self.send_json({"error": "not found"}, 404); return
+        slots = getattr(self.server, "slots", None)
+        if slots is None:
+            handler(data); return
+        with slots:
+            handler(data)
+
+    def route(self, routes):
+        """The bound method serving this request's path, or None"""
+        name = routes.get(self.path.split("?", 1)[0])
+        return getattr(self, name) if name else None
+
+    def do_POST(self):
+        self._dispatch(self.post_routes, True)
+
+    def do_GET(self):
+        self._dispatch({**self.shared_get_routes, **self.get_routes}, False)
+
+    def handle_llm_stats(self, data):
+        import llm_backend
+        from gemini_client import gemini
+        self.send_json({"calls": dict(llm_backend.stats), "client": gemini.stats()})
+
+
+class BoundedThreadingHTTPServer(ThreadingHTTPServer):
+    """One thread per connection, at most max_workers requests being handled at once"""
+    daemon_threads = True
+
+    def __init__(self, address, handler, max_workers=MAX_WORKERS):
+        super().__init__(address, handler)
+        self.slots = threading.BoundedSemaphore(max(1, max_workers))
+
+
+def serve(handler, port, max_workers=MAX_WORKERS):
+    BoundedThreadingHTTPServer(("0.0.0.0", port), handler, max_workers).serve_forever()
+
+
+class RWLock:
+    """Many concurrent readers or one writer; waiting writers block new readers"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
@@ -0,0 +1,158 @@
+# service_host.py - All Python agents served from one process
+#
+# One interpreter serves the routes of reviewer.py, reflector_v2.py,
+# strategist_v2.py, memory_v2.py, planner.py and system_agent.py, so the model
+# client pool (gemini_client.py), the embedding cache, numpy and configuration
+# exist once instead of six times. An agent module is imported the first time
+# one of its routes is called; SERVICE_HOST_PRELOAD lists agents to import in
+# the background right after startup instead.
+#
+# The host listens on PY_HOST_PORT (server_v2.js uses it when PY_HOST_PORT is
+# set) and, unless SERVICE_HOST_LEGACY_PORTS=0, on the agents' old ports
+# 10001-10006 as well. Every listener answers every route, and all of them share
+# PY_HOST_WORKERS request slots.
+import os
+import time
+import importlib
+import threading
+from service import JSONHandler, BoundedThreadingHTTPServer
+
+PORT = int(os.environ.get("PY_HOST_PORT", "10010"))
+LEGACY_PORTS = os.environ.get("SERVICE_HOST_LEGACY_PORTS", "1") == "1"
+WORKERS = int(os.environ.get("PY_HOST_WORKERS", "32"))
+PRELOAD = [a for a in os.environ.get("SERVICE_HOST_PRELOAD", "").split(",") if a]
+
+# agent module -> its port when run on its own
+AGENTS = {"reviewer": 10001, "reflector_v2": 10002, "strategist_v2": 10003,
+          "memory_v2": 10004, "planner": 10005, "system_agent": 10006}
+
+# (method, path) -> agent module, so a route can be served without importing every agent first.
+# Routes missing here are still found: an unknown path loads all agents and looks again.
+ROUTES = {
+    ("POST", "/_py/review"): "reviewer",
+    ("POST", "/_py/reflect"): "reflector_v2",
+    ("POST", "/_py/strategize"): "strategist_v2",
+    ("POST", "/_py/add"): "memory_v2",
+    ("POST", "/_py/add_batch"): "memory_v2",
+    ("POST", "/_py/query"): "memory_v2",
+    ("GET", "/_py/stats"): "memory_v2",
+    ("POST", "/_py/plan"): "planner",
+    ("POST", "/_py/improve"): "system_agent",
+    ("POST", "/_py/failures/screen"): "system_agent",
+    ("POST", "/_py/failures/learn"): "system_agent",
+    ("POST", "/_py/metrics/loop"): "system_agent",
+    ("GET", "/_py/failures/summary"): "system_agent",
+    ("GET", "/_py/metrics"): "system_agent",
+}
+
+
+class AgentRegistry:
+    """Agent modules imported on demand, and the (handler class, method name) behind each route"""
+
+    def __init__(self, agents, routes):
+        self.agents = agents
+        self.routes = dict(routes)
+        self._handlers = {}   # (method, path) -> (agent's handler class, method name)
+        self._loaded = {}     # agent -> seconds its import took
+        self._failed = {}     # agent -> why its last import failed
+        self._lock = threading.Lock()
+
+    def load(self, agent):
+        with self._lock:
+            if agent in self._loaded:
+                return
+            start = time.perf_counter()
+            try:
+                handler = importlib.import_module(agent).H
+            except Exception as e:
+                self._failed[agent] = f"{type(e).__name__}: {e}"
+                print(f"Loading {agent} failed: {self._failed[agent]}", flush=True)
+                raise
+            self._failed.pop(agent, None)
+            for method, table in (("POST", handler.post_routes), ("GET", handler.get_routes)):
+                for path, name in table.items():
+                    self._handlers[(method, path)] = (handler, name)
+                    self.routes[(method, path)] = agent
+            self._loaded[agent] = time.perf_counter() - start
+            print(f"Loaded {agent} in {self._loaded[agent] * 1000:.0f} ms", flush=True)
+
+    def resolve(self, method, path):
+        """(handler class, method name) for the route, or None; raises if the route's agent fails to import"""
+        key = (method, path)
+        if key not in self._handlers:
+            agent = self.routes.get(key)
+            if agent:
+                self.load(agent)
+            else:
+                for name in self.agents:
+                    try:
+                        self.load(name)
+                    except Exception:
+                        pass  # logged; the other agents may still serve the path
+        return self._handlers.get(key)
+
+    def loaded(self):
+        with self._lock:
+            return {agent: round(seconds * 1000, 1) for agent, seconds in self._loaded.items()}
+
+    def failed(self):
+        with self._lock:
+            return dict(self._failed)
+
+
+# Global instance
+registry = AgentRegistry(AGENTS, ROUTES)
+
+
+class HostHandler(JSONHandler):
+    """Serves every agent's routes: the agent's handler methods run on this request"""
+    get_routes = {"/_py/host": "handle_host"}
+
+    def route(self, routes):
+        own = super().route(routes)
+        if own is not None:
+            return own
+        try:
+            target = registry.resolve(self.command, self.path.split("?", 1)[0])
+        except Exception as e:
+            # Only this agent's routes fail; the rest of the host keeps serving
+            error = f"agent unavailable: {type(e).__name__}: {e}"
+            return lambda data: self.send_json({"error": error}, 500)
+        if target is None:
+            return None
+        handler, name = target
+        # Agent handlers only use the JSONHandler API, so their methods can be bound to this request
+        return getattr(handler, name).__get__(self)
+
+    def handle_host(self, data):
+        self.send_json({"pid": os.getpid(), "agents": list(AGENTS), "loaded_ms": registry.loaded(),
+                        "failed": registry.failed()})
+
+
+def start(port=PORT, legacy_ports=LEGACY_PORTS, workers=WORKERS, host="0.0.0.0"):
+    """Bind the listeners and serve each on a thread; returns the servers"""
+    ports = [port] + (list(AGENTS.values()) if legacy_ports else [])
+    slots = threading.BoundedSemaphore(max(1, workers))
+    servers = []
+    for p in ports:
+        server = BoundedThreadingHTTPServer((host, p), HostHandler)
+        server.slots = slots  # one limit for the process, not per listener
+        threading.Thread(target=server.serve_forever, name=f"listener-{p}", daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+def preload(agents):
+    for agent in agents:
+        try:
+            registry.load(agent)
+        except Exception as e:
+            print(f"Preloading {agent} failed: {e}", flush=True)
+
+
+if __name__ == "__main__":
+    servers = start()
+    print(f"Serving {', '.join(AGENTS)} on ports {', '.join(str(s.server_address[1]) for s in servers)}", flush=True)
+    if PRELOAD:
+        threading.Thread(target=preload, args=(PRELOAD,), name="preload", daemon=True).start()
+    threading.Event().wait()
@@ -0,0 +1,273 @@
+# step_cache.py - Recorded results of read-only steps, reused while the files they read are unchanged
+#
+# A step is cacheable when the reviewer classified it read_only/file_read AND
+# its command is built only from read-only tools (ls, cat, grep, find, ...)
+# joined by |, && or ||, with no redirection other than to /dev/null and no
+# $-expansion or command substitution. The key is the normalized command and
+# cwd plus a fingerprint of every path the command names: content hash for
+# small files, (mtime, size, inode) otherwise, and the entries of directories
+# (the whole tree for find, du and recursive grep/ls). Directory entries count
+# by name and type only, unless the command shows their details (ls -l, stat,
+# du, find -size/-newer/...). Globs are expanded, names that do not exist are
+# fingerprinted as missing, and the cache's own file is left out.
+import os
+import sys
+import json
+import glob
+import shlex
+import stat
+import hashlib
+import threading
+from collections import OrderedDict
+
+READ_ONLY_CATEGORIES = {"read_only", "file_read"}
+READ_ONLY_BINS = {"ls", "cat", "grep", "egrep", "fgrep", "find", "head", "tail", "wc", "stat", "du",
+                  "diff", "test", "file", "md5sum", "sha256sum"}
+RECURSIVE_BINS = {"find", "du"}
+IMPLICIT_CWD_BINS = {"ls", "find", "du"}  # read "." when no path is given
+DETAIL_BINS = {"stat", "du"}  # print sizes and times of directories too
+LS_DETAIL_FLAGS = set("lnogsStuc")  # ls options that show or sort by entries' sizes and times
+FIND_DETAIL_ARGS = {"-size", "-newer", "-anewer", "-cnewer", "-mtime", "-mmin", "-atime", "-amin", "-ctime", "-cmin",
+                    "-used", "-empty", "-perm", "-user", "-group", "-uid", "-gid", "-nouser", "-nogroup",
+                    "-links", "-inum", "-printf", "-ls"}
+UNSAFE_ARGS = {"-exec", "-execdir", "-ok", "-okdir", "-delete", "-fprint", "-fprint0", "-fprintf", "-fls"}
+OPERATORS = {"|", "&&", "||"}
+EXPANSION_CHARS = set("$`{}")  # variables, command substitution, brace expansion; ~ (home) is rejected too
+VOLATILE_PREFIXES = ("/proc", "/sys", "/dev")
+SMALL_FILE_BYTES = 65536
+MAX_ENTRIES = 2000  # fingerprinting more than this many files is not worth it
+
+
+def read_paths(bash):
+    """(path arguments, recursive, detailed) if the command only reads files, else None"""
+    if "\n" in bash:
+        return None  # bash runs each line as its own command
+    try:
+        lexer = shlex.shlex(bash, posix=True, punctuation_chars=True)
+        lexer.whitespace_split = True
+        tokens = list(lexer)
+    except ValueError:
+        return None
+    paths, recursive, detailed = [], False, False
+    segment = []
+    tokens.append("|")  # flush the last segment
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in (">", ">>", "2>") and i + 1 < len(tokens) and tokens[i + 1] == "/dev/null":
+            i += 2
+            continue
+        if token == ">&" and i + 1 < len(tokens) and tokens[i + 1] in ("1", "2"):
+            i += 2
+            continue
+        if token in OPERATORS:
+            if not segment:
+                return None
+            command, args = os.path.basename(segment[0]), segment[1:]
+            if command not in READ_ONLY_BINS or UNSAFE_ARGS.intersection(args):
+                return None
+            options = [a for a in args if a.startswith("-")]
+            short = "".join(o[1:] for o in options if not o.startswith("--"))
+            named = [a for a in args if not a.startswith("-") and not a.isdigit()]
+            if (command in RECURSIVE_BINS or "--recursive" in options
+                    or "R" in short or (command.endswith("grep") and "r" in short)):
+                recursive = True
+                if command.endswith("grep") and not named[1:]:
+                    named.append(".")
+            if (command in DETAIL_BINS or (command == "find" and FIND_DETAIL_ARGS.intersection(args))
+                    or (command == "ls" and (LS_DETAIL_FLAGS.intersection(short)
+                                             or any(o.startswith(("--size", "--full-time", "--sort")) for o in options)))):
+                detailed = True
+            if command in IMPLICIT_CWD_BINS and not named:
+                named.append(".")
+            paths.extend(named)
+            segment = []
+        elif (set(token) <= set("();<>|&") or EXPANSION_CHARS.intersection(token)
+              or token.startswith("~") or "=~" in token or ":~" in token):
+            return None
+        else:
+            segment.append(token)
+        i += 1
+    return paths, recursive, detailed
+
+
+def _stat_key(st):
+    return f"{st.st_mode:o}:{st.st_size}:{st.st_mtime_ns}:{st.st_ino}"
+
+
+def _entry_key(st, detailed):
+    """Directories by type unless details are shown; files by stat, which their contents change"""
+    if stat.S_ISDIR(st.st_mode) and not detailed:
+        return "dir"
+    return _stat_key(st)
+
+
+def fingerprint(paths, cwd, recursive, detailed=False, exclude=()):
+    """Hash of the state of everything the paths name, or None if it is too large or volatile.
+
+    exclude: absolute paths (and their path.* siblings) left out of directory listings.
+    """
+    digest = hashlib.sha256()
+    entries = 0
+
+    def excluded(full):
+        return any(full == p or full.startswith(p + ".") for p in exclude)
+
+    for path in sorted(set(paths)):
+        full = os.path.normpath(os.path.join(cwd, path))
+        if full == "/dev/null":
+            continue
+        if full.startswith(VOLATILE_PREFIXES):
+            return None
+        matches = sorted(glob.glob(full)) if glob.has_magic(path) else [full]
+        digest.update(f"\0{path}".encode("utf-8"))
+        for match in matches:
+            try:
+                st = os.stat(match)
+            except OSError:
+                digest.update(f"|{match}:missing".encode("utf-8"))
+                continue
+            digest.update(f"|{match}:{_entry_key(st, detailed)}".encode("utf-8"))
+            if os.path.isdir(match):
+                if recursive:
+                    unreadable = []
+                    for root, dirs, files in os.walk(match, onerror=unreadable.append):
+                        dirs.sort()
+                        for name in sorted(dirs + files):
+                            full_name = os.path.join(root, name)
+                            if excluded(full_name):
+                                continue
+                            entries += 1
+                            if entries > MAX_ENTRIES:
+                                return None
+                            try:
+                                digest.update(f"|{full_name}:{_entry_key(os.lstat(full_name), detailed)}".encode("utf-8"))
+                            except OSError:
+                                pass
+                    if unreadable:
+                        return None  # a directory the walk could not list
+                else:
+                    try:
+                        if detailed:
+                            digest.update(_stat_key(os.stat(os.path.join(match, ".."))).encode("utf-8"))  # ls -la shows it
+                        with os.scandir(match) as it:
+                            listing = sorted(it, key=lambda e: e.name)
+                    except OSError:
+                        return None  # unreadable: the command's output is not ours to predict
+                    for entry in listing:
+                        if excluded(entry.path):
+                            continue
+                        entries += 1
+                        if entries > MAX_ENTRIES:
+                            return None
+                        try:
+                            st_entry = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        if detailed:
+                            digest.update(f"|{entry.name}:{_stat_key(st_entry)}".encode("utf-8"))
+                        else:
+                            digest.update(f"|{entry.name}:{stat.S_IFMT(st_entry.st_mode):o}".encode("utf-8"))
+            elif st.st_size <= SMALL_FILE_BYTES:
+                try:
+                    with open(match, 'rb') as f:
+                        digest.update(hashlib.sha256(f.read()).digest())
+                except OSError:
+                    return None
+            entries += 1
+            if entries > MAX_ENTRIES:
+                return None
+    return digest.hexdigest()
+
+
+class StepCache:
+    """key -> recorded {stdout, stderr, exit_code, duration_ms, ts}, LRU-bounded by entries and bytes, on disk"""
+
+    def __init__(self, path="data/step_cache.json", max_entries=500, max_bytes=8 * 1024 * 1024, enabled=True):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries = None  # loaded on first use
+        self._bytes = 0
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self._entries.update(json.load(f).get("entries", {}))
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable step cache {self.path}: {e}", file=sys.stderr)  # stdout carries results
+        self._bytes = sum(entry["bytes"] for entry in self._entries.values())
+
+    def key(self, step, cwd):
+        """Cache key for the step as things stand on disk now, or None if it is not cacheable"""
+        risk = step.get("risk")
+        if not self.enabled or not isinstance(risk, dict) or risk.get("category") not in READ_ONLY_CATEGORIES:
+            return None
+        bash = "\n".join(line.rstrip() for line in str(step.get("bash", "")).strip().splitlines())
+        parsed = read_paths(bash)
+        if parsed is None:
+            return None
+        paths, recursive, detailed = parsed
+        state = fingerprint(paths, cwd, recursive, detailed, exclude=(os.path.abspath(self.path),))
+        if state is None:
+            return None
+        return hashlib.sha256(f"{bash}\0{os.path.normpath(cwd)}\0{state}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, result, ts):
+        entry = {"stdout": result["stdout"], "stderr": result["stderr"], "exit_code": result["exit_code"],
+                 "duration_ms": result["duration_ms"], "ts": ts}
+        entry["bytes"] = len(entry["stdout"]) + len(entry["stderr"]) + 200
+        with self._lock:
+            self._load()
+            previous = self._entries.pop(key, None)
+            if previous:
+                self._bytes -= previous["bytes"]
+            self._entries[key] = entry
+            self._bytes += entry["bytes"]
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._bytes -= self._entries.popitem(last=False)[1]["bytes"]
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, 'w') as f:
+                f.write(json.dumps({"entries": self._entries}))
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries or ()),
+                "bytes": self._bytes, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+# Global instance
+step_cache = StepCache(
+    max_entries=int(os.environ.get("EXECUTOR_CACHE_ENTRIES", "500")),
+    max_bytes=int(float(os.environ.get("EXECUTOR_CACHE_MB", "8")) * 1024 * 1024),
+    enabled=os.environ.get("EXECUTOR_CACHE", "1") == "1",
+)
@@ -1,10 +1,8 @@
 # strategist.py — high-level goal-setting agent
-import os
 import json
 from http.server import BaseHTTPRequestHandler, HTTPServer
-import google.generativeai as genai
+from llm_backend import generate
 
-genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
 PORT = 10003
 
 SYSTEM = """You are a CTO and strategist for an autonomous AI agent.
@@ -26,12 +24,11 @@ Output ONLY the markdown content for the new mission file. Be concise and clear.
 """
 
 def strategize(prompt: str, model: str):
-    m = genai.GenerativeModel(model)
-    r = m.generate_content([
+    text = generate(model, [
         {"role": "system", "parts": [SYSTEM]},
         {"role": "user", "parts": [prompt]}
     ])
-    return {"mission_md": r.text or "Mission unchanged."}
+    return {"mission_md": text or "Mission unchanged."}
 
 class H(BaseHTTPRequestHandler):
     def do_POST(self):
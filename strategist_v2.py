@@ -1,10 +1,7 @@
 # strategist_v2.py - Enhanced with mission stability anchor (Improvement #4)
-import os
-import json
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import google.generativeai as genai
+from llm_backend import generate
+from service import JSONHandler, serve
 
-genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
 PORT = 10003
 
 # Immutable core mission that anchors all strategies
@@ -74,17 +71,15 @@ def validate_mission(mission_text):
     return True, "Valid"
 
 def strategize(prompt: str, model: str):
-    m = genai.GenerativeModel(model)
-    
     # Add core mission reminder to prompt
     enhanced_prompt = f"{prompt}\n\nREMEMBER: The core mission is '{CORE_MISSION}'. Your new mission must support this."
     
-    r = m.generate_content([
+    mission = generate(model, [
         {"role": "system", "parts": [SYSTEM]},
         {"role": "user", "parts": [enhanced_prompt]}
     ])
     
-    mission = r.text or "Mission unchanged."
+    mission = mission or "Mission unchanged."
     
     # Validate the mission
     is_valid, reason = validate_mission(mission)
@@ -95,17 +90,14 @@ def strategize(prompt: str, model: str):
     
     return {"mission_md": mission}
 
-class H(BaseHTTPRequestHandler):
-    def do_POST(self):
-        if self.path != "/_py/strategize":
-            self.send_response(404); self.end_headers(); return
-        l = int(self.headers.get("Content-Length", 0))
-        data = json.loads(self.rfile.read(l).decode("utf-8") or "{}")
+class H(JSONHandler):
+    post_routes = {"/_py/strategize": "handle_strategize"}
+
+    def handle_strategize(self, data):
         model = data.get("model", "gemini-1.5-pro-latest")
         prompt = data.get("prompt", "")
         out = strategize(prompt, model)
-        self.send_response(200); self.send_header("Content-Type", "application/json"); self.end_headers()
-        self.wfile.write(json.dumps(out).encode("utf-8"))
+        self.send_json(out)
 
 if __name__ == "__main__":
-    HTTPServer(("0.0.0.0", PORT), H).serve_forever()
\ No newline at end of file
+    serve(H, PORT)
\ No newline at end of file
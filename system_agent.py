@@ -1,13 +1,19 @@
 # system_agent.py - Meta-agent that improves the system itself
 import os
 import json
-import glob
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import google.generativeai as genai
+import time
+import threading
+from llm_backend import generate
+from failure_db import failure_db
+from service import JSONHandler, serve
+from metrics_store import MetricsStore
+from context_packer import ContextPacker
+from patch_gate import gate
 
-genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
 PORT = 10006
 
+system_metrics = MetricsStore("data/metrics.json")
+
 SYSTEM = """You are the System Agent - a meta-level AI that improves the autonomous agent system itself.
 
 You have access to:
@@ -56,78 +62,48 @@ Rules:
 - Focus on fixing SYSTEMIC issues, not one-off problems
 """
 
-def get_codebase_context():
-    """Concatenate all agent code files"""
-    codebase = {}
-    code_files = [
-        "server.js", "planner.py", "reviewer.py", "reflector.py", 
-        "strategist.py", "memory_v2.py", "failure_db.py", "run_steps.sh"
-    ]
-    
-    for filename in code_files:
-        if os.path.exists(filename):
-            with open(filename, 'r') as f:
-                codebase[filename] = f.read()
-    
-    return codebase
+def code_files():
+    """The agent's own source: every top-level module except benchmarks, the server and the executor"""
+    return sorted(f for f in os.listdir(".") if f.endswith(".py") and not f.startswith("bench_")) \
+        + ["server_v2.js", "run_steps.sh"]
+
+context_packer = ContextPacker(code_files(), "data/context_packer.json")
+
+def get_codebase_context(query):
+    """Units of the codebase most relevant to query, packed into the context token budget"""
+    context_packer.files = code_files()
+    return context_packer.pack(query)
 
 def get_failure_patterns():
-    """Load recent failure patterns"""
-    if os.path.exists("data/failure_patterns.json"):
-        with open("data/failure_patterns.json", 'r') as f:
-            return json.load(f)
-    return {}
+    """Current failure patterns, including ones other processes have learned since the last call"""
+    failure_db.refresh()
+    return failure_db.patterns
 
 def get_system_metrics():
-    """Gather system performance metrics"""
-    metrics = {
-        "total_loops": len(glob.glob("data/artifacts/*_plan.json")),
-        "disk_usage_mb": sum(os.path.getsize(f) for f in glob.glob("data/**/*", recursive=True)) / 1048576,
+    """Gather system performance metrics from the incrementally updated metrics store"""
+    snapshot = system_metrics.snapshot()
+    return {
+        "total_loops": snapshot["totals"]["loops"],
+        "disk_usage_mb": snapshot["gauges"]["data_bytes"] / 1048576,
         "failure_patterns": len(get_failure_patterns()),
-        "memory_size": len(json.load(open("data/memory_vectors.json"))) if os.path.exists("data/memory_vectors.json") else 0
+        "memory_size": snapshot["gauges"]["memory_entries"],
+        "recent_failure_rate": snapshot["windows"]["10"]["failure_rate"],
+        "totals": snapshot["totals"],
+        "windows": snapshot["windows"]
     }
-    
-    # Calculate recent success rate
-    recent_reports = sorted(glob.glob("data/artifacts/*_report.md"))[-10:]
-    failures = sum(1 for r in recent_reports if "FAILED" in open(r).read())
-    metrics["recent_failure_rate"] = failures / len(recent_reports) if recent_reports else 0
-    
-    return metrics
-
-def apply_patches(patches):
-    """Apply code patches to fix issues"""
-    results = []
-    for patch in patches:
-        try:
-            filename = patch["file"]
-            if not os.path.exists(filename):
-                results.append({"file": filename, "status": "not found"})
-                continue
-                
-            with open(filename, 'r') as f:
-                content = f.read()
-            
-            if patch["old_code"] in content:
-                new_content = content.replace(patch["old_code"], patch["new_code"])
-                with open(filename, 'w') as f:
-                    f.write(new_content)
-                results.append({"file": filename, "status": "patched", "description": patch["description"]})
-            else:
-                results.append({"file": filename, "status": "pattern not found"})
-                
-        except Exception as e:
-            results.append({"file": patch["file"], "status": f"error: {e}"})
-    
-    return results
+
+_improve_lock = threading.Lock()  # one improvement run patches the tree at a time
 
 def analyze_and_improve(trigger_reason="scheduled"):
     """Main system improvement function"""
     print(f"System Agent activated: {trigger_reason}")
     
-    # Gather context
-    codebase = get_codebase_context()
-    failures = get_failure_patterns()
+    # Gather context: the most frequent failures, and the code they point at
+    failures = dict(sorted(get_failure_patterns().items(), key=lambda item: -item[1]["count"])[:20])
     metrics = get_system_metrics()
+    query = trigger_reason + "\n" + "\n".join(
+        f"{d['command_example']} {d['error']} {' '.join(d['titles'])}" for d in failures.values())
+    codebase, context_stats = get_codebase_context(query)
     
     # Build prompt
     context = f"""
@@ -139,25 +115,22 @@ def analyze_and_improve(trigger_reason="scheduled"):
     REPEATED FAILURE PATTERNS:
     {json.dumps(failures, indent=2)[:5000]}  # Limit size
     
-    CODEBASE:
+    CODEBASE (units relevant to the failures in full, others as one-line summaries):
     """
-    
-    for filename, code in codebase.items():
-        context += f"\n\n=== {filename} ===\n{code[:3000]}..."  # Sample each file
+    context += codebase
     
     # Get AI analysis
-    model = genai.GenerativeModel("gemini-1.5-pro-latest")
-    response = model.generate_content([
+    response = generate("gemini-1.5-pro-latest", [
         {"role": "system", "parts": [SYSTEM]},
         {"role": "user", "parts": [context]}
     ])
     
     try:
-        result = json.loads(response.text)
+        result = json.loads(response)
     except:
         # Try to extract JSON from response
         import re
-        json_match = re.search(r'\{.*\}', response.text, re.DOTALL)
+        json_match = re.search(r'\{.*\}', response, re.DOTALL)
         if json_match:
             result = json.loads(json_match.group())
         else:
@@ -167,10 +140,13 @@ def analyze_and_improve(trigger_reason="scheduled"):
                 "new_features": []
             }
     
-    # Apply patches
+    result["context_stats"] = context_stats
+    
+    # Apply patches: only if they compile, import and keep the hot paths within the regression budget
     if result.get("patches"):
-        patch_results = apply_patches(result["patches"])
-        result["patch_results"] = patch_results
+        report = gate(result["patches"])
+        result["patch_results"] = report.pop("patch_results")
+        result["gate"] = report
     
     # Save improvement report
     report_file = f"data/system_improvements/{int(time.time())}_improvement.json"
@@ -180,21 +156,36 @@ def analyze_and_improve(trigger_reason="scheduled"):
     
     return result
 
-class H(BaseHTTPRequestHandler):
-    def do_POST(self):
-        if self.path != "/_py/improve":
-            self.send_response(404); self.end_headers(); return
-            
-        l = int(self.headers.get("Content-Length", 0))
-        data = json.loads(self.rfile.read(l).decode("utf-8") or "{}")
-        
+class H(JSONHandler):
+    post_routes = {"/_py/improve": "handle_improve", "/_py/failures/screen": "handle_screen",
+                   "/_py/failures/learn": "handle_learn", "/_py/metrics/loop": "handle_metrics_loop"}
+    get_routes = {"/_py/failures/summary": "handle_summary", "/_py/metrics": "handle_metrics"}
+
+    def handle_improve(self, data):
         trigger = data.get("trigger", "scheduled")
-        result = analyze_and_improve(trigger)
-        
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps(result).encode("utf-8"))
+        with _improve_lock:
+            result = analyze_and_improve(trigger)
+        self.send_json(result)
+
+    def handle_screen(self, data):
+        """should_skip for every step of a plan in one request"""
+        results = failure_db.should_skip_many(data.get("steps") or [])
+        self.send_json({"results": [{"skip": skip, "reason": reason} for skip, reason in results]})
+
+    def handle_learn(self, data):
+        """Record a loop's failed steps with one journal append"""
+        self.send_json({"learned": failure_db.learn_failures(data.get("failures") or [])})
+
+    def handle_summary(self, data):
+        self.send_json({"summary": failure_db.get_failure_summary()})
+
+    def handle_metrics_loop(self, data):
+        """One event per finished loop from server_v2.js"""
+        system_metrics.record_loop(data)
+        self.send_json({"status": "ok"})
+
+    def handle_metrics(self, data):
+        self.send_json(get_system_metrics())
 
 if __name__ == "__main__":
-    HTTPServer(("0.0.0.0", PORT), H).serve_forever()
\ No newline at end of file
+    serve(H, PORT)
\ No newline at end of file
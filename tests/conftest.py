@@ -0,0 +1,23 @@
+# conftest.py - Shared fixtures; tests import the top-level modules from the repo root
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Several modules create a global instance under data/ at import; keep it out of the tree
+os.chdir(tempfile.mkdtemp(prefix="tests_"))
+
+import pytest
+
+POLICY_FILE = os.path.join(ROOT, "exec_policy.json")
+
+
+@pytest.fixture
+def step_cache(tmp_path, monkeypatch):
+    """A fresh step cache in tmp_path, used by the executor too"""
+    import executor
+    from step_cache import StepCache
+    cache = StepCache(path=str(tmp_path / "data" / "step_cache.json"))
+    monkeypatch.setattr(executor, "step_cache", cache)
+    return cache
@@ -0,0 +1,47 @@
+import time
+import reviewer
+from verdict_cache import VerdictCache, step_key
+from json_stream import ArrayItemStream
+from metadata_index import MetadataIndex
+
+
+def test_verdict_key_ignores_title_and_whitespace():
+    assert step_key({"bash": "ls  \n", "title": "a"}) == step_key({"bash": "ls", "title": "b"})
+    assert step_key({"bash": "ls"}) != step_key({"bash": "ls", "allow_net": True})
+
+
+def test_verdicts_expire_and_drop_with_the_generation(tmp_path):
+    path = str(tmp_path / "review_cache.json")
+    cache = VerdictCache(path, policy_path=str(tmp_path / "policy.json"), ttl=60)
+    steps = [{"bash": "ls"}, {"bash": "cat x"}]
+    generation = cache.generation("prompt", "model")
+    cache.put_many([(steps[0], {"bash": "ls"}, None)], generation)
+    assert [bool(e) for e in VerdictCache(path, ttl=60).get_many(steps, generation)] == [True, False]
+    assert cache.get_many(steps, cache.generation("other prompt", "model")) == [None, None]
+    cache.put_many([(steps[0], {"bash": "ls"}, None)], generation)
+    cache._entries[step_key(steps[0])]["ts"] = time.time() - 120
+    assert cache.get_many(steps, generation) == [None, None]
+
+
+def test_plan_fields_do_not_leak_into_cached_verdicts():
+    cached = {"title": "y", "bash": "ls"}
+    first = reviewer._with_plan_fields(0, cached, [{"id": "s2", "depends_on": ["s1"], "bash": "ls"}])
+    assert first["depends_on"] == ["s1"] and cached == {"title": "y", "bash": "ls"}
+    assert "id" not in reviewer._with_plan_fields(0, dict(first), [{"title": "y2", "bash": "ls"}])
+
+
+def test_array_items_stream_across_chunks():
+    text = '```json\n{"spec_md": "a {b} [c]", "steps": [{"bash": "echo \\"}\\""}, {"n": [1, {"x": 2}]}], "z": 1}\n```'
+    stream = ArrayItemStream("steps")
+    items = [item for i in range(0, len(text), 3) for item in stream.feed(text[i:i + 3])]
+    assert items == [{"bash": 'echo "}"'}, {"n": [1, {"x": 2}]}]
+
+
+def test_last_loops_ignores_removed_loops():
+    meta = MetadataIndex()
+    meta.add(0, [{"loop_id": 1}, {"loop_id": 2}, {"loop_id": 3}, {"loop_id": 3}])
+    meta.remove(2)
+    assert list(meta.select(last_loops=1)) == [2, 3]
+    meta.remove(3)  # loop 3 is gone; its dead rows are filtered by the caller
+    assert list(meta.select(last_loops=1)) == [1, 2, 3]
+    assert list(meta.select(last_loops=2)) == [0, 1, 2, 3]
@@ -0,0 +1,79 @@
+import time
+import executor
+from conftest import POLICY_FILE
+
+
+def step(sid, bash, depends_on=(), **fields):
+    return dict({"id": sid, "title": sid, "bash": bash, "depends_on": list(depends_on)}, **fields)
+
+
+def run(steps, tmp_path, **kwargs):
+    return {r["id"]: r for r in executor.execute(steps, policy_path=POLICY_FILE, cwd=str(tmp_path), **kwargs)["steps"]}
+
+
+def test_dependencies_run_in_order(tmp_path, step_cache):
+    results = run([step("a", "sleep 0.2; echo a > a.txt"), step("b", "cat a.txt", ["a"])], tmp_path)
+    assert results["b"]["stdout"] == "a\n"
+
+
+def test_independent_steps_overlap(tmp_path, step_cache):
+    start = time.perf_counter()
+    results = run([step(f"s{i}", "sleep 0.3") for i in range(4)], tmp_path, workers=4)
+    assert all(r["status"] == "success" for r in results.values())
+    assert time.perf_counter() - start < 1.0
+
+
+def test_missing_depends_on_follows_the_previous_step(tmp_path, step_cache):
+    steps = [step("a", "sleep 0.2; echo 1 > f"), {"id": "b", "title": "b", "bash": "cat f"}]
+    assert run(steps, tmp_path)["b"]["stdout"] == "1\n"
+
+
+def test_failure_blocks_dependents_only(tmp_path, step_cache):
+    results = run([step("a", "cat missing.txt"), step("b", "echo b", ["a"]), step("c", "echo c")], tmp_path)
+    assert results["a"]["status"] == "failed"
+    assert results["b"]["status"] == "blocked" and "a" in results["b"]["stderr"]
+    assert results["c"]["status"] == "success"
+
+
+def test_unknown_dependency_and_cycle_are_blocked(tmp_path, step_cache):
+    results = run([step("a", "echo a", ["nope"]), step("b", "echo b", ["c"]), step("c", "echo c", ["b"])], tmp_path)
+    assert {r["status"] for r in results.values()} == {"blocked"}
+
+
+def test_policy_denies(tmp_path, step_cache):
+    results = run([step("a", "rm -rf x"), step("b", "curl http://example.com")], tmp_path)
+    assert results["a"]["status"] == results["b"]["status"] == "denied"
+
+
+def test_timeout_kills_the_step(tmp_path, step_cache):
+    result = run([step("a", "sleep 5", timeout_sec=1)], tmp_path)["a"]
+    assert result["status"] == "timeout" and result["duration_ms"] < 4000
+
+
+def test_malformed_timeout_falls_back_to_the_default(tmp_path, step_cache):
+    assert executor.step_timeout({"timeout_sec": "60s"}) == executor.DEFAULT_TIMEOUT_SEC
+    assert executor.step_timeout({"timeout_sec": "1.5"}) == 1.5
+    assert executor.step_timeout({"timeout_sec": -1}) == executor.DEFAULT_TIMEOUT_SEC
+    assert executor.step_timeout({"timeout_sec": 10 ** 6}) == executor.MAX_TIMEOUT_SEC
+    assert run([step("a", "echo ok", timeout_sec="60s")], tmp_path)["a"]["status"] == "success"
+
+
+def test_one_broken_step_keeps_the_others(tmp_path, step_cache, monkeypatch):
+    real = executor.run_step
+
+    def run_step(index, step, *args):
+        if step["id"] == "bad":
+            raise RuntimeError("boom")
+        return real(index, step, *args)
+    monkeypatch.setattr(executor, "run_step", run_step)
+    results = run([step("bad", "echo x"), step("good", "echo y")], tmp_path)
+    assert results["bad"]["status"] == "failed" and "boom" in results["bad"]["stderr"]
+    assert results["good"]["stdout"] == "y\n"
+
+
+def test_large_output_is_capped_and_spilled(tmp_path, step_cache):
+    bash = "python3 -c \"print('x' * 100000)\""
+    result = run([step("a", bash)], tmp_path, spill_prefix=str(tmp_path / "spill_"))["a"]
+    assert len(result["stdout"]) < 20000 and result["output_bytes"]["stdout"] == 100001
+    with open(result["artifacts"]["stdout"]) as f:
+        assert f.read() == "x" * 100000 + "\n"
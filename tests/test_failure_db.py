@@ -0,0 +1,48 @@
+import os
+import json
+from failure_db import FailureDB
+
+
+def failure(i, stderr="exit 1"):
+    return {"bash": f"tool{i} --flag data/file.txt", "stderr": stderr, "title": f"step {i}"}
+
+
+def test_journal_replays_without_a_snapshot(tmp_path):
+    path = str(tmp_path / "failures.json")
+    db = FailureDB(path, snapshot_every=10 ** 9)
+    db.learn_failures([failure(1), failure(1), failure(2)])
+    assert not os.path.exists(path)
+    reopened = FailureDB(path)
+    assert reopened.patterns == db.patterns and reopened.seq == 3
+
+
+def test_snapshot_plus_newer_journal_events(tmp_path):
+    path = str(tmp_path / "failures.json")
+    db = FailureDB(path, snapshot_every=2)
+    db.learn_failures([failure(1), failure(1)])  # snapshot at seq 2, journal emptied
+    db.learn_failures([failure(1)])
+    reopened = FailureDB(path)
+    assert reopened.seq == 3 and reopened.should_skip("tool1 --flag data/file.txt")[0]
+
+
+def test_torn_journal_tail_is_dropped(tmp_path):
+    path = str(tmp_path / "failures.json")
+    db = FailureDB(path, snapshot_every=10 ** 9)
+    db.learn_failures([failure(1)])
+    with open(db.journal_path, 'a') as f:
+        f.write('{"seq": 2, "pattern"')
+    reopened = FailureDB(path)
+    assert reopened.seq == 1
+    reopened.learn_failures([failure(2)])
+    again = FailureDB(path)
+    assert again.seq == 2 and len(again.patterns) == 2
+
+
+def test_processes_see_each_others_writes(tmp_path):
+    path = str(tmp_path / "failures.json")
+    a, b = FailureDB(path, snapshot_every=10 ** 9), FailureDB(path, snapshot_every=10 ** 9)
+    a.learn_failures([failure(1), failure(1)])
+    b.learn_failures([failure(1)])  # catches up under the lock before appending
+    assert b.patterns[b.match_pattern("tool1 --flag data/file.txt")]["count"] == 3
+    assert a.should_skip("tool1 --flag data/file.txt")[0]
+    assert [e["seq"] for e in map(json.loads, open(a.journal_path))] == [1, 2, 3]
@@ -0,0 +1,117 @@
+import os
+import pytest
+import executor
+from step_cache import read_paths, StepCache
+from conftest import POLICY_FILE
+
+READ_ONLY = {"category": "read_only"}
+
+
+def step(bash, category="read_only", **fields):
+    return dict({"title": bash, "bash": bash, "risk": {"category": category}, "depends_on": []}, **fields)
+
+
+def run(steps, cwd):
+    return executor.execute(steps, policy_path=POLICY_FILE, cwd=str(cwd))["steps"]
+
+
+@pytest.mark.parametrize("bash", [
+    "cat a.txt", "ls", "ls -la src", "grep -rn TODO .", "find . -name '*.py' | wc -l",
+    "head -5 a.txt && tail -5 a.txt", "cat a.txt 2>/dev/null || ls",
+])
+def test_read_only_commands_are_cacheable(bash):
+    assert read_paths(bash) is not None
+
+
+@pytest.mark.parametrize("bash", [
+    "cat a.txt > b.txt", "rm a.txt", "cat $HOME/a.txt", "cat `ls`", "cat $(ls)", "cat {a,b}.txt",
+    "cat ~/a.txt", "grep --file=~/p a.txt", "find . -delete", "find . -exec cat {} ;", "ls; rm a.txt",
+    "cat a.txt\nrm a.txt", "echo hi", "ls &",
+])
+def test_anything_else_is_not(bash):
+    assert read_paths(bash) is None
+
+
+def test_recursive_and_detailed_flags():
+    assert read_paths("ls") == (["."], False, False)
+    assert read_paths("grep -r x") == (["x", "."], True, False)
+    assert read_paths("ls -l src")[2] and read_paths("ls -t")[2] and read_paths("du -sh .")[2]
+    assert not read_paths("find . -name x")[2] and read_paths("find . -newer x")[2]
+
+
+def test_step_must_be_reviewed_read_only(tmp_path):
+    (tmp_path / "a.txt").write_text("one")
+    cache = StepCache(path=str(tmp_path / "cache.json"))
+    assert cache.key(step("cat a.txt"), str(tmp_path))
+    assert cache.key(step("cat a.txt", category="file_write"), str(tmp_path)) is None
+    assert cache.key({"bash": "cat a.txt", "risk": "read_only"}, str(tmp_path)) is None
+    assert StepCache(path=str(tmp_path / "c.json"), enabled=False).key(step("cat a.txt"), str(tmp_path)) is None
+
+
+def test_hit_until_the_file_changes(tmp_path, step_cache):
+    (tmp_path / "a.txt").write_text("one\n")
+    steps = [step("cat a.txt")]
+    first, second = run(steps, tmp_path)[0], run(steps, tmp_path)[0]
+    assert not first.get("cached") and second["cached"] and second["stdout"] == "one\n"
+    (tmp_path / "a.txt").write_text("two\n")
+    third = run(steps, tmp_path)[0]
+    assert not third.get("cached") and third["stdout"] == "two\n"
+
+
+def test_brace_expansion_is_never_served_stale(tmp_path, step_cache):
+    (tmp_path / "a.txt").write_text("one\n")
+    (tmp_path / "b.txt").write_text("b\n")
+    steps = [step("cat {a,b}.txt")]
+    run(steps, tmp_path)
+    (tmp_path / "a.txt").write_text("two\n")
+    result = run(steps, tmp_path)[0]
+    assert not result.get("cached") and result["stdout"] == "two\nb\n"
+
+
+def test_listing_hits_despite_the_cache_file(tmp_path, step_cache):
+    # The cache lives in tmp_path/data, inside the listed and walked tree
+    (tmp_path / "art").mkdir()
+    (tmp_path / "art" / "x").write_text("x")
+    steps = [step("ls"), step("find ."), step("ls art")]
+    run(steps, tmp_path)
+    run(steps, tmp_path)  # data/ appeared after the first run
+    assert all(r.get("cached") for r in run(steps, tmp_path))
+    (tmp_path / "art" / "y").write_text("y")
+    cached = {r["bash"]: bool(r.get("cached")) for r in run(steps, tmp_path)}
+    assert cached == {"ls": True, "find .": False, "ls art": False}
+
+
+def test_missing_file_is_cached_until_created(tmp_path, step_cache):
+    steps = [step("cat new.txt")]
+    run(steps, tmp_path)
+    assert run(steps, tmp_path)[0]["cached"]
+    (tmp_path / "new.txt").write_text("now\n")
+    result = run(steps, tmp_path)[0]
+    assert result["status"] == "success" and not result.get("cached")
+
+
+def test_unreadable_directory_is_uncacheable_not_fatal(tmp_path, step_cache, monkeypatch):
+    (tmp_path / "d").mkdir()
+    (tmp_path / "a.txt").write_text("a\n")
+
+    def denied(path):
+        raise PermissionError(13, "Permission denied", path)
+    monkeypatch.setattr(os, "scandir", denied)
+    assert step_cache.key(step("ls d"), str(tmp_path)) is None
+    results = run([step("ls d"), step("cat a.txt")], tmp_path)
+    assert [r["status"] for r in results] == ["success", "success"]
+
+
+def test_cache_persists_and_stays_bounded(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = StepCache(path=path, max_entries=2)
+    result = {"stdout": "x", "stderr": "", "exit_code": 0, "duration_ms": 1.0}
+    for key in ("a", "b", "c"):
+        cache.put(key, result, 0)
+    cache.save()
+    reopened = StepCache(path=path, max_entries=2)
+    assert reopened.get("a") is None and reopened.get("c")["stdout"] == "x"
+    small = StepCache(path=str(tmp_path / "small.json"), max_bytes=500)
+    for key in ("a", "b", "c"):
+        small.put(key, dict(result, stdout="x" * 200), 0)
+    assert small.stats()["entries"] == 1 and small.stats()["bytes"] <= 500
@@ -0,0 +1,60 @@
+import os
+import numpy as np
+from vector_store import VectorStore
+
+
+def filled(path, n=3, dim=4):
+    store = VectorStore(str(path))
+    store.add_many([{"id": f"m{i}", "text": f"t{i}"} for i in range(n)], np.eye(n, dim) + 1)
+    return store
+
+
+def sizes(path):
+    return os.path.getsize(path / "vectors.0.f32"), os.path.getsize(path / "meta.0.jsonl")
+
+
+def tear(path):
+    """A crash between writing a vector and its sidecar line, and mid-way through the line"""
+    with open(path / "vectors.0.f32", 'ab') as f:
+        f.write(b"\0" * 16)
+    with open(path / "meta.0.jsonl", 'a') as f:
+        f.write('{"row": 3, "id')
+
+
+def test_reopen_repairs_a_torn_tail(tmp_path):
+    filled(tmp_path, dim=4)
+    clean = sizes(tmp_path)
+    tear(tmp_path)
+    store = VectorStore(str(tmp_path))
+    assert len(store) == 3 and sizes(tmp_path) == clean
+    store.add("m3", "t3", [1, 2, 3, 4])
+    assert VectorStore(str(tmp_path)).get("m3")["embedding"] == [1, 2, 3, 4]
+
+
+def test_read_only_open_leaves_the_files_alone(tmp_path):
+    filled(tmp_path)
+    tear(tmp_path)
+    torn = sizes(tmp_path)
+    assert len(VectorStore(str(tmp_path), read_only=True)) == 3
+    assert sizes(tmp_path) == torn
+    assert not os.path.exists(VectorStore(str(tmp_path / "none"), read_only=True).path)
+
+
+def test_delete_and_replace_survive_reopen(tmp_path):
+    store = filled(tmp_path)
+    store.delete(["m0"])
+    store.add("m1", "new", [9, 9, 9, 9])
+    reopened = VectorStore(str(tmp_path))
+    assert sorted(reopened.row_of) == ["m1", "m2"]
+    assert reopened.get("m1")["text"] == "new" and reopened.dead_rows == 2
+
+
+def test_compaction_keeps_live_rows(tmp_path):
+    store = filled(tmp_path, n=6)
+    store.delete(["m0", "m2", "m4"])
+    expected = {doc_id: store.get(doc_id)["embedding"] for doc_id in store.row_of}
+    store.compact()
+    assert store.generation == 1 and store.dead_rows == 0
+    assert not os.path.exists(tmp_path / "vectors.0.f32")
+    reopened = VectorStore(str(tmp_path))
+    assert {doc_id: reopened.get(doc_id)["embedding"] for doc_id in reopened.row_of} == expected
@@ -0,0 +1,212 @@
+# vector_index.py - Resident embedding index for the memory service
+import numpy as np
+from metadata_index import MetadataIndex
+from quantize import VectorCodec
+
+
+class VectorIndex:
+    """All embeddings as one pre-normalized matrix plus a parallel id/text table.
+
+    Rows are append-only; replacing or removing an id tombstones its old row,
+    and dead rows are dropped by compact() once they make up half the matrix.
+    An optional `ann` (see ann_index.IVFIndex) narrows searches to candidate rows.
+
+    Rows are held in `codec` form (float32, float16 or int8, see quantize.py),
+    optionally after a dimensionality-reducing `projection`; the norm of each
+    decoded row is kept so scores stay cosine similarities.
+
+    Each row also carries metadata (kind, loop id, ts, source) in `meta`, so
+    searches can be restricted to a filtered subset before scoring.
+    """
+
+    def __init__(self, dim=None, capacity=1024, ann=None, codec=None, projection=None):
+        self.dim = dim
+        self.ann = ann
+        self.codec = codec or VectorCodec("float32")
+        self.projection = projection
+        self._capacity = capacity
+        self._matrix = None
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._n = 0
+        self.ids = []
+        self.texts = []
+        self.row_of = {}
+        self.meta = MetadataIndex(capacity)
+
+    def __len__(self):
+        return len(self.row_of)
+
+    @staticmethod
+    def normalize(vectors):
+        """Return float32 copies of the vectors scaled to unit length"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    @property
+    def code_dim(self):
+        return self.projection.dim_out if self.projection is not None else self.dim
+
+    def _project(self, vectors):
+        """Unit-length inputs -> unit-length vectors in the (possibly projected) search space"""
+        if self.projection is None:
+            return vectors
+        return self.normalize(self.projection(vectors))
+
+    def _decoded(self, rows):
+        return self.codec.decode(self._matrix[rows])
+
+    def _reserve(self, rows):
+        if self._matrix is not None and self._n + rows <= len(self._matrix):
+            return
+        capacity = max(self._capacity, 2 * (self._n + rows))
+        matrix = self.codec.empty(capacity, self.code_dim)
+        norms = np.ones(capacity, dtype=np.float32)
+        alive = np.zeros(capacity, dtype=bool)
+        if self._matrix is not None:
+            matrix[:self._n] = self._matrix[:self._n]
+            norms[:self._n] = self._norms[:self._n]
+            alive[:self._n] = self._alive[:self._n]
+        self._matrix, self._norms, self._alive = matrix, norms, alive
+
+    def nbytes(self):
+        """Resident bytes of the vector matrix (excluding ids and texts)"""
+        if self._matrix is None:
+            return 0
+        return self._matrix.nbytes + self._norms.nbytes
+
+    def add(self, doc_id, text, embedding, meta=None):
+        """Insert or replace a single entry"""
+        self.add_many([doc_id], [text], [embedding], [meta or {}])
+
+    def add_many(self, ids, texts, embeddings, metas=None):
+        """Insert or replace a batch of entries with one matrix write"""
+        if not ids:
+            return
+        vectors = self.normalize(embeddings)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding has {vectors.shape[1]} dims, index expects {self.dim}")
+
+        vectors = self._project(vectors)
+        codes = self.codec.encode(vectors)
+        norms = np.linalg.norm(self.codec.decode(codes), axis=1)
+        norms[norms == 0] = 1.0
+
+        self._reserve(len(ids))
+        start = self._n
+        self._matrix[start:start + len(ids)] = codes
+        self._norms[start:start + len(ids)] = norms
+        self._alive[start:start + len(ids)] = True
+        for offset, (doc_id, text) in enumerate(zip(ids, texts)):
+            self.remove(doc_id)
+            self.ids.append(doc_id)
+            self.texts.append(text)
+            self.row_of[doc_id] = start + offset
+        self.meta.add(start, metas or [{}] * len(ids))
+        for row in np.flatnonzero(~self._alive[start:start + len(ids)]):
+            self.meta.remove(start + row)  # an id repeated within the batch
+        self._n += len(ids)
+
+        if self.ann is not None:
+            if self.ann.needs_training(len(self.row_of)):
+                self.train_ann()
+            elif self.ann.trained:
+                self.ann.add(np.arange(start, self._n), vectors)
+
+        if self._n > 64 and len(self.row_of) < self._n // 2:
+            self.compact()
+
+    def remove(self, doc_id):
+        row = self.row_of.pop(doc_id, None)
+        if row is not None:
+            self._alive[row] = False
+            self.meta.remove(row)
+        return row is not None
+
+    def live_rows(self):
+        return np.flatnonzero(self._alive[:self._n])
+
+    def train_ann(self):
+        """(Re)train the ANN quantizer on the live vectors and assign every live row"""
+        live = self.live_rows()
+        vectors = self._decoded(live)
+        self.ann.train(vectors)
+        self.ann.add(live, vectors)
+
+    def attach_ann(self, ann, labels=None):
+        """Attach an ANN index, reusing saved list ids (-1 = unknown) for existing rows"""
+        self.ann = ann
+        live = self.live_rows()
+        if not ann.trained:
+            if ann.needs_training(len(live)):
+                self.train_ann()
+            return
+        if labels is None:
+            labels = np.full(self._n, -1, dtype=np.int32)
+        known = live[labels[live] >= 0]
+        unknown = live[labels[live] < 0]
+        ann.add(known, labels=labels[known])
+        if len(unknown):
+            ann.add(unknown, self._decoded(unknown))
+
+    def compact(self):
+        """Drop tombstoned rows so scans only touch live vectors"""
+        live = self.live_rows()
+        if self.ann is not None and self.ann.trained:
+            new_of_old = np.full(self._n, -1, dtype=np.int64)
+            new_of_old[live] = np.arange(len(live))
+            self.ann.remap(new_of_old)
+        self._matrix = self._matrix[live].copy() if len(live) else None
+        self._norms = self._norms[live].copy()
+        self._alive = np.ones(len(live), dtype=bool)
+        self.ids = [self.ids[r] for r in live]
+        self.texts = [self.texts[r] for r in live]
+        self.row_of = {doc_id: r for r, doc_id in enumerate(self.ids)}
+        self.meta.compact(live)
+        self._n = len(live)
+
+    def search(self, query_embedding, top_k=3, exact=False, nprobe=None, rerank=None, rerank_k=0, where=None):
+        """Return [(score, id, text)] for the top_k most similar live entries.
+
+        `where` holds MetadataIndex.select() conditions; only matching rows
+        are scored, exactly. Otherwise the ANN index is used when one is
+        trained, unless exact=True. With
+        `rerank` (ids -> full-precision embeddings) the best max(top_k,
+        rerank_k) candidates are re-scored against those embeddings.
+        """
+        if not self.row_of or top_k <= 0:
+            return []
+        query = self.normalize(query_embedding)
+        if query.shape[-1] != self.dim:
+            return []
+        projected = self._project(query)
+
+        if where:
+            rows = self.meta.select(**where)
+            rows = rows[self._alive[rows]]
+            scores = self.codec.dot(self._matrix[rows], projected) / self._norms[rows]
+        elif self.ann is not None and self.ann.trained and not exact:
+            rows = self.ann.probe(projected, nprobe)
+            rows = rows[self._alive[rows]]
+            scores = self.codec.dot(self._matrix[rows], projected) / self._norms[rows]
+        else:
+            rows = np.arange(self._n)
+            scores = self.codec.dot(self._matrix[:self._n], projected) / self._norms[:self._n]
+            scores[~self._alive[:self._n]] = -np.inf
+
+        candidates = max(top_k, rerank_k) if rerank is not None else top_k
+        k = min(candidates, len(rows), len(self.row_of))
+        if k == 0:
+            return []
+        top = np.argpartition(scores, -k)[-k:] if k < len(rows) else np.arange(len(rows))
+        hits = [(float(scores[i]), rows[i]) for i in top]
+
+        if rerank is not None:
+            exact_vectors = self.normalize(rerank([self.ids[row] for _, row in hits]))
+            hits = [(float(score), row) for score, (_, row) in zip(exact_vectors @ query, hits)]
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return [(score, self.ids[row], self.texts[row]) for score, row in hits[:top_k]]
@@ -0,0 +1,253 @@
+# vector_store.py - Append-only, memory-mapped storage for memory embeddings
+#
+# Layout of a store directory:
+#   store.json            {"dim", "dtype", "generation"} - replaced atomically
+#   vectors.<gen>.f32     raw rows in the store's codec (float32 by default), one per add
+#   meta.<gen>.jsonl      sidecar: {"row", "id", "text", ...} per add, {"del": id} per delete
+import os
+import sys
+import json
+import numpy as np
+from quantize import VectorCodec
+
+
+class VectorStore:
+    """read_only inspects a store another process writes: a torn tail is skipped, not truncated"""
+
+    def __init__(self, path="data/memory_store", dim=None, codec="float32", read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self.dim = dim
+        self.codec = VectorCodec(codec)
+        self.generation = 0
+        self.entries = []      # per row: {"id", "text", ...extra}
+        self.row_of = {}       # id -> live row
+        self._alive = []
+        self._map = None
+        self._open()
+
+    # --- Files ---
+
+    def _header_file(self):
+        return os.path.join(self.path, "store.json")
+
+    def _vectors_file(self, generation=None):
+        return os.path.join(self.path, f"vectors.{self.generation if generation is None else generation}.f32")
+
+    def _meta_file(self, generation=None):
+        return os.path.join(self.path, f"meta.{self.generation if generation is None else generation}.jsonl")
+
+    def _write_header(self):
+        tmp = self._header_file() + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump({"dim": self.dim, "dtype": self.codec.kind, "generation": self.generation}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._header_file())
+
+    def _open(self):
+        if not self.read_only:
+            os.makedirs(self.path, exist_ok=True)
+        if os.path.exists(self._header_file()):
+            with open(self._header_file(), 'r') as f:
+                header = json.load(f)
+            self.dim = header.get("dim") or self.dim
+            self.generation = header.get("generation", 0)
+            # An existing store keeps its codec; convert with `vector_store.py recode`
+            self.codec = VectorCodec(header.get("dtype", "float32"))
+
+        if os.path.exists(self._meta_file()):
+            good_bytes = 0
+            with open(self._meta_file(), 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # torn tail from a crash mid-append
+                    self._apply(record)
+                    good_bytes += len(line)
+            if good_bytes < os.path.getsize(self._meta_file()) and not self.read_only:
+                with open(self._meta_file(), 'r+b') as f:
+                    f.truncate(good_bytes)
+
+        # Vectors are written before their sidecar line, so drop any rows the
+        # sidecar never acknowledged.
+        if self.dim and os.path.exists(self._vectors_file()) and not self.read_only:
+            expected = len(self.entries) * self.codec.bytes_per_vector(self.dim)
+            if os.path.getsize(self._vectors_file()) > expected:
+                with open(self._vectors_file(), 'r+b') as f:
+                    f.truncate(expected)
+
+    def _apply(self, record):
+        if "del" in record:
+            row = self.row_of.pop(record["del"], None)
+            if row is not None:
+                self._alive[row] = False
+            return
+        row = record.pop("row")
+        if row != len(self.entries):
+            return
+        old = self.row_of.get(record["id"])
+        if old is not None:
+            self._alive[old] = False
+        self.entries.append(record)
+        self._alive.append(True)
+        self.row_of[record["id"]] = row
+
+    # --- Reads ---
+
+    def __len__(self):
+        return len(self.row_of)
+
+    @property
+    def dead_rows(self):
+        return len(self.entries) - len(self.row_of)
+
+    def vectors(self):
+        """Memory-mapped view of every row, live or dead, in the store's codec"""
+        rows = len(self.entries)
+        if rows == 0:
+            return self.codec.empty(0, self.dim or 0)
+        if self._map is None or len(self._map) != rows:
+            self._map = np.memmap(self._vectors_file(), dtype=self.codec.dtype(self.dim), mode='r',
+                                  shape=self.codec.shape(rows, self.dim))
+        return self._map
+
+    def read(self, rows):
+        """Decoded float32 vectors for the given rows"""
+        return self.codec.decode(self.vectors()[rows])
+
+    def live_rows(self):
+        return np.flatnonzero(np.asarray(self._alive, dtype=bool))
+
+    def live_entries(self):
+        """(row, entry) for every live id, in insertion order"""
+        return [(row, self.entries[row]) for row in self.live_rows()]
+
+    def get(self, doc_id):
+        row = self.row_of.get(doc_id)
+        if row is None:
+            return None
+        return dict(self.entries[row], embedding=self.read([row])[0].tolist())
+
+    # --- Writes ---
+
+    def add(self, doc_id, text, embedding, **extra):
+        """Append one entry; replaces any previous entry with the same id"""
+        self.add_many([dict(extra, id=doc_id, text=text)], [embedding])
+
+    def add_many(self, docs, embeddings):
+        """Append a batch of {"id", "text", ...} docs with one write per file"""
+        if not docs:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(docs):
+            raise ValueError("Expected one embedding per document")
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._write_header()
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding has {vectors.shape[1]} dims, store expects {self.dim}")
+
+        records = []
+        for offset, doc in enumerate(docs):
+            records.append(dict(doc, row=len(self.entries) + offset))
+        with open(self._vectors_file(), 'ab') as f:
+            f.write(self.codec.encode(vectors).tobytes())
+        with open(self._meta_file(), 'a') as f:
+            f.write("".join(json.dumps(r) + "\n" for r in records))
+        for record in records:
+            self._apply(record)
+
+    def delete(self, ids):
+        """Tombstone ids; their rows are reclaimed by the next compaction"""
+        ids = [doc_id for doc_id in ids if doc_id in self.row_of]
+        if not ids:
+            return 0
+        with open(self._meta_file(), 'a') as f:
+            f.write("".join(json.dumps({"del": doc_id}) + "\n" for doc_id in ids))
+        for doc_id in ids:
+            self._apply({"del": doc_id})
+        return len(ids)
+
+    def maybe_compact(self, min_dead=256, ratio=0.5):
+        """Compact once dead rows exceed both min_dead and ratio of all rows"""
+        if self.dead_rows >= min_dead and self.dead_rows >= ratio * len(self.entries):
+            self.compact()
+            return True
+        return False
+
+    def compact(self, codec=None):
+        """Rewrite live rows into a new generation and switch to it atomically.
+
+        Passing `codec` re-encodes the rows into that representation.
+        """
+        new_codec = VectorCodec(codec) if codec else self.codec
+        live = self.live_rows()
+        old_generation = self.generation
+        new_generation = old_generation + 1
+        vectors = self.vectors()
+
+        with open(self._vectors_file(new_generation), 'wb') as f:
+            for start in range(0, len(live), 4096):
+                chunk = vectors[live[start:start + 4096]]
+                if new_codec.kind != self.codec.kind:
+                    chunk = new_codec.encode(self.codec.decode(chunk))
+                f.write(np.ascontiguousarray(chunk).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        entries = [self.entries[row] for row in live]
+        with open(self._meta_file(new_generation), 'w') as f:
+            for row, entry in enumerate(entries):
+                f.write(json.dumps(dict(entry, row=row)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._map = None
+        self.codec = new_codec
+        self.generation = new_generation
+        self._write_header()
+        self.entries = entries
+        self._alive = [True] * len(entries)
+        self.row_of = {entry["id"]: row for row, entry in enumerate(entries)}
+        for stale in (self._vectors_file(old_generation), self._meta_file(old_generation)):
+            if os.path.exists(stale):
+                os.remove(stale)
+
+    # --- Migration ---
+
+    def migrate_json(self, *json_files):
+        """One-shot import of legacy JSON memory files into an empty store"""
+        was_empty = len(self.entries) == 0
+        imported = 0
+        for json_file in json_files:
+            if not os.path.exists(json_file):
+                continue
+            if was_empty:
+                try:
+                    with open(json_file, 'r') as f:
+                        legacy = json.load(f)
+                except json.JSONDecodeError:
+                    legacy = []
+                legacy = [e for e in legacy if e.get("id") and e.get("embedding")]
+                docs = [{k: v for k, v in e.items() if k != "embedding"} for e in legacy]
+                self.add_many(docs, [e["embedding"] for e in legacy])
+                imported += len(docs)
+            os.replace(json_file, json_file + ".migrated")
+        return imported
+
+
+if __name__ == "__main__":
+    # Usage: python3 vector_store.py migrate|compact [store_dir] [json files...]
+    #        python3 vector_store.py recode [store_dir] float32|float16|int8
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    store = VectorStore(sys.argv[2] if len(sys.argv) > 2 else "data/memory_store")
+    if command == "migrate":
+        files = sys.argv[3:] or ["data/memory_vectors.json", "data/compressed_lessons.json"]
+        print(f"Migrated {store.migrate_json(*files)} entries into {store.path}")
+    elif command == "compact":
+        store.compact()
+        print(f"Compacted {store.path}: {len(store)} live entries")
+    elif command == "recode":
+        store.compact(codec=sys.argv[3])
+        print(f"Re-encoded {store.path} as {store.codec.kind}: {len(store)} live entries")
@@ -0,0 +1,119 @@
+# verdict_cache.py - Reviewer verdicts per step, reused while the prompt and policy are unchanged
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def step_key(step):
+    """What the verdict depends on: the command, where it runs, network access and timeout (not the title)"""
+    normalized = {
+        "bash": "\n".join(line.rstrip() for line in str(step.get("bash", "")).strip().splitlines()),
+        "cwd": (str(step.get("cwd") or "/app").rstrip("/") or "/"),
+        "allow_net": bool(step.get("allow_net", False)),
+        "timeout_sec": int(step.get("timeout_sec") or 60),
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class VerdictCache:
+    """step_key -> {"approved": step or None, "rejected": entry or None, "ts"}, LRU-bounded, on disk.
+
+    Every entry belongs to a generation: a hash of the reviewer prompt, the
+    model and exec_policy.json. When the generation changes all entries are
+    dropped; entries older than ttl seconds are misses.
+    """
+
+    def __init__(self, path="data/review_cache.json", policy_path="exec_policy.json", ttl=86400, max_entries=2000):
+        self.path = path
+        self.policy_path = policy_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generation = None
+        self._policy = (None, "")  # (mtime_ns, content hash) of the policy file
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    saved = json.load(f)
+                self._generation = saved.get("generation")
+                self._entries.update(saved.get("entries", {}))
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable review cache {path}: {e}")
+
+    def generation(self, system_prompt, model):
+        try:
+            mtime = os.stat(self.policy_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._policy[0]:
+            content = ""
+            if mtime is not None:
+                with open(self.policy_path, 'r') as f:
+                    content = f.read()
+            self._policy = (mtime, hashlib.sha256(content.encode("utf-8")).hexdigest())
+        return hashlib.sha256(f"{system_prompt}\0{model}\0{self._policy[1]}".encode("utf-8")).hexdigest()
+
+    def _use(self, generation):
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+    def get_many(self, steps, generation):
+        """[entry or None] per step"""
+        now = time.time()
+        results = []
+        with self._lock:
+            self._use(generation)
+            for step in steps:
+                key = step_key(step)
+                entry = self._entries.get(key)
+                if entry is not None and now - entry["ts"] > self.ttl:
+                    del self._entries[key]
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                results.append(entry)
+        return results
+
+    def put_many(self, verdicts, generation):
+        """verdicts: [(original step, approved step or None, rejected entry or None)]"""
+        if not verdicts:
+            return
+        now = time.time()
+        with self._lock:
+            self._use(generation)
+            for step, approved, rejected in verdicts:
+                key = step_key(step)
+                self._entries[key] = {"approved": approved, "rejected": rejected, "ts": now}
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(json.dumps({"generation": self._generation, "entries": self._entries}))
+        os.replace(tmp, self.path)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+# Global instance
+verdict_cache = VerdictCache(
+    ttl=float(os.environ.get("REVIEW_CACHE_TTL_SEC", "86400")),
+    max_entries=int(os.environ.get("REVIEW_CACHE_ENTRIES", "2000")),
+)